@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from db import Database
+from metrics import REGISTRY
+
+logger = logging.getLogger("activity")
+
+HOUR = 3600
+DAY = 86400
+
+
+def hour_bucket(when: datetime) -> int:
+    """Unix time of the start of the (UTC) hour containing `when`."""
+    ts = int(when.timestamp())
+    return ts - ts % HOUR
+
+
+class ActivityRecorder:
+    """Pre-aggregates message counts per (guild_id, user_id, hour) in memory.
+
+    record() is a dict increment; the counts are written to the activity rollup table
+    every `interval` seconds and on close(). Once a day, hourly buckets older than
+    `hourly_days` are compacted into daily ones and buckets older than
+    `retention_days` are deleted. Reads merge in the unflushed counts.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        interval: float = 60.0,
+        hourly_days: int = 7,
+        retention_days: int = 365,
+        compact_interval: float = DAY,
+    ) -> None:
+        self.db = db
+        self.interval = interval
+        self.hourly_days = hourly_days
+        self.retention_days = retention_days
+        self.compact_interval = compact_interval
+        self._pending: dict[tuple[int, int, int], int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._last_compact = float("-inf")
+        REGISTRY.gauge("bot_activity_pending_buckets", "Activity buckets not yet written").set_function(
+            lambda: len(self._pending)
+        )
+
+    def start(self) -> None:
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        await self.flush()
+        logger.info("Activity recorder flushed and closed")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_compact >= self.compact_interval:
+                    await self.compact()
+            except Exception:
+                logger.exception("Periodic activity flush failed")
+
+    def record(self, guild_id: int, user_id: int, when: datetime, messages: int = 1) -> None:
+        key = (guild_id, user_id, hour_bucket(when))
+        self._pending[key] = self._pending.get(key, 0) + messages
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                await self.db.add_activity([(g, u, bucket, n) for (g, u, bucket), n in pending.items()])
+            except BaseException:
+                # Put the counts back so the next flush retries them
+                for key, n in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + n
+                raise
+
+    async def compact(self, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        today = int(now) - int(now) % DAY
+        await self.db.compact_activity(today - self.hourly_days * DAY, today - self.retention_days * DAY)
+        self._last_compact = time.monotonic()
+        logger.info("Compacted activity older than %d days", self.hourly_days)
+
+    async def get_activity(self, guild_id: int, days: int, user_id: Optional[int] = None) -> list[tuple[int, int]]:
+        """Return [(day, messages), ...] for the last `days` days (UTC, including today), oldest first.
+
+        Days without messages are included with a count of 0.
+        """
+        now = int(time.time())
+        since = now - now % DAY - (days - 1) * DAY
+        counts = dict.fromkeys(range(since, now + 1, DAY), 0)
+        # Hold the flush lock so counts being written are neither missed nor counted twice
+        async with self._flush_lock:
+            for day, messages in await self.db.get_activity(guild_id, since, user_id):
+                if day in counts:
+                    counts[day] += messages
+            for (g, u, bucket), n in self._pending.items():
+                day = bucket - bucket % DAY
+                if g == guild_id and (user_id is None or u == user_id) and day in counts:
+                    counts[day] += n
+        return list(counts.items())
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Optional
+
+import discord
+
+from metrics import REGISTRY
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("announcer")
+
+MESSAGE_LIMIT = 2000
+
+SENT = REGISTRY.counter("bot_announcements_sent_total", "Announcement messages sent")
+QUEUED = REGISTRY.counter("bot_announcement_lines_total", "Announcement lines queued, before merging")
+DROPPED = REGISTRY.counter("bot_announcement_lines_dropped_total", "Announcement lines summarized away under back-pressure")
+
+
+class _ChannelQueue:
+    __slots__ = ("channel", "lines", "dropped", "bucket", "task")
+
+    def __init__(self, channel: discord.abc.Messageable, rate: float, burst: float) -> None:
+        self.channel = channel
+        self.lines: list[str] = []
+        self.dropped = 0
+        self.bucket = TokenBucket(rate, burst)
+        self.task: Optional[asyncio.Task] = None
+
+
+class Announcer:
+    """Coalescing, rate-limited outbound queue for announcements such as level-ups.
+
+    announce() never waits: lines are queued per channel and a worker task merges
+    whatever arrives within `window` seconds into one message. Each channel is held to
+    `burst` messages per `per` seconds (Discord allows 5 per 5s per channel) and all
+    channels together to `global_rate` per second. Beyond `max_pending` queued lines a
+    channel's extra lines are collapsed into an "and N more" summary.
+    """
+
+    def __init__(
+        self,
+        window: float = 2.0,
+        burst: int = 5,
+        per: float = 5.0,
+        global_rate: float = 40.0,
+        max_pending: int = 25,
+    ) -> None:
+        self.window = window
+        self.burst = burst
+        self.per = per
+        self.max_pending = max_pending
+        self._global = TokenBucket(global_rate, global_rate)
+        self._queues: dict[int, _ChannelQueue] = {}
+        self._closing = False
+        self._closed = asyncio.Event()
+
+    def announce(self, channel: discord.abc.Messageable, line: str) -> None:
+        if self._closing:
+            return
+        QUEUED.inc()
+        key = getattr(channel, "id", id(channel))
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _ChannelQueue(channel, self.burst / self.per, self.burst)
+        if len(queue.lines) >= self.max_pending:
+            queue.dropped += 1
+            DROPPED.inc()
+        else:
+            queue.lines.append(line)
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._drain(key, queue))
+
+    def _take_message(self, queue: _ChannelQueue) -> str:
+        """Pop as many queued lines as fit in one message."""
+        parts: list[str] = []
+        size = 0
+        while queue.lines and size + len(queue.lines[0]) + 1 <= MESSAGE_LIMIT - 40:
+            line = queue.lines.pop(0)
+            parts.append(line)
+            size += len(line) + 1
+        if not parts and queue.lines:
+            parts.append(queue.lines.pop(0)[:MESSAGE_LIMIT])
+        if not queue.lines and queue.dropped:
+            parts.append(f"…and {queue.dropped} more.")
+            queue.dropped = 0
+        return "\n".join(parts)
+
+    async def _drain(self, key: int, queue: _ChannelQueue) -> None:
+        try:
+            while queue.lines or queue.dropped:
+                if not self._closing:
+                    # Let simultaneous announcements pile up so they go out together
+                    try:
+                        await asyncio.wait_for(self._closed.wait(), self.window)
+                    except asyncio.TimeoutError:
+                        pass
+                await queue.bucket.acquire()
+                await self._global.acquire()
+                content = self._take_message(queue)
+                if not content:
+                    continue
+                try:
+                    await queue.channel.send(content)
+                    SENT.inc()
+                except Exception:
+                    logger.exception("Failed to send announcement to %s", getattr(queue.channel, "id", queue.channel))
+        finally:
+            # Keep the queue (and its bucket) while the channel is still rate limited
+            idle = not queue.lines and not queue.dropped
+            if idle and self._queues.get(key) is queue and queue.bucket.retry_after(queue.bucket.capacity) == 0:
+                del self._queues[key]
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Send whatever is queued without waiting for the merge window, then stop."""
+        self._closing = True
+        self._closed.set()
+        tasks = [q.task for q in self._queues.values() if q.task is not None and not q.task.done()]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Dropped announcements for %d channels on shutdown", len(pending))
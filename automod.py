@@ -0,0 +1,306 @@
+import logging
+import re
+import time
+from collections import deque
+from re import _constants as sre, _parser as sre_parse
+from typing import Iterable, Iterator, Optional
+
+from backends.base import AutomodRule
+from cache import MISSING, TTLCache
+from db import Database
+from metrics import REGISTRY
+
+logger = logging.getLogger("automod")
+
+KINDS = ("word", "regex", "link")
+ACTIONS = ("delete", "warn", "escalate")
+MAX_RULES = 1000
+MAX_PATTERN_LENGTH = 200
+# Slowest search a regex rule may take on any probe text, in seconds
+PROBE_BUDGET = 0.05
+# Probe texts grow slowly at first, so an exponential pattern is caught soon after it gets
+# slow, then up to the longest message Discord allows, for polynomial ones
+_PROBE_LENGTHS = [*range(2, 34, 2), *(int(32 * 1.25**i) for i in range(1, 23))]
+
+REBUILDS = REGISTRY.counter("bot_automod_rebuilds_total", "Per-guild automod matchers compiled")
+
+# Host names in a message, with or without a scheme
+_HOST = re.compile(r"(?<![\w.@-])(?:https?://)?((?:[a-z0-9-]+\.)+[a-z]{2,63})\b", re.IGNORECASE)
+
+
+def normalize_pattern(kind: str, pattern: str) -> str:
+    """Validate a rule and return it in stored form; raises ValueError with a user-facing reason."""
+    if kind not in KINDS:
+        raise ValueError(f"Kind must be one of: {', '.join(KINDS)}.")
+    pattern = pattern.strip()
+    if not pattern or len(pattern) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Patterns must be 1-{MAX_PATTERN_LENGTH} characters.")
+    if kind == "word":
+        return pattern.casefold()
+    if kind == "link":
+        host = re.sub(r"^[a-z]+://", "", pattern.lower()).split("/", 1)[0].removeprefix("www.")
+        if not _HOST.fullmatch(host):
+            raise ValueError(f"{pattern!r} is not a domain name.")
+        return host
+    if re.search(r"\\\d|\(\?P[<=]", pattern):
+        # Group numbers and names would clash once patterns are combined
+        raise ValueError("Backreferences and named groups are not supported.")
+    try:
+        re.compile(f"(?:{pattern})")
+    except re.error as e:
+        raise ValueError(f"Invalid regex: {e}.") from None
+    return pattern
+
+
+def _subpatterns(op, av) -> Iterator[sre_parse.SubPattern]:
+    if op in (sre.MAX_REPEAT, sre.MIN_REPEAT, sre.POSSESSIVE_REPEAT):
+        yield av[2]
+    elif op is sre.SUBPATTERN:
+        yield av[3]
+    elif op is sre.BRANCH:
+        yield from av[1]
+    elif op is sre.ATOMIC_GROUP:
+        yield av
+    elif op in (sre.ASSERT, sre.ASSERT_NOT):
+        yield av[1]
+    elif op is sre.GROUPREF_EXISTS:
+        yield from (branch for branch in av[1:] if branch is not None)
+
+
+def _nested_quantifier(items: sre_parse.SubPattern, repeated: bool = False) -> bool:
+    """Whether a variable-count quantifier sits inside a repeated group, like (a+)+."""
+    for op, av in items:
+        repeats = op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[1] > 1
+        if repeated and op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[0] != av[1]:
+            return True
+        if any(_nested_quantifier(sub, repeated or repeats) for sub in _subpatterns(op, av)):
+            return True
+    return False
+
+
+def _literals(items: sre_parse.SubPattern) -> Iterator[str]:
+    for op, av in items:
+        if op is sre.LITERAL:
+            yield chr(av)
+        for sub in _subpatterns(op, av):
+            yield from _literals(sub)
+
+
+def check_backtracking(pattern: str) -> None:
+    """Raise ValueError if a regex rule could backtrack long enough to stall the bot.
+
+    Nested quantifiers are rejected outright; anything else is timed on runs of its own
+    characters that end in one it can't match, growing up to the longest message. Only
+    the runs tried are covered, so this catches the usual catastrophic shapes rather
+    than proving a pattern safe.
+    """
+    parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    if _nested_quantifier(parsed):
+        raise ValueError("Nested quantifiers like (a+)+ can take too long to match.")
+    compiled = re.compile(pattern, re.IGNORECASE)
+    for ch in dict.fromkeys([*_literals(parsed), "a", "1", " "]):
+        for length in _PROBE_LENGTHS:
+            text = ch * length + "\0"
+            start = time.perf_counter()
+            compiled.search(text)
+            if time.perf_counter() - start > PROBE_BUDGET:
+                raise ValueError("This pattern takes too long to match on some messages.")
+
+
+class WordAutomaton:
+    """Aho-Corasick automaton over casefolded words and phrases.
+
+    search() makes one pass over the text whatever the number of words, and only
+    reports matches that start and end on word boundaries, so "ass" doesn't hit "class".
+    """
+
+    __slots__ = ("_goto", "_fail", "_out")
+
+    def __init__(self, words: Iterable[str]) -> None:
+        goto: list[dict[str, int]] = [{}]
+        out: list[tuple[str, ...]] = [()]
+        for word in words:
+            node = 0
+            for ch in word:
+                child = goto[node].get(ch)
+                if child is None:
+                    child = goto[node][ch] = len(goto)
+                    goto.append({})
+                    out.append(())
+                node = child
+            out[node] += (word,)
+        # Breadth-first, so every fail target is complete before it is used
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                target = fail[node]
+                while target and ch not in goto[target]:
+                    target = fail[target]
+                fail[child] = goto[target].get(ch, 0)
+                out[child] += out[fail[child]]
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def search(self, text: str) -> Optional[str]:
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        end = len(text)
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for word in out[node]:
+                start = i - len(word) + 1
+                if (start == 0 or not (word[0].isalnum() and text[start - 1].isalnum())) and (
+                    i + 1 == end or not (word[-1].isalnum() and text[i + 1].isalnum())
+                ):
+                    return word
+        return None
+
+
+class AutomodFilter:
+    """One guild's rules compiled into a word automaton, one combined regex and a domain set."""
+
+    __slots__ = ("_words", "_regex", "_patterns", "_domains")
+
+    def __init__(self, rules: Iterable[tuple[str, str]]) -> None:
+        words, patterns, domains = [], [], set()
+        for kind, pattern in rules:
+            if kind == "word":
+                words.append(pattern)
+            elif kind == "regex":
+                patterns.append(pattern)
+            elif kind == "link":
+                domains.add(pattern)
+        self._words = WordAutomaton(words) if words else None
+        self._patterns = patterns
+        self._regex = re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+        self._domains = frozenset(domains)
+
+    def check(self, content: str) -> Optional[tuple[str, str]]:
+        """Return the (kind, pattern) of the first rule the content breaks, or None."""
+        if self._domains and "." in content:
+            for match in _HOST.finditer(content):
+                labels = match.group(1).lower().split(".")
+                for i in range(len(labels) - 1):
+                    domain = ".".join(labels[i:])
+                    if domain in self._domains:
+                        return "link", domain
+        if self._words is not None:
+            word = self._words.search(content.casefold())
+            if word is not None:
+                return "word", word
+        if self._regex is not None and self._regex.search(content):
+            # Only on a hit: find out which of the combined patterns it was
+            for pattern in self._patterns:
+                if re.search(pattern, content, re.IGNORECASE):
+                    return "regex", pattern
+        return None
+
+
+class Automod:
+    """Per-guild automod rules and actions, kept in memory.
+
+    Rules are loaded once by load(). Each guild's rules are compiled into an
+    AutomodFilter on first use and kept until they change. Strikes for the
+    "escalate" action are counted per member and forgotten `strike_window`
+    seconds after the last one.
+    """
+
+    def __init__(
+        self,
+        db: Optional[Database] = None,
+        strikes: int = 3,
+        strike_window: float = 600.0,
+        timeout: float = 600.0,
+    ) -> None:
+        self.db = db
+        self.strikes = strikes
+        self.timeout = timeout
+        self._rules: dict[int, set[tuple[str, str]]] = {}
+        self._actions: dict[int, str] = {}
+        self._filters: dict[int, AutomodFilter] = {}
+        self._strikes: TTLCache[int] = TTLCache(maxsize=10_000, ttl=strike_window)
+
+    async def load(self) -> None:
+        assert self.db is not None
+        for guild_id, kind, pattern in await self.db.fetch_automod_rules():
+            if kind == "regex":
+                # Rules stored before the backtracking check; !automod remove still deletes them
+                try:
+                    check_backtracking(pattern)
+                except ValueError as e:
+                    logger.warning("Skipping automod regex %r in guild %s: %s", pattern, guild_id, e)
+                    continue
+            self._rules.setdefault(guild_id, set()).add((kind, pattern))
+        self._actions = dict(await self.db.fetch_automod_actions())
+        self._filters.clear()
+        logger.info("Loaded automod rules for %d guilds", len(self._rules))
+
+    def rules(self, guild_id: int) -> list[tuple[str, str]]:
+        return sorted(self._rules.get(guild_id, ()))
+
+    def action(self, guild_id: int) -> str:
+        return self._actions.get(guild_id, "delete")
+
+    def filter(self, guild_id: int) -> Optional[AutomodFilter]:
+        """The guild's compiled filter, or None when it has no rules."""
+        compiled = self._filters.get(guild_id)
+        if compiled is None:
+            rules = self._rules.get(guild_id)
+            if not rules:
+                return None
+            compiled = self._filters[guild_id] = AutomodFilter(rules)
+            REBUILDS.inc()
+        return compiled
+
+    async def add(self, guild_id: int, kind: str, pattern: str) -> str:
+        """Store a rule and return it as stored; raises ValueError if it is invalid."""
+        assert self.db is not None
+        pattern = normalize_pattern(kind, pattern)
+        if kind == "regex":
+            check_backtracking(pattern)
+        rules = self._rules.get(guild_id, set())
+        if len(rules) >= MAX_RULES:
+            raise ValueError(f"A server can have at most {MAX_RULES} automod rules.")
+        rule: AutomodRule = (guild_id, kind, pattern)
+        await self.db.add_automod_rule(rule)
+        self._rules[guild_id] = rules | {(kind, pattern)}
+        self._filters.pop(guild_id, None)
+        return pattern
+
+    async def remove(self, guild_id: int, kind: str, pattern: str) -> bool:
+        assert self.db is not None
+        try:
+            pattern = normalize_pattern(kind, pattern)
+        except ValueError:
+            return False
+        removed = await self.db.delete_automod_rule((guild_id, kind, pattern))
+        rules = self._rules.get(guild_id, set()) - {(kind, pattern)}
+        if rules:
+            self._rules[guild_id] = rules
+        else:
+            self._rules.pop(guild_id, None)
+        self._filters.pop(guild_id, None)
+        return removed
+
+    async def set_action(self, guild_id: int, action: str) -> None:
+        assert self.db is not None
+        if action not in ACTIONS:
+            raise ValueError(f"Action must be one of: {', '.join(ACTIONS)}.")
+        await self.db.save_automod_action(guild_id, action)
+        self._actions[guild_id] = action
+
+    def strike(self, guild_id: int, user_id: int) -> int:
+        """Record a violation and return the member's current strike count."""
+        count = self._strikes.get((guild_id, user_id))
+        count = 1 if count is MISSING else count + 1
+        self._strikes.set((guild_id, user_id), count)
+        return count
+
+    def pardon(self, guild_id: int, user_id: int) -> None:
+        self._strikes.pop((guild_id, user_id))
@@ -0,0 +1,40 @@
+"""Storage engines behind db.Database.
+
+    create_backend(url=None, path="bot.db")          -> SQLite file (default)
+    create_backend(url="postgresql://...")           -> PostgreSQL
+    create_backend(url="postgresql://...", read_url="postgresql://replica/...") -> reads from a replica
+    create_backend(url="memory://")                  -> in memory, not persisted
+    create_backend(url="memory:///var/lib/bot/xp.log") -> in memory with an append-only log
+
+Engines are imported lazily so the in-memory one needs no database driver.
+"""
+from typing import Optional
+from urllib.parse import urlparse
+
+from backends.base import Backend, USER_COLUMNS, IMPORT_MODES, xp_to_level
+
+__all__ = ["Backend", "USER_COLUMNS", "IMPORT_MODES", "create_backend", "xp_to_level"]
+
+
+def create_backend(
+    url: Optional[str] = None,
+    path: Optional[str] = "bot.db",
+    sqlite_readers: int = 2,
+    commit_delay: float = 0.005,
+    read_url: Optional[str] = None,
+    pool_min: int = 1,
+    pool_max: int = 5,
+    statement_timeout: Optional[float] = None,
+    connection_lifetime: float = 300.0,
+) -> Backend:
+    scheme = urlparse(url).scheme if url else ""
+    if scheme.startswith("postgres"):
+        from backends.postgres import PostgresBackend
+        return PostgresBackend(url, read_url, pool_min, pool_max, statement_timeout, connection_lifetime)
+    if scheme == "memory":
+        parsed = urlparse(url)
+        log_path = parsed.netloc + parsed.path
+        from backends.memory import MemoryBackend
+        return MemoryBackend(log_path or None)
+    from backends.sqlite import SQLiteBackend
+    return SQLiteBackend(path or "bot.db", readers=sqlite_readers, commit_delay=commit_delay)
@@ -0,0 +1,105 @@
+import math
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, Optional, Protocol
+
+from metrics import REGISTRY
+
+POOL_WAIT = REGISTRY.histogram(
+    "bot_db_pool_wait_seconds", "Time spent waiting for a pooled connection", ("pool",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+POOL_CONNECTIONS = REGISTRY.gauge("bot_db_pool_connections", "Open pooled connections", ("pool", "state"))
+
+USER_COLUMNS = ("user_id", "guild_id", "xp", "level", "messages", "last_active")
+SETTINGS_COLUMNS = ("guild_id", "prefix", "xp_min", "xp_max", "announce_channel_id", "ignored_channels")
+IMPORT_MODES = ("replace", "add")
+DAY = 86400
+
+# (xp, level, messages, last_active)
+Stats = tuple[int, int, int, str]
+# (user_id, guild_id, xp, level, messages, last_active) as exported
+UserRow = tuple[int, int, int, int, int, str]
+# (user_id, guild_id, xp, level, messages, last_active) as imported
+ImportRow = tuple[int, int, int, int, int, Optional[datetime]]
+# (user_id, guild_id, xp_delta, messages_delta, level, last_active) from the XP buffer
+DeltaRow = tuple[int, int, int, int, int, datetime]
+# (guild_id, prefix, xp_min, xp_max, announce_channel_id, ignored_channels); None means
+# the bot-wide default, ignored_channels is space-separated channel ids
+SettingsRow = tuple[int, Optional[str], Optional[int], Optional[int], Optional[int], str]
+# (guild_id, kind, pattern) with kind "word", "regex" or "link"
+AutomodRule = tuple[int, str, str]
+
+
+def xp_to_level(xp: int) -> int:
+    """Level formula; mirrored by the xp_to_level SQL function on the SQL backends."""
+    return int(math.sqrt(xp / 50))
+
+
+class Backend(Protocol):
+    """Storage engine behind Database.
+
+    Backends only store and query; Database adds the stats cache, the in-memory
+    leaderboard and per-operation metrics on top. last_active values are returned as
+    UTC "YYYY-MM-DD HH:MM:SS" strings ("" when unknown), the format the XP buffer
+    writes, so snapshot rows compare equal to the database's. `statements` counts
+    executed statements for benchmarks.
+    """
+
+    name: str
+    statements: int
+
+    async def init(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    async def add_message(self, user_id: int, guild_id: int, xp_gain: int, messages: int) -> tuple[int, int, int, int, str]:
+        """Upsert one message; return (xp, old_level, level, messages, last_active)."""
+        ...
+
+    async def add_messages(self, rows: list[DeltaRow]) -> None: ...
+
+    async def set_level(self, user_id: int, guild_id: int, level: int) -> None: ...
+
+    async def fetch_stats(self, user_id: int, guild_id: int) -> Optional[Stats]: ...
+
+    async def fetch_stats_many(self, keys: list[tuple[int, int]]) -> dict[tuple[int, int], Stats]: ...
+
+    async def fetch_guild_xp(self, guild_id: int) -> list[tuple[int, int]]:
+        """Return [(user_id, xp), ...] for one guild, highest XP first."""
+        ...
+
+    def iter_users(self, guild_id: Optional[int], batch_size: int) -> AsyncIterator[list[UserRow]]: ...
+
+    async def import_users(
+        self, batches: Iterable[list[ImportRow]], mode: str, progress: Optional[Callable[[int], None]],
+    ) -> tuple[int, set[int]]:
+        """Load rows (atomically, or batch by batch on SQLite); return (rows read, guild ids touched)."""
+        ...
+
+    async def add_activity(self, rows: list[tuple[int, int, int, int]]) -> None: ...
+
+    async def get_activity(self, guild_id: int, since: int, user_id: Optional[int]) -> list[tuple[int, int]]: ...
+
+    async def compact_activity(self, hourly_before: int, delete_before: int) -> None: ...
+
+    async def fetch_guild_settings(self) -> list[SettingsRow]:
+        """Return every stored guild settings row (one per configured guild)."""
+        ...
+
+    async def save_guild_settings(self, row: SettingsRow) -> None: ...
+
+    async def delete_guild_settings(self, guild_id: int) -> None: ...
+
+    async def fetch_automod_rules(self) -> list[AutomodRule]: ...
+
+    async def add_automod_rule(self, rule: AutomodRule) -> None: ...
+
+    async def delete_automod_rule(self, rule: AutomodRule) -> bool:
+        """Remove a rule; return whether it existed."""
+        ...
+
+    async def fetch_automod_actions(self) -> list[tuple[int, str]]:
+        """Return (guild_id, action) for guilds that changed the default action."""
+        ...
+
+    async def save_automod_action(self, guild_id: int, action: str) -> None: ...
@@ -0,0 +1,435 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from backends.base import DAY, AutomodRule, DeltaRow, ImportRow, SettingsRow, Stats, UserRow, xp_to_level
+
+logger = logging.getLogger("db")
+
+# Log record: op, guild_id, user_id, four op-specific values, then a CRC32 of the rest
+_PAYLOAD = struct.Struct("<BQQqqqq")
+RECORD_SIZE = _PAYLOAD.size + 4
+
+OP_ADD = 1  # xp delta, messages delta, level floor, last_active
+OP_SET_LEVEL = 2  # level
+OP_PUT = 3  # xp, level, messages, last_active
+OP_ACTIVITY = 4  # bucket, messages
+OP_COMPACT_ACTIVITY = 5  # hourly_before, delete_before
+
+
+def _record(op: int, guild_id: int, user_id: int, a: int = 0, b: int = 0, c: int = 0, d: int = 0) -> bytes:
+    payload = _PAYLOAD.pack(op, guild_id, user_id, a, b, c, d)
+    return payload + zlib.crc32(payload).to_bytes(4, "little")
+
+
+def _format_time(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if ts else ""
+
+
+class _User:
+    __slots__ = ("xp", "level", "messages", "last_active")
+
+    def __init__(self) -> None:
+        self.xp = 0
+        self.level = 0
+        self.messages = 0
+        # Unix time, 0 when unknown
+        self.last_active = 0
+
+    def stats(self) -> Stats:
+        return self.xp, self.level, self.messages, _format_time(self.last_active)
+
+
+class MemoryBackend:
+    """All state in memory, persisted to an append-only log of fixed-size records.
+
+    Every write is applied to per-guild dicts and appended to the log; writes issued
+    in the same `commit_delay` window share one write() call (group commit, durable
+    across application crashes like SQLite's synchronous=NORMAL). On startup the log
+    is replayed, dropping a torn or corrupt tail. Every `compact_interval` seconds, if
+    the log holds more than twice as many records as there is live state, it is
+    rewritten as one record per user and activity bucket. Guild settings and automod
+    rules are small and rarely change, so they are kept in a JSON file next to the log. Without
+    `path` nothing is persisted, which suits benchmarks and tests.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        commit_delay: float = 0.0,
+        compact_interval: float = 600.0,
+        compact_min_records: int = 100_000,
+    ) -> None:
+        self._path = path
+        self._commit_delay = commit_delay
+        self._compact_interval = compact_interval
+        self._compact_min_records = compact_min_records
+        self._users: dict[int, dict[int, _User]] = {}
+        self._activity: dict[int, dict[tuple[int, int], int]] = {}
+        self._settings: dict[int, SettingsRow] = {}
+        self._automod_rules: set[AutomodRule] = set()
+        self._automod_actions: dict[int, str] = {}
+        self._fd: Optional[int] = None
+        self._pending = bytearray()
+        self._log_records = 0
+        self._io_lock = asyncio.Lock()
+        self._settings_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._compact_task: Optional[asyncio.Task] = None
+        self.statements = 0
+
+    # Persistence
+    async def init(self) -> None:
+        if self._path is None:
+            logger.info("In-memory storage initialized (not persisted)")
+            return
+        start = time.perf_counter()
+        replayed = await asyncio.to_thread(self._replay)
+        try:
+            with open(self._settings_path, encoding="utf-8") as f:
+                state = json.load(f)
+            self._settings = {row[0]: tuple(row) for row in state["guild_settings"]}
+            self._automod_rules = {tuple(row) for row in state.get("automod_rules", ())}
+            self._automod_actions = {guild_id: action for guild_id, action in state.get("automod_actions", ())}
+        except FileNotFoundError:
+            pass
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._compact_task = asyncio.create_task(self._compact_loop())
+        logger.info(
+            "In-memory storage loaded %d log records from %s in %.2fs (%d users)",
+            replayed, self._path, time.perf_counter() - start, self._live_records(),
+        )
+
+    def _replay(self) -> int:
+        assert self._path is not None
+        try:
+            with open(self._path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        valid = 0
+        with memoryview(data) as view:
+            for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+                payload = view[offset:offset + _PAYLOAD.size]
+                crc = int.from_bytes(view[offset + _PAYLOAD.size:offset + RECORD_SIZE], "little")
+                if zlib.crc32(payload) != crc:
+                    break
+                self._apply(*_PAYLOAD.unpack(payload))
+                valid = offset + RECORD_SIZE
+        if valid != len(data):
+            logger.warning("Dropping %d bytes of torn or corrupt log tail in %s", len(data) - valid, self._path)
+            os.truncate(self._path, valid)
+        self._log_records = valid // RECORD_SIZE
+        return self._log_records
+
+    def _apply(self, op: int, guild_id: int, user_id: int, a: int, b: int, c: int, d: int) -> None:
+        """Apply one log record to the in-memory state; used for live writes and replay alike."""
+        if op == OP_ACTIVITY:
+            cells = self._activity.setdefault(guild_id, {})
+            cells[(user_id, a)] = cells.get((user_id, a), 0) + b
+            return
+        if op == OP_COMPACT_ACTIVITY:
+            self._fold_activity(a, b)
+            return
+        users = self._users.setdefault(guild_id, {})
+        user = users.get(user_id)
+        if op == OP_SET_LEVEL:
+            if user is not None:
+                user.level = a
+            return
+        if user is None:
+            user = users[user_id] = _User()
+        if op == OP_ADD:
+            user.xp += a
+            user.messages += b
+            user.level = max(user.level, c, xp_to_level(user.xp))
+            user.last_active = max(user.last_active, d)
+        elif op == OP_PUT:
+            user.xp, user.level, user.messages, user.last_active = a, b, c, d
+
+    def _write(self, op: int, guild_id: int, user_id: int, a: int = 0, b: int = 0, c: int = 0, d: int = 0) -> None:
+        self._apply(op, guild_id, user_id, a, b, c, d)
+        if self._fd is not None:
+            self._pending += _record(op, guild_id, user_id, a, b, c, d)
+
+    async def _commit(self) -> None:
+        """Group commit: every write issued before the pending flush shares one write() call."""
+        if self._fd is None:
+            return
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._group_flush())
+        await asyncio.shield(self._flush_task)
+
+    async def _group_flush(self) -> None:
+        await asyncio.sleep(self._commit_delay)
+        # Writes queued from here on need the next flush
+        self._flush_task = None
+        async with self._io_lock:
+            self._flush_pending()
+
+    def _flush_pending(self) -> None:
+        if not self._pending or self._fd is None:
+            return
+        data, self._pending = bytes(self._pending), bytearray()
+        os.write(self._fd, data)
+        self._log_records += len(data) // RECORD_SIZE
+        self.statements += 1
+
+    def _live_records(self) -> int:
+        return sum(map(len, self._users.values())) + sum(map(len, self._activity.values()))
+
+    async def _compact_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._compact_interval)
+            if self._log_records > max(self._compact_min_records, 2 * self._live_records()):
+                try:
+                    await self.compact()
+                except Exception:
+                    logger.exception("Log compaction failed")
+
+    async def compact(self) -> None:
+        """Rewrite the log as one record per user and activity bucket."""
+        if self._path is None:
+            return
+        async with self._io_lock:
+            start = time.perf_counter()
+            before = self._log_records + len(self._pending) // RECORD_SIZE
+            # Built without awaiting, so the snapshot is consistent and supersedes everything pending
+            snapshot = bytearray()
+            for guild_id, users in self._users.items():
+                for user_id, user in users.items():
+                    snapshot += _record(OP_PUT, guild_id, user_id, user.xp, user.level, user.messages, user.last_active)
+            for guild_id, cells in self._activity.items():
+                for (user_id, bucket), messages in cells.items():
+                    snapshot += _record(OP_ACTIVITY, guild_id, user_id, bucket, messages)
+            self._pending = bytearray()
+            tmp = f"{self._path}.compact"
+            await asyncio.to_thread(self._write_file, tmp, bytes(snapshot))
+            os.replace(tmp, self._path)
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND)
+            self._log_records = len(snapshot) // RECORD_SIZE
+            logger.info(
+                "Compacted %s from %d to %d records in %.2fs",
+                self._path, before, self._log_records, time.perf_counter() - start,
+            )
+
+    @property
+    def _settings_path(self) -> str:
+        return f"{self._path}.settings.json"
+
+    async def _save_settings(self) -> None:
+        if self._path is None:
+            return
+        # Serialized, and each save snapshots the state once it holds the lock, so the
+        # last file written is never older than the last change
+        async with self._settings_lock:
+            data = json.dumps({
+                "guild_settings": list(self._settings.values()),
+                "automod_rules": sorted(self._automod_rules),
+                "automod_actions": sorted(self._automod_actions.items()),
+            }).encode()
+            await asyncio.to_thread(self._replace_file, self._settings_path, data)
+
+    @staticmethod
+    def _write_file(path: str, data: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _replace_file(path: str, data: bytes) -> None:
+        """Atomically replace `path` through a uniquely named temporary file next to it."""
+        fd, tmp = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp", dir=os.path.dirname(path) or ".")
+        try:
+            with open(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def close(self) -> None:
+        if self._compact_task is not None:
+            self._compact_task.cancel()
+            try:
+                await self._compact_task
+            except asyncio.CancelledError:
+                pass
+            self._compact_task = None
+        if self._flush_task is not None:
+            await asyncio.shield(self._flush_task)
+        async with self._io_lock:
+            self._flush_pending()
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+                logger.info("In-memory storage log closed")
+
+    # Users
+    async def add_message(self, user_id: int, guild_id: int, xp_gain: int, messages: int) -> tuple[int, int, int, int, str]:
+        self.statements += 1
+        self._write(OP_ADD, guild_id, user_id, xp_gain, messages, 0, int(time.time()))
+        user = self._users[guild_id][user_id]
+        # Same rule as the SQL backends: no level-up when the level was set above the formula
+        old_level = xp_to_level(user.xp - xp_gain) if user.level == xp_to_level(user.xp) else user.level
+        await self._commit()
+        return user.xp, old_level, user.level, user.messages, _format_time(user.last_active)
+
+    async def add_messages(self, rows: list[DeltaRow]) -> None:
+        self.statements += len(rows)
+        for user_id, guild_id, xp, messages, level, last_active in rows:
+            self._write(OP_ADD, guild_id, user_id, xp, messages, level, int(last_active.timestamp()))
+        await self._commit()
+
+    async def set_level(self, user_id: int, guild_id: int, level: int) -> None:
+        self.statements += 1
+        if user_id in self._users.get(guild_id, {}):
+            self._write(OP_SET_LEVEL, guild_id, user_id, level)
+            await self._commit()
+
+    async def fetch_stats(self, user_id: int, guild_id: int) -> Optional[Stats]:
+        self.statements += 1
+        user = self._users.get(guild_id, {}).get(user_id)
+        return user.stats() if user is not None else None
+
+    async def fetch_stats_many(self, keys: list[tuple[int, int]]) -> dict[tuple[int, int], Stats]:
+        self.statements += 1
+        found = {}
+        for user_id, guild_id in keys:
+            user = self._users.get(guild_id, {}).get(user_id)
+            if user is not None:
+                found[(user_id, guild_id)] = user.stats()
+        return found
+
+    async def fetch_guild_xp(self, guild_id: int) -> list[tuple[int, int]]:
+        self.statements += 1
+        rows = [(user_id, user.xp) for user_id, user in self._users.get(guild_id, {}).items()]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows
+
+    async def iter_users(self, guild_id: Optional[int], batch_size: int) -> AsyncIterator[list[UserRow]]:
+        self.statements += 1
+        guild_ids = [guild_id] if guild_id is not None else sorted(self._users)
+        for gid in guild_ids:
+            user_ids = sorted(self._users.get(gid, {}))
+            for i in range(0, len(user_ids), batch_size):
+                users = self._users.get(gid, {})
+                batch = [
+                    (user_id, gid, *users[user_id].stats())
+                    for user_id in user_ids[i:i + batch_size]
+                    if user_id in users
+                ]
+                if batch:
+                    yield batch
+
+    async def import_users(
+        self, batches: Iterable[list[ImportRow]], mode: str, progress: Optional[Callable[[int], None]],
+    ) -> tuple[int, set[int]]:
+        """Parse everything first and apply it in one step, so a bad row imports nothing."""
+        rows: list[ImportRow] = []
+        for batch in batches:
+            rows.extend(batch)
+            if progress is not None:
+                progress(len(rows))
+        guilds = set()
+        for user_id, guild_id, xp, level, messages, last_active in rows:
+            level = max(level, xp_to_level(xp))
+            ts = int(last_active.timestamp()) if last_active else 0
+            if mode == "replace":
+                self._write(OP_PUT, guild_id, user_id, xp, level, messages, ts)
+            else:
+                self._write(OP_ADD, guild_id, user_id, xp, messages, level, ts)
+            guilds.add(guild_id)
+        self.statements += len(rows)
+        await self._commit()
+        return len(rows), guilds
+
+    # Activity rollups
+    async def add_activity(self, rows: list[tuple[int, int, int, int]]) -> None:
+        self.statements += len(rows)
+        for guild_id, user_id, bucket, messages in rows:
+            self._write(OP_ACTIVITY, guild_id, user_id, bucket, messages)
+        await self._commit()
+
+    async def get_activity(self, guild_id: int, since: int, user_id: Optional[int]) -> list[tuple[int, int]]:
+        self.statements += 1
+        days: dict[int, int] = {}
+        for (uid, bucket), messages in self._activity.get(guild_id, {}).items():
+            if bucket >= since and (user_id is None or uid == user_id):
+                day = bucket - bucket % DAY
+                days[day] = days.get(day, 0) + messages
+        return sorted(days.items())
+
+    def _fold_activity(self, hourly_before: int, delete_before: int) -> None:
+        for guild_id, cells in self._activity.items():
+            folded: dict[tuple[int, int], int] = {}
+            for (user_id, bucket), messages in cells.items():
+                if bucket < hourly_before:
+                    bucket -= bucket % DAY
+                if bucket < delete_before:
+                    continue
+                folded[(user_id, bucket)] = folded.get((user_id, bucket), 0) + messages
+            self._activity[guild_id] = folded
+
+    async def compact_activity(self, hourly_before: int, delete_before: int) -> None:
+        self.statements += 1
+        self._write(OP_COMPACT_ACTIVITY, 0, 0, hourly_before, delete_before)
+        await self._commit()
+
+    # Guild settings
+    async def fetch_guild_settings(self) -> list[SettingsRow]:
+        self.statements += 1
+        return list(self._settings.values())
+
+    async def save_guild_settings(self, row: SettingsRow) -> None:
+        self.statements += 1
+        self._settings[row[0]] = tuple(row)
+        await self._save_settings()
+
+    async def delete_guild_settings(self, guild_id: int) -> None:
+        self.statements += 1
+        if self._settings.pop(guild_id, None) is not None:
+            await self._save_settings()
+
+    # Automod
+    async def fetch_automod_rules(self) -> list[AutomodRule]:
+        self.statements += 1
+        return sorted(self._automod_rules)
+
+    async def add_automod_rule(self, rule: AutomodRule) -> None:
+        self.statements += 1
+        if rule not in self._automod_rules:
+            self._automod_rules.add(tuple(rule))
+            await self._save_settings()
+
+    async def delete_automod_rule(self, rule: AutomodRule) -> bool:
+        self.statements += 1
+        if rule not in self._automod_rules:
+            return False
+        self._automod_rules.discard(rule)
+        await self._save_settings()
+        return True
+
+    async def fetch_automod_actions(self) -> list[tuple[int, str]]:
+        self.statements += 1
+        return list(self._automod_actions.items())
+
+    async def save_automod_action(self, guild_id: int, action: str) -> None:
+        self.statements += 1
+        self._automod_actions[guild_id] = action
+        await self._save_settings()
@@ -0,0 +1,409 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+import asyncpg
+
+from backends.base import (
+    POOL_CONNECTIONS, POOL_WAIT, SETTINGS_COLUMNS, USER_COLUMNS, AutomodRule, DeltaRow, ImportRow, SettingsRow, Stats, UserRow,
+)
+
+logger = logging.getLogger("db")
+
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id BIGINT NOT NULL,
+    guild_id BIGINT NOT NULL,
+    xp INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 0,
+    messages INTEGER NOT NULL DEFAULT 0,
+    last_active TIMESTAMPTZ
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users ON users (user_id, guild_id);
+CREATE INDEX IF NOT EXISTS idx_users_guild_xp ON users (guild_id, xp DESC);
+CREATE TABLE IF NOT EXISTS activity (
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    bucket BIGINT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_activity_guild_bucket ON activity (guild_id, bucket);
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id BIGINT PRIMARY KEY,
+    prefix TEXT,
+    xp_min INTEGER,
+    xp_max INTEGER,
+    announce_channel_id BIGINT,
+    ignored_channels TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS automod_rules (
+    guild_id BIGINT NOT NULL,
+    kind TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    PRIMARY KEY (guild_id, kind, pattern)
+);
+CREATE TABLE IF NOT EXISTS automod_actions (
+    guild_id BIGINT PRIMARY KEY,
+    action TEXT NOT NULL
+);
+CREATE OR REPLACE FUNCTION xp_to_level(xp BIGINT) RETURNS INTEGER
+    LANGUAGE SQL IMMUTABLE AS $$ SELECT FLOOR(SQRT(xp / 50.0))::INTEGER $$;
+"""
+
+# Cluster workers start together; the advisory lock makes them apply the schema one at a
+# time, as concurrent CREATE OR REPLACE FUNCTION fails with "tuple concurrently updated"
+SCHEMA_LOCK_ID = 7_240_541_002
+
+# Hot-path statements live at module level so the identical SQL text hits
+# asyncpg's per-connection prepared statement cache on every call. The third
+# returned column is the level before this message; when the stored level is
+# ahead of the XP formula (set manually) no level-up is reported. $3 feeds both the
+# INTEGER xp column and xp_to_level(BIGINT), so it is cast explicitly or the server
+# could not settle on one parameter type.
+POSTGRES_ADD_MESSAGE = """
+INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
+VALUES ($1, $2, $3::integer, xp_to_level($3::integer), $4, NOW())
+ON CONFLICT (user_id, guild_id) DO UPDATE
+SET xp = users.xp + EXCLUDED.xp,
+    level = GREATEST(users.level, xp_to_level(users.xp + EXCLUDED.xp)),
+    messages = users.messages + EXCLUDED.messages,
+    last_active = EXCLUDED.last_active
+RETURNING xp, level, CASE WHEN level = xp_to_level(xp) THEN xp_to_level(xp - $3::integer) ELSE level END,
+    messages, COALESCE(to_char(last_active AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'), '')
+"""
+
+POSTGRES_ADD_MESSAGES = """
+INSERT INTO users (user_id, guild_id, xp, messages, level, last_active)
+VALUES ($1, $2, $3::integer, $4, GREATEST($5, xp_to_level($3::integer)), $6)
+ON CONFLICT (user_id, guild_id) DO UPDATE
+SET xp = users.xp + EXCLUDED.xp,
+    messages = users.messages + EXCLUDED.messages,
+    level = GREATEST(users.level, EXCLUDED.level, xp_to_level(users.xp + EXCLUDED.xp)),
+    last_active = EXCLUDED.last_active
+"""
+
+# Activity rollups: `bucket` is the unix time of the start of the hour, or of the
+# day once compacted. Daily rows are the midnight bucket, so the same queries work
+# on both resolutions.
+POSTGRES_ADD_ACTIVITY = """
+INSERT INTO activity (guild_id, user_id, bucket, messages) VALUES ($1, $2, $3, $4)
+ON CONFLICT (guild_id, user_id, bucket) DO UPDATE SET messages = activity.messages + EXCLUDED.messages
+"""
+
+POSTGRES_COMPACT_ACTIVITY = """
+INSERT INTO activity (guild_id, user_id, bucket, messages)
+SELECT guild_id, user_id, bucket - bucket % 86400, SUM(messages) FROM activity
+WHERE bucket < $1 AND bucket % 86400 != 0
+GROUP BY guild_id, user_id, bucket - bucket % 86400
+ON CONFLICT (guild_id, user_id, bucket) DO UPDATE SET messages = activity.messages + EXCLUDED.messages
+"""
+
+POSTGRES_SAVE_SETTINGS = f"""
+INSERT INTO guild_settings ({", ".join(SETTINGS_COLUMNS)}) VALUES ($1, $2, $3, $4, $5, $6)
+ON CONFLICT (guild_id) DO UPDATE
+SET {", ".join(f"{column} = EXCLUDED.{column}" for column in SETTINGS_COLUMNS[1:])}
+"""
+
+# Bulk import goes through a staging table filled with COPY, then one upsert.
+# "replace" overwrites imported users, "add" merges the file's XP and message
+# counts into existing ones. Levels never drop below the XP formula.
+POSTGRES_IMPORT_STAGING = """
+CREATE TEMP TABLE users_import (
+    user_id BIGINT, guild_id BIGINT, xp INTEGER, level INTEGER, messages INTEGER, last_active TIMESTAMPTZ
+) ON COMMIT DROP
+"""
+
+POSTGRES_IMPORT = {
+    "replace": """
+INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
+SELECT user_id, guild_id, MAX(xp), GREATEST(MAX(level), xp_to_level(MAX(xp))), MAX(messages), MAX(last_active)
+FROM users_import GROUP BY user_id, guild_id
+ON CONFLICT (user_id, guild_id) DO UPDATE
+SET xp = EXCLUDED.xp, level = EXCLUDED.level, messages = EXCLUDED.messages, last_active = EXCLUDED.last_active
+""",
+    "add": """
+INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
+SELECT user_id, guild_id, SUM(xp), GREATEST(MAX(level), xp_to_level(SUM(xp))), SUM(messages), MAX(last_active)
+FROM users_import GROUP BY user_id, guild_id
+ON CONFLICT (user_id, guild_id) DO UPDATE
+SET xp = users.xp + EXCLUDED.xp,
+    level = GREATEST(users.level, EXCLUDED.level, xp_to_level(users.xp + EXCLUDED.xp)),
+    messages = users.messages + EXCLUDED.messages,
+    last_active = GREATEST(users.last_active, EXCLUDED.last_active)
+""",
+}
+
+
+class PostgresBackend:
+    """PostgreSQL through asyncpg connection pools.
+
+    Writes go to a pool on `url`. With `read_url` (typically a streaming replica),
+    reads run on a second pool of the same size, so bursts of commands don't queue
+    ahead of XP ingestion for connections. Replica reads can lag the primary slightly;
+    Database's stats cache is updated from writes and masks most of that.
+    `statement_timeout` (seconds) is enforced by the server. Connections are closed
+    when released once they are `connection_lifetime` seconds old, and sooner if
+    idle that long (down to `min_size`), so none outlives a failover or DNS change.
+    """
+
+    name = "postgres"
+
+    def __init__(
+        self,
+        url: str,
+        read_url: Optional[str] = None,
+        min_size: int = 1,
+        max_size: int = 5,
+        statement_timeout: Optional[float] = None,
+        connection_lifetime: float = 300.0,
+    ) -> None:
+        self._url = url
+        self._read_url = read_url
+        self._min_size = min_size
+        self._max_size = max_size
+        self._statement_timeout = statement_timeout
+        self._connection_lifetime = connection_lifetime
+        self._pool: Optional[asyncpg.Pool] = None
+        self._read_pool: Optional[asyncpg.Pool] = None
+        # Open time of each pooled connection, by pool label and server backend pid
+        self._opened: dict[str, dict[int, float]] = {}
+        self.statements = 0
+
+    async def _create_pool(self, dsn: str, label: str) -> asyncpg.Pool:
+        opened = self._opened.setdefault(label, {})
+
+        async def init(conn: asyncpg.Connection) -> None:
+            opened[conn.get_server_pid()] = time.monotonic()
+
+        server_settings = {}
+        if self._statement_timeout:
+            server_settings["statement_timeout"] = str(int(self._statement_timeout * 1000))
+        pool = await asyncpg.create_pool(
+            dsn=dsn,
+            min_size=self._min_size,
+            max_size=self._max_size,
+            max_inactive_connection_lifetime=self._connection_lifetime,
+            server_settings=server_settings,
+            init=init,
+        )
+        POOL_CONNECTIONS.labels(label, "idle").set_function(pool.get_idle_size)
+        POOL_CONNECTIONS.labels(label, "in_use").set_function(lambda: pool.get_size() - pool.get_idle_size())
+        return pool
+
+    async def init(self) -> None:
+        self._pool = await self._create_pool(self._url, "postgres")
+        async with self._acquire() as conn, conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_ID)
+            await conn.execute(POSTGRES_SCHEMA)
+        if self._read_url:
+            self._read_pool = await self._create_pool(self._read_url, "postgres_read")
+        logger.info(
+            "PostgreSQL initialized at %s (pool %d-%d%s)", self._url, self._min_size, self._max_size,
+            ", reads from replica" if self._read_pool is not None else "",
+        )
+
+    async def close(self) -> None:
+        for pool in (self._read_pool, self._pool):
+            if pool is not None:
+                await pool.close()
+        if self._pool is not None:
+            logger.info("PostgreSQL pool closed")
+        self._pool = self._read_pool = None
+
+    @asynccontextmanager
+    async def _acquire(self, read: bool = False) -> AsyncIterator[asyncpg.Connection]:
+        """Acquire a pooled connection, from the read pool if there is one and `read` is set, recording the wait time."""
+        pool, label = self._pool, "postgres"
+        if read and self._read_pool is not None:
+            pool, label = self._read_pool, "postgres_read"
+        assert pool is not None
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            POOL_WAIT.labels(label).observe(time.perf_counter() - start)
+            yield conn
+            if self._connection_lifetime:
+                pid = conn.get_server_pid()
+                opened = self._opened[label]
+                if time.monotonic() - opened.get(pid, 0.0) >= self._connection_lifetime:
+                    # The pool sees the connection closed on release and opens a new one when needed
+                    opened.pop(pid, None)
+                    try:
+                        await conn.close(timeout=5)
+                    except Exception:
+                        conn.terminate()
+
+    async def add_message(self, user_id: int, guild_id: int, xp_gain: int, messages: int) -> tuple[int, int, int, int, str]:
+        self.statements += 1
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(POSTGRES_ADD_MESSAGE, user_id, guild_id, xp_gain, messages)
+        return int(row[0]), int(row[2]), int(row[1]), int(row[3]), str(row[4])
+
+    async def add_messages(self, rows: list[DeltaRow]) -> None:
+        self.statements += len(rows)
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(POSTGRES_ADD_MESSAGES, rows)
+
+    async def set_level(self, user_id: int, guild_id: int, level: int) -> None:
+        self.statements += 1
+        async with self._acquire() as conn:
+            await conn.execute(
+                "UPDATE users SET level = $1 WHERE user_id = $2 AND guild_id = $3",
+                level, user_id, guild_id,
+            )
+
+    async def fetch_stats(self, user_id: int, guild_id: int) -> Optional[Stats]:
+        self.statements += 1
+        async with self._acquire(read=True) as conn:
+            row = await conn.fetchrow(
+                "SELECT xp, level, messages, "
+                "COALESCE(to_char(last_active AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'), '') FROM users "
+                "WHERE user_id = $1 AND guild_id = $2",
+                user_id, guild_id,
+            )
+            if row:
+                return int(row[0]), int(row[1]), int(row[2]), str(row[3])
+            return None
+
+    async def fetch_stats_many(self, keys: list[tuple[int, int]]) -> dict[tuple[int, int], Stats]:
+        self.statements += 1
+        async with self._acquire(read=True) as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, guild_id, xp, level, messages, "
+                "COALESCE(to_char(last_active AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'), '') FROM users "
+                "JOIN unnest($1::bigint[], $2::bigint[]) AS k(user_id, guild_id) USING (user_id, guild_id)",
+                [user_id for user_id, _ in keys], [guild_id for _, guild_id in keys],
+            )
+        return {(int(r[0]), int(r[1])): (int(r[2]), int(r[3]), int(r[4]), str(r[5])) for r in rows}
+
+    async def fetch_guild_xp(self, guild_id: int) -> list[tuple[int, int]]:
+        # Served by idx_users_guild_xp
+        self.statements += 1
+        async with self._acquire(read=True) as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, xp FROM users WHERE guild_id = $1 ORDER BY xp DESC",
+                guild_id,
+            )
+        return [(int(user_id), int(xp)) for user_id, xp in rows]
+
+    async def iter_users(self, guild_id: Optional[int], batch_size: int) -> AsyncIterator[list[UserRow]]:
+        """Streams through a server-side cursor."""
+        query = (
+            "SELECT user_id, guild_id, xp, level, messages, "
+            "COALESCE(to_char(last_active AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'), '') FROM users"
+        )
+        args: tuple = ()
+        if guild_id is not None:
+            query += " WHERE guild_id = $1"
+            args = (guild_id,)
+        self.statements += 1
+        async with self._acquire(read=True) as conn, conn.transaction():
+            batch = []
+            async for record in conn.cursor(query + " ORDER BY guild_id, user_id", *args, prefetch=batch_size):
+                batch.append(tuple(record))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    async def import_users(
+        self, batches: Iterable[list[ImportRow]], mode: str, progress: Optional[Callable[[int], None]],
+    ) -> tuple[int, set[int]]:
+        total = 0
+        guilds: set[int] = set()
+        async with self._acquire() as conn, conn.transaction():
+            # Large imports may legitimately outlast the statement timeout
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            await conn.execute(POSTGRES_IMPORT_STAGING)
+            for batch in batches:
+                await conn.copy_records_to_table("users_import", records=batch, columns=USER_COLUMNS)
+                total += len(batch)
+                guilds.update(row[1] for row in batch)
+                if progress is not None:
+                    progress(total)
+            await conn.execute(POSTGRES_IMPORT[mode])
+        self.statements += 3 + total
+        return total, guilds
+
+    async def add_activity(self, rows: list[tuple[int, int, int, int]]) -> None:
+        self.statements += len(rows)
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(POSTGRES_ADD_ACTIVITY, rows)
+
+    async def get_activity(self, guild_id: int, since: int, user_id: Optional[int]) -> list[tuple[int, int]]:
+        # One range scan over the primary key (member) or idx_activity_guild_bucket (guild)
+        query = "SELECT bucket - bucket % 86400 AS day, SUM(messages) FROM activity WHERE guild_id = $1 AND bucket >= $2"
+        args: tuple = (guild_id, since)
+        if user_id is not None:
+            query += " AND user_id = $3"
+            args += (user_id,)
+        self.statements += 1
+        async with self._acquire(read=True) as conn:
+            rows = await conn.fetch(query + " GROUP BY day ORDER BY day", *args)
+        return [(int(day), int(messages)) for day, messages in rows]
+
+    async def compact_activity(self, hourly_before: int, delete_before: int) -> None:
+        self.statements += 3
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(POSTGRES_COMPACT_ACTIVITY, hourly_before)
+                await conn.execute("DELETE FROM activity WHERE bucket < $1 AND bucket % 86400 != 0", hourly_before)
+                await conn.execute("DELETE FROM activity WHERE bucket < $1", delete_before)
+
+    # Guild settings are read from the primary so a change is visible right after it is made
+    async def fetch_guild_settings(self) -> list[SettingsRow]:
+        self.statements += 1
+        async with self._acquire() as conn:
+            rows = await conn.fetch(f"SELECT {', '.join(SETTINGS_COLUMNS)} FROM guild_settings")
+        return [tuple(row) for row in rows]
+
+    async def save_guild_settings(self, row: SettingsRow) -> None:
+        self.statements += 1
+        async with self._acquire() as conn:
+            await conn.execute(POSTGRES_SAVE_SETTINGS, *row)
+
+    async def delete_guild_settings(self, guild_id: int) -> None:
+        self.statements += 1
+        async with self._acquire() as conn:
+            await conn.execute("DELETE FROM guild_settings WHERE guild_id = $1", guild_id)
+
+    # Automod, also read from the primary
+    async def fetch_automod_rules(self) -> list[AutomodRule]:
+        self.statements += 1
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT guild_id, kind, pattern FROM automod_rules")
+        return [tuple(row) for row in rows]
+
+    async def add_automod_rule(self, rule: AutomodRule) -> None:
+        self.statements += 1
+        async with self._acquire() as conn:
+            await conn.execute(
+                "INSERT INTO automod_rules (guild_id, kind, pattern) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING", *rule,
+            )
+
+    async def delete_automod_rule(self, rule: AutomodRule) -> bool:
+        self.statements += 1
+        async with self._acquire() as conn:
+            status = await conn.execute(
+                "DELETE FROM automod_rules WHERE guild_id = $1 AND kind = $2 AND pattern = $3", *rule,
+            )
+        return status != "DELETE 0"
+
+    async def fetch_automod_actions(self) -> list[tuple[int, str]]:
+        self.statements += 1
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT guild_id, action FROM automod_actions")
+        return [tuple(row) for row in rows]
+
+    async def save_automod_action(self, guild_id: int, action: str) -> None:
+        self.statements += 1
+        async with self._acquire() as conn:
+            await conn.execute(
+                "INSERT INTO automod_actions (guild_id, action) VALUES ($1, $2) "
+                "ON CONFLICT (guild_id) DO UPDATE SET action = EXCLUDED.action",
+                guild_id, action,
+            )
@@ -0,0 +1,409 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+import aiosqlite
+
+from backends.base import POOL_WAIT, SETTINGS_COLUMNS, AutomodRule, DeltaRow, ImportRow, SettingsRow, Stats, UserRow, xp_to_level
+
+logger = logging.getLogger("db")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    xp INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 0,
+    messages INTEGER NOT NULL DEFAULT 0,
+    last_active TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users ON users (user_id, guild_id);
+CREATE INDEX IF NOT EXISTS idx_users_guild_xp ON users (guild_id, xp DESC);
+CREATE TABLE IF NOT EXISTS activity (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_activity_guild_bucket ON activity (guild_id, bucket);
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER PRIMARY KEY,
+    prefix TEXT,
+    xp_min INTEGER,
+    xp_max INTEGER,
+    announce_channel_id INTEGER,
+    ignored_channels TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS automod_rules (
+    guild_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    PRIMARY KEY (guild_id, kind, pattern)
+);
+CREATE TABLE IF NOT EXISTS automod_actions (
+    guild_id INTEGER PRIMARY KEY,
+    action TEXT NOT NULL
+);
+"""
+
+SQLITE_SAVE_SETTINGS = f"""
+INSERT INTO guild_settings ({", ".join(SETTINGS_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(guild_id) DO UPDATE
+SET {", ".join(f"{column} = excluded.{column}" for column in SETTINGS_COLUMNS[1:])}
+"""
+
+# WAL lets the read-only pool read while the writer appends; NORMAL sync is
+# durable across application crashes and only fsyncs on checkpoints.
+SQLITE_WRITER_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA busy_timeout = 5000;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
+
+SQLITE_READER_PRAGMAS = """
+PRAGMA busy_timeout = 5000;
+PRAGMA cache_size = -16384;
+PRAGMA mmap_size = 268435456;
+PRAGMA query_only = ON;
+"""
+
+# Hot-path statements live at module level so the identical SQL text hits the
+# connection's statement cache on every call. The third returned column is the
+# level before this message; when the stored level is ahead of the XP formula
+# (set manually) no level-up is reported.
+SQLITE_ADD_MESSAGE = """
+INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
+VALUES (?1, ?2, ?3, xp_to_level(?3), ?4, CURRENT_TIMESTAMP)
+ON CONFLICT(user_id, guild_id) DO UPDATE
+SET xp = xp + excluded.xp,
+    level = MAX(level, xp_to_level(xp + excluded.xp)),
+    messages = messages + excluded.messages,
+    last_active = excluded.last_active
+RETURNING xp, level, CASE WHEN level = xp_to_level(xp) THEN xp_to_level(xp - ?3) ELSE level END,
+    messages, COALESCE(last_active, '')
+"""
+
+SQLITE_ADD_MESSAGES = """
+INSERT INTO users (user_id, guild_id, xp, messages, level, last_active)
+VALUES (?1, ?2, ?3, ?4, MAX(?5, xp_to_level(?3)), ?6)
+ON CONFLICT(user_id, guild_id) DO UPDATE
+SET xp = xp + excluded.xp,
+    messages = messages + excluded.messages,
+    level = MAX(level, excluded.level, xp_to_level(xp + excluded.xp)),
+    last_active = excluded.last_active
+"""
+
+# Activity rollups: `bucket` is the unix time of the start of the hour, or of the
+# day once compacted. Daily rows are the midnight bucket, so the same queries work
+# on both resolutions.
+SQLITE_ADD_ACTIVITY = """
+INSERT INTO activity (guild_id, user_id, bucket, messages) VALUES (?1, ?2, ?3, ?4)
+ON CONFLICT(guild_id, user_id, bucket) DO UPDATE SET messages = messages + excluded.messages
+"""
+
+SQLITE_COMPACT_ACTIVITY = """
+INSERT INTO activity (guild_id, user_id, bucket, messages)
+SELECT guild_id, user_id, bucket - bucket % 86400, SUM(messages) FROM activity
+WHERE bucket < ?1 AND bucket % 86400 != 0
+GROUP BY guild_id, user_id, bucket - bucket % 86400
+ON CONFLICT(guild_id, user_id, bucket) DO UPDATE SET messages = messages + excluded.messages
+"""
+
+# Bulk import. "replace" overwrites imported users, "add" merges the file's XP and
+# message counts into existing ones. Levels never drop below the XP formula.
+SQLITE_IMPORT = {
+    "replace": """
+INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
+VALUES (?1, ?2, ?3, MAX(?4, xp_to_level(?3)), ?5, ?6)
+ON CONFLICT(user_id, guild_id) DO UPDATE
+SET xp = excluded.xp, level = excluded.level, messages = excluded.messages, last_active = excluded.last_active
+""",
+    "add": """
+INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
+VALUES (?1, ?2, ?3, MAX(?4, xp_to_level(?3)), ?5, ?6)
+ON CONFLICT(user_id, guild_id) DO UPDATE
+SET xp = xp + excluded.xp,
+    level = MAX(level, excluded.level, xp_to_level(xp + excluded.xp)),
+    messages = messages + excluded.messages,
+    last_active = COALESCE(MAX(last_active, excluded.last_active), last_active, excluded.last_active)
+""",
+}
+
+
+def _format_time(row: ImportRow) -> tuple:
+    return (*row[:5], row[5].strftime("%Y-%m-%d %H:%M:%S") if row[5] else None)
+
+
+class SQLiteBackend:
+    """SQLite in WAL mode: one serialized writer connection whose commits are grouped,
+    plus `readers` read-only connections for queries (none for ":memory:").
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "bot.db", readers: int = 2, commit_delay: float = 0.005) -> None:
+        self._path = path
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._readers: list[aiosqlite.Connection] = []
+        self._idle_readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._reader_count = 0 if path == ":memory:" else readers
+        self._commit_delay = commit_delay
+        self._commit_task: Optional[asyncio.Task] = None
+        # Held for each statement on the writer until its cursor is closed, and for the
+        # commit: sqlite cannot commit while another statement is still in progress
+        self._write_lock = asyncio.Lock()
+        self.statements = 0
+
+    async def init(self) -> None:
+        self._conn = await aiosqlite.connect(self._path)
+        await self._conn.executescript(SQLITE_WRITER_PRAGMAS)
+        await self._conn.create_function("xp_to_level", 1, xp_to_level, deterministic=True)
+        await self._conn.executescript(SQLITE_SCHEMA)
+        await self._conn.commit()
+        uri = Path(self._path).resolve().as_uri() + "?mode=ro"
+        for _ in range(self._reader_count):
+            reader = await aiosqlite.connect(uri, uri=True)
+            await reader.executescript(SQLITE_READER_PRAGMAS)
+            self._readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+        logger.info("SQLite initialized at %s (WAL, %d readers)", self._path, len(self._readers))
+
+    async def close(self) -> None:
+        if self._commit_task is not None:
+            await asyncio.shield(self._commit_task)
+        for reader in self._readers:
+            await reader.close()
+        self._readers.clear()
+        self._idle_readers = asyncio.Queue()
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+            logger.info("SQLite connection closed")
+
+    async def _commit(self) -> None:
+        """Group commit: every write issued before the pending commit runs shares it."""
+        if self._commit_task is None:
+            self._commit_task = asyncio.create_task(self._group_commit())
+        await asyncio.shield(self._commit_task)
+
+    async def _group_commit(self) -> None:
+        await asyncio.sleep(self._commit_delay)
+        # Writes queued from here on need the next commit
+        self._commit_task = None
+        self.statements += 1
+        async with self._writer() as conn:
+            await conn.commit()
+
+    @asynccontextmanager
+    async def _writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """The writer connection, held exclusively; leave before awaiting the commit."""
+        assert self._conn is not None
+        async with self._write_lock:
+            yield self._conn
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a read-only connection, or the writer when no readers are configured."""
+        if not self._readers:
+            async with self._writer() as conn:
+                yield conn
+            return
+        start = time.perf_counter()
+        reader = await self._idle_readers.get()
+        POOL_WAIT.labels("sqlite_readers").observe(time.perf_counter() - start)
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+
+    async def add_message(self, user_id: int, guild_id: int, xp_gain: int, messages: int) -> tuple[int, int, int, int, str]:
+        self.statements += 1
+        async with self._writer() as conn:
+            async with conn.execute(SQLITE_ADD_MESSAGE, (user_id, guild_id, xp_gain, messages)) as cur:
+                row = await cur.fetchone()
+        await self._commit()
+        return int(row[0]), int(row[2]), int(row[1]), int(row[3]), str(row[4])
+
+    async def add_messages(self, rows: list[DeltaRow]) -> None:
+        self.statements += len(rows)
+        async with self._writer() as conn:
+            await conn.executemany(
+                SQLITE_ADD_MESSAGES,
+                [
+                    (user_id, guild_id, xp, messages, level, last_active.strftime("%Y-%m-%d %H:%M:%S"))
+                    for user_id, guild_id, xp, messages, level, last_active in rows
+                ],
+            )
+        await self._commit()
+
+    async def set_level(self, user_id: int, guild_id: int, level: int) -> None:
+        self.statements += 1
+        async with self._writer() as conn:
+            await conn.execute(
+                "UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?",
+                (level, user_id, guild_id),
+            )
+        await self._commit()
+
+    async def fetch_stats(self, user_id: int, guild_id: int) -> Optional[Stats]:
+        self.statements += 1
+        async with self._reader() as conn, conn.execute(
+            "SELECT xp, level, messages, COALESCE(last_active, '') FROM users WHERE user_id = ? AND guild_id = ?",
+            (user_id, guild_id),
+        ) as cur:
+            row = await cur.fetchone()
+            if row:
+                return int(row[0]), int(row[1]), int(row[2]), str(row[3])
+            return None
+
+    async def fetch_stats_many(self, keys: list[tuple[int, int]]) -> dict[tuple[int, int], Stats]:
+        self.statements += 1
+        values = ", ".join("(?, ?)" for _ in keys)
+        async with self._reader() as conn, conn.execute(
+            "SELECT user_id, guild_id, xp, level, messages, COALESCE(last_active, '') FROM users "
+            f"WHERE (user_id, guild_id) IN (VALUES {values})",
+            [value for key in keys for value in key],
+        ) as cur:
+            rows = await cur.fetchall()
+        return {(int(r[0]), int(r[1])): (int(r[2]), int(r[3]), int(r[4]), str(r[5])) for r in rows}
+
+    async def fetch_guild_xp(self, guild_id: int) -> list[tuple[int, int]]:
+        # Served by idx_users_guild_xp
+        self.statements += 1
+        async with self._reader() as conn, conn.execute(
+            "SELECT user_id, xp FROM users WHERE guild_id = ? ORDER BY xp DESC",
+            (guild_id,),
+        ) as cur:
+            return [(int(user_id), int(xp)) for user_id, xp in await cur.fetchall()]
+
+    async def iter_users(self, guild_id: Optional[int], batch_size: int) -> AsyncIterator[list[UserRow]]:
+        query = "SELECT user_id, guild_id, xp, level, messages, COALESCE(last_active, '') FROM users"
+        args: tuple = ()
+        if guild_id is not None:
+            query += " WHERE guild_id = ?"
+            args = (guild_id,)
+        self.statements += 1
+        async with self._reader() as conn, conn.execute(query + " ORDER BY guild_id, user_id", args) as cur:
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+
+    async def import_users(
+        self, batches: Iterable[list[ImportRow]], mode: str, progress: Optional[Callable[[int], None]],
+    ) -> tuple[int, set[int]]:
+        """executemany per batch on the writer connection, committed batch by batch.
+
+        A single long transaction would hold the write lock for the whole import and
+        make live XP writes fail with "database is locked"; per-batch group commits
+        let them interleave. Rows of batches committed before an error stay imported.
+        """
+        total = 0
+        guilds: set[int] = set()
+        for batch in batches:
+            async with self._writer() as conn:
+                await conn.executemany(SQLITE_IMPORT[mode], [_format_time(row) for row in batch])
+            await self._commit()
+            total += len(batch)
+            guilds.update(row[1] for row in batch)
+            if progress is not None:
+                progress(total)
+        self.statements += total
+        return total, guilds
+
+    async def add_activity(self, rows: list[tuple[int, int, int, int]]) -> None:
+        self.statements += len(rows)
+        async with self._writer() as conn:
+            await conn.executemany(SQLITE_ADD_ACTIVITY, rows)
+        await self._commit()
+
+    async def get_activity(self, guild_id: int, since: int, user_id: Optional[int]) -> list[tuple[int, int]]:
+        # One range scan over the primary key (member) or idx_activity_guild_bucket (guild)
+        query = "SELECT bucket - bucket % 86400 AS day, SUM(messages) FROM activity WHERE guild_id = ? AND bucket >= ?"
+        args: tuple = (guild_id, since)
+        if user_id is not None:
+            query += " AND user_id = ?"
+            args += (user_id,)
+        self.statements += 1
+        async with self._reader() as conn, conn.execute(query + " GROUP BY day ORDER BY day", args) as cur:
+            return [(int(day), int(messages)) for day, messages in await cur.fetchall()]
+
+    async def compact_activity(self, hourly_before: int, delete_before: int) -> None:
+        self.statements += 5
+        # One transaction of its own: a group commit between the fold and the deletes
+        # would leave the hours counted twice (or lost) after a crash. Holding the writer
+        # throughout keeps other writes and commits out; theirs is committed first.
+        async with self._writer() as conn:
+            await conn.commit()
+            try:
+                await conn.execute(SQLITE_COMPACT_ACTIVITY, (hourly_before,))
+                await conn.execute("DELETE FROM activity WHERE bucket < ? AND bucket % 86400 != 0", (hourly_before,))
+                await conn.execute("DELETE FROM activity WHERE bucket < ?", (delete_before,))
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
+    # Guild settings
+    async def fetch_guild_settings(self) -> list[SettingsRow]:
+        self.statements += 1
+        async with self._reader() as conn, conn.execute(
+            f"SELECT {', '.join(SETTINGS_COLUMNS)} FROM guild_settings"
+        ) as cur:
+            return [tuple(row) for row in await cur.fetchall()]
+
+    async def save_guild_settings(self, row: SettingsRow) -> None:
+        self.statements += 1
+        async with self._writer() as conn:
+            await conn.execute(SQLITE_SAVE_SETTINGS, row)
+        await self._commit()
+
+    async def delete_guild_settings(self, guild_id: int) -> None:
+        self.statements += 1
+        async with self._writer() as conn:
+            await conn.execute("DELETE FROM guild_settings WHERE guild_id = ?", (guild_id,))
+        await self._commit()
+
+    # Automod
+    async def fetch_automod_rules(self) -> list[AutomodRule]:
+        self.statements += 1
+        async with self._reader() as conn, conn.execute("SELECT guild_id, kind, pattern FROM automod_rules") as cur:
+            return [tuple(row) for row in await cur.fetchall()]
+
+    async def add_automod_rule(self, rule: AutomodRule) -> None:
+        self.statements += 1
+        async with self._writer() as conn:
+            await conn.execute("INSERT OR IGNORE INTO automod_rules (guild_id, kind, pattern) VALUES (?, ?, ?)", rule)
+        await self._commit()
+
+    async def delete_automod_rule(self, rule: AutomodRule) -> bool:
+        self.statements += 1
+        async with self._writer() as conn:
+            cur = await conn.execute(
+                "DELETE FROM automod_rules WHERE guild_id = ? AND kind = ? AND pattern = ?", rule,
+            )
+        await self._commit()
+        return cur.rowcount > 0
+
+    async def fetch_automod_actions(self) -> list[tuple[int, str]]:
+        self.statements += 1
+        async with self._reader() as conn, conn.execute("SELECT guild_id, action FROM automod_actions") as cur:
+            return [tuple(row) for row in await cur.fetchall()]
+
+    async def save_automod_action(self, guild_id: int, action: str) -> None:
+        self.statements += 1
+        async with self._writer() as conn:
+            await conn.execute(
+                "INSERT INTO automod_actions (guild_id, action) VALUES (?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET action = excluded.action",
+                (guild_id, action),
+            )
+        await self._commit()
@@ -1,27 +1,181 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+from datetime import datetime, timezone
+from typing import Optional
 
+from metrics import REGISTRY
+from ratelimit import TokenBucket, parse_rate
 
-def setup_logging(level: int = logging.INFO) -> None:
+_listener: Optional[logging.handlers.QueueListener] = None
+_filters: list[tuple[logging.Logger, logging.Filter]] = []
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text format that also notes how many records a rate limit suppressed."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" [+{suppressed} suppressed]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token-bucket limit for records below WARNING; warnings and errors always pass.
+
+    The next record let through carries the number of records dropped in between.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        super().__init__()
+        self.bucket = TokenBucket(rate, burst)
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if not self.bucket.try_acquire():
+            self.suppressed += 1
+            return False
+        if self.suppressed:
+            record.suppressed = self.suppressed
+            self.suppressed = 0
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a random `ratio` of records below WARNING."""
+
+    def __init__(self, ratio: float) -> None:
+        super().__init__()
+        self.ratio = ratio
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.ratio
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller and leaves formatting to the listener thread."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message now since its args may change once we return, but leave
+        # timestamps, JSON encoding and traceback formatting to the listener thread.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_rules(spec: Optional[str]) -> dict[str, str]:
+    """Parse "logger=value,other=value" into a dict."""
+    rules = {}
+    for part in (spec or "").split(","):
+        name, sep, value = part.partition("=")
+        if sep and name.strip():
+            rules[name.strip()] = value.strip()
+    return rules
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the background listener, if any. Safe to call twice."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    use_queue: bool = True,
+    json_format: bool = False,
+    rate_limits: Optional[str] = None,
+    sampling: Optional[str] = None,
+    queue_size: int = 10_000,
+) -> None:
     """Configure centralized logging for the bot.
 
-    Format includes time, level, logger name, and message.
+    Format includes time, level, logger name, and message (or one JSON object per line).
+    With use_queue, records go through a bounded queue to a background listener thread
+    that does the formatting and I/O until stop_logging() (also run at exit).
+    `rate_limits` ("decorators=20/s,levels=5/s") and `sampling` ("decorators=0.1")
+    thin out high-volume loggers below WARNING.
     """
+    global _listener
     root = logging.getLogger()
     if root.handlers:
         # Avoid duplicate handlers when reloading
         for h in list(root.handlers):
             root.removeHandler(h)
+    stop_logging()
+    for logger, log_filter in _filters:
+        logger.removeFilter(log_filter)
+    _filters.clear()
 
     handler = logging.StreamHandler(stream=sys.stdout)
-    formatter = logging.Formatter(
-        fmt="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
-    handler.setFormatter(formatter)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter(fmt=TEXT_FORMAT, datefmt=DATE_FORMAT))
 
     root.setLevel(level)
-    root.addHandler(handler)
+    if use_queue:
+        queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        REGISTRY.counter("bot_log_records_dropped_total", "Log records dropped because the log queue was full") \
+            .set_function(lambda: queue_handler.dropped)
+        _listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+        _listener.start()
+        root.addHandler(queue_handler)
+    else:
+        root.addHandler(handler)
+
+    # Logger-level filters drop records before they reach any handler or the queue
+    for name, spec in _parse_rules(rate_limits).items():
+        _filters.append((logging.getLogger(name), RateLimitFilter(*parse_rate(spec))))
+    for name, ratio in _parse_rules(sampling).items():
+        _filters.append((logging.getLogger(name), SamplingFilter(float(ratio))))
+    for logger, log_filter in _filters:
+        logger.addFilter(log_filter)
 
     # Reduce noise from external libs
     logging.getLogger("discord.gateway").setLevel(logging.WARNING)
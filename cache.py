@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Iterator, TypeVar
+
+V = TypeVar("V")
+
+MISSING: Any = object()
+
+
+class TTLCache(Generic[V]):
+    """Bounded LRU cache whose entries also expire `ttl` seconds after being written.
+
+    get() returns MISSING on a miss so that None can be cached as a value.
+    Keeps hit/miss/eviction counters for monitoring.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> V:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key: Hashable, value: V) -> None:
+        """Set key only if it has no live entry."""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            self.set(key, value)
+
+    def peek(self, key: Hashable) -> V:
+        """Like get() but without touching recency or counters."""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return MISSING
+        return item[1]
+
+    def items(self) -> Iterator[tuple[Hashable, V]]:
+        """Live entries, least recently used first, without touching recency or counters."""
+        now = time.monotonic()
+        for key, (expires, value) in list(self._data.items()):
+            if expires >= now:
+                yield key, value
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def info(self) -> dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,131 @@
+"""Cluster launcher: split the bot's shards across several worker processes.
+
+Each worker runs main.main() with an AutoShardedBot for its shard range and its
+own Database pool, so gateway and XP processing scale with CPU cores.
+
+    CLUSTER_PROCESSES=4 SHARD_COUNT=16 python cluster.py
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from dotenv import load_dotenv
+
+from bot_logging import setup_logging
+from main import get_env, main
+
+logger = logging.getLogger("cluster")
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+async def recommended_shard_count(token: str) -> int:
+    """Ask Discord how many shards it recommends for this bot."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_BOT_URL, headers={"Authorization": f"Bot {token}"}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            return int(data["shards"])
+
+
+def split_shards(shard_count: int, processes: int) -> list[list[int]]:
+    """Split shard ids into contiguous, near-equal ranges, one per process."""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+def run_worker(cluster_id: int, shard_ids: list[int], shard_count: int) -> None:
+    asyncio.run(main(shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id))
+
+
+class Cluster:
+    """Starts one worker process per shard range, restarts crashed workers and stops them together."""
+
+    def __init__(self, shard_count: int, processes: int, stop_timeout: float = 30.0) -> None:
+        self.shard_count = shard_count
+        self.ranges = split_shards(shard_count, processes)
+        self.stop_timeout = stop_timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers: dict[int, multiprocessing.Process] = {}
+        self._stopping = False
+
+    def _start_worker(self, cluster_id: int) -> None:
+        shard_ids = self.ranges[cluster_id]
+        proc = self._ctx.Process(
+            target=run_worker, args=(cluster_id, shard_ids, self.shard_count), name=f"cluster-{cluster_id}",
+        )
+        proc.start()
+        self._workers[cluster_id] = proc
+        logger.info("Started cluster %d (pid %s) with shards %s", cluster_id, proc.pid, shard_ids)
+
+    def request_stop(self, *_args) -> None:
+        self._stopping = True
+
+    def run(self, poll_interval: float = 1.0) -> None:
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        for cluster_id in range(len(self.ranges)):
+            self._start_worker(cluster_id)
+
+        restarts: dict[int, float] = {}
+        while not self._stopping:
+            time.sleep(poll_interval)
+            for cluster_id, proc in list(self._workers.items()):
+                if proc.is_alive() or self._stopping:
+                    continue
+                logger.error("Cluster %d exited with code %s", cluster_id, proc.exitcode)
+                # Back off if a worker keeps crashing right after start
+                if time.monotonic() - restarts.get(cluster_id, 0) < 30:
+                    time.sleep(5)
+                restarts[cluster_id] = time.monotonic()
+                self._start_worker(cluster_id)
+        self.stop()
+
+    def stop(self) -> None:
+        logger.info("Stopping %d cluster workers...", len(self._workers))
+        for proc in self._workers.values():
+            if proc.is_alive():
+                proc.terminate()  # SIGTERM: each worker closes its gateway and flushes its database state
+        deadline = time.monotonic() + self.stop_timeout
+        for cluster_id, proc in self._workers.items():
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                logger.warning("Cluster %d did not stop in time, killing it", cluster_id)
+                proc.kill()
+                proc.join()
+        logger.info("All cluster workers stopped")
+
+
+def launch(shard_count: Optional[int] = None, processes: Optional[int] = None) -> None:
+    load_dotenv()
+    setup_logging()
+    token = get_env("DISCORD_TOKEN", required=True)
+    if shard_count is None:
+        configured = get_env("SHARD_COUNT")
+        shard_count = int(configured) if configured else asyncio.run(recommended_shard_count(token))
+    if processes is None:
+        processes = int(get_env("CLUSTER_PROCESSES", default=str(os.cpu_count() or 1)))
+    processes = min(processes, shard_count)
+    database_url = get_env("DATABASE_URL") or ""
+    parsed = urlparse(database_url)
+    if processes > 1 and parsed.scheme == "memory" and parsed.netloc + parsed.path:
+        # Each worker would replay and compact the same log with only its own state
+        raise RuntimeError("A persisted memory:// database can only be used by one process; set CLUSTER_PROCESSES=1")
+    logger.info("Launching %d shards across %d processes", shard_count, processes)
+    Cluster(shard_count, processes).run()
+
+
+if __name__ == "__main__":
+    launch()
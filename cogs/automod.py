@@ -0,0 +1,156 @@
+import logging
+import time
+from datetime import timedelta
+
+import discord
+from discord.ext import commands
+
+from automod import ACTIONS, KINDS, Automod
+from decorators import command_policy, pipeline
+from metrics import REGISTRY
+
+logger = logging.getLogger("automod")
+
+CHECK_DURATION = REGISTRY.histogram(
+    "bot_automod_check_duration_seconds", "Automod matching time per message",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05),
+)
+MATCHES = REGISTRY.counter("bot_automod_matches_total", "Messages removed by automod", ("kind", "action"))
+
+RULE_LIST_LIMIT = 1900
+
+
+@pipeline
+class AutomodCog(commands.Cog):
+    """Removes messages with banned words, regexes or links, then warns or times out repeat offenders.
+
+    Members who can manage messages are exempt. Matching runs on every new or
+    edited message against the guild's compiled filter, so its cost depends on the
+    message length rather than on the number of rules.
+    """
+
+    def __init__(self, bot: commands.Bot, automod: Automod) -> None:
+        self.bot = bot
+        self.automod = automod
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        await self._check(message)
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        if before.content != after.content:
+            await self._check(after)
+
+    async def _check(self, message: discord.Message) -> None:
+        if message.author.bot or message.guild is None or not message.content:
+            return
+        matcher = self.automod.filter(message.guild.id)
+        if matcher is None:
+            return
+        start = time.perf_counter()
+        hit = matcher.check(message.content)
+        CHECK_DURATION.observe(time.perf_counter() - start)
+        if hit is None:
+            return
+        # Only resolved on a hit: permissions are computed from the member's roles
+        author = message.author
+        if isinstance(author, discord.Member) and author.guild_permissions.manage_messages:
+            return
+        await self._enforce(message, *hit)
+
+    async def _enforce(self, message: discord.Message, kind: str, pattern: str) -> None:
+        guild = message.guild
+        action = self.automod.action(guild.id)
+        MATCHES.labels(kind, action).inc()
+        logger.info("Automod removed a message by %s in #%s (%s: %s)", message.author, message.channel, kind, pattern)
+        try:
+            await message.delete()
+        except discord.NotFound:
+            pass
+        except discord.Forbidden:
+            logger.warning("Automod cannot delete messages in #%s of guild %s", message.channel, guild.id)
+            return
+        if action == "delete":
+            return
+
+        mention = message.author.mention
+        if action == "escalate" and isinstance(message.author, discord.Member):
+            strikes = self.automod.strike(guild.id, message.author.id)
+            if strikes >= self.automod.strikes:
+                self.automod.pardon(guild.id, message.author.id)
+                try:
+                    await message.author.timeout(
+                        timedelta(seconds=self.automod.timeout), reason=f"Automod: {strikes} violations",
+                    )
+                    await message.channel.send(
+                        f"🔇 {mention} was timed out for {self.automod.timeout / 60:.0f} minutes after repeated violations.",
+                    )
+                    return
+                except discord.HTTPException:
+                    logger.warning("Automod could not time out %s in guild %s", message.author, guild.id)
+            else:
+                await message.channel.send(
+                    f"⚠️ {mention}, your message broke this server's rules "
+                    f"(strike {strikes}/{self.automod.strikes}).",
+                    delete_after=10,
+                )
+                return
+        await message.channel.send(f"⚠️ {mention}, your message broke this server's rules.", delete_after=10)
+
+    @commands.group(name="automod", invoke_without_command=True, help="Show this server's automod rules. Usage: !automod")
+    @command_policy(manage_guild=True)
+    async def automod(self, ctx: commands.Context):
+        rules = self.automod.rules(ctx.guild.id)
+        header = f"Action: **{self.automod.action(ctx.guild.id)}** | {len(rules)} rules"
+        lines = [f"`{kind}` {discord.utils.escape_markdown(pattern)}" for kind, pattern in rules]
+        body = "\n".join(lines)
+        if len(body) > RULE_LIST_LIMIT:
+            body = body[:RULE_LIST_LIMIT].rsplit("\n", 1)[0] + "\n…"
+        await ctx.reply(f"{header}\n{body}" if body else f"{header}\nNo rules yet. Add one with !automod add.")
+
+    @automod.command(name="add", help="Add a rule. Usage: !automod add <word|regex|link> <pattern>")
+    @command_policy(manage_guild=True)
+    async def automod_add(self, ctx: commands.Context, kind: str, *, pattern: str):
+        try:
+            stored = await self.automod.add(ctx.guild.id, kind.lower(), pattern)
+        except ValueError as e:
+            await ctx.reply(f"❗ {e}")
+            return
+        logger.info("%s added automod %s rule %r in guild %s", ctx.author, kind, stored, ctx.guild.id)
+        await ctx.reply(f"✅ Added {kind.lower()} rule `{stored}`.")
+
+    @automod.command(name="remove", help="Remove a rule. Usage: !automod remove <word|regex|link> <pattern>")
+    @command_policy(manage_guild=True)
+    async def automod_remove(self, ctx: commands.Context, kind: str, *, pattern: str):
+        if kind.lower() not in KINDS:
+            await ctx.reply(f"Kind must be one of: {', '.join(KINDS)}.")
+            return
+        if not await self.automod.remove(ctx.guild.id, kind.lower(), pattern):
+            await ctx.reply("No such rule.")
+            return
+        logger.info("%s removed automod %s rule %r in guild %s", ctx.author, kind, pattern, ctx.guild.id)
+        await ctx.reply("✅ Rule removed.")
+
+    @automod.command(
+        name="action",
+        help="Set what happens to matching messages. Usage: !automod action <delete|warn|escalate>",
+    )
+    @command_policy(manage_guild=True)
+    async def automod_action(self, ctx: commands.Context, action: str):
+        action = action.lower()
+        if action not in ACTIONS:
+            await ctx.reply(f"Action must be one of: {', '.join(ACTIONS)}.")
+            return
+        await self.automod.set_action(ctx.guild.id, action)
+        await ctx.reply(f"✅ Automod action set to **{action}**.")
+
+    @automod.command(name="test", help="Check text against the rules without acting. Usage: !automod test <text>")
+    @command_policy(manage_guild=True)
+    async def automod_test(self, ctx: commands.Context, *, text: str):
+        matcher = self.automod.filter(ctx.guild.id)
+        hit = matcher.check(text) if matcher is not None else None
+        if hit is None:
+            await ctx.reply("✅ No rule matches.")
+        else:
+            await ctx.reply(f"🚫 Matches {hit[0]} rule `{hit[1]}`.")
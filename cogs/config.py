@@ -0,0 +1,115 @@
+import logging
+from typing import Optional
+
+import discord
+from discord.ext import commands
+
+from decorators import command_policy, pipeline
+from guild_settings import MAX_PREFIX_LENGTH, MAX_XP_GAIN, GuildSettingsStore
+
+logger = logging.getLogger("config")
+
+
+@pipeline
+class ConfigCog(commands.Cog):
+    """Per-server settings: command prefix, XP range, ignored channels and level-up channel."""
+
+    def __init__(self, bot: commands.Bot, settings: GuildSettingsStore) -> None:
+        self.bot = bot
+        self.settings = settings
+
+    async def _update(self, ctx: commands.Context, reply: str, **changes) -> None:
+        try:
+            await self.settings.update(ctx.guild.id, **changes)
+        except Exception:
+            logger.exception("Failed to save settings for guild %s", ctx.guild.id)
+            await ctx.reply("⚠️ Could not save the setting, try again later.")
+            return
+        logger.info("%s changed settings of guild %s: %s", ctx.author, ctx.guild.id, changes)
+        await ctx.reply(reply)
+
+    async def _set_ignored(self, ctx: commands.Context, channel: discord.abc.GuildChannel, ignored: bool) -> None:
+        try:
+            changed = await self.settings.set_ignored(ctx.guild.id, channel.id, ignored)
+        except Exception:
+            logger.exception("Failed to save settings for guild %s", ctx.guild.id)
+            await ctx.reply("⚠️ Could not save the setting, try again later.")
+            return
+        if not changed:
+            await ctx.reply(f"{channel.mention} is {'already' if ignored else 'not'} ignored.")
+            return
+        logger.info("%s %s #%s in guild %s", ctx.author, "ignored" if ignored else "unignored", channel, ctx.guild.id)
+        await ctx.reply(f"✅ {channel.mention} no longer earns XP." if ignored else f"✅ {channel.mention} earns XP again.")
+
+    @commands.group(name="config", invoke_without_command=True, help="Show this server's settings. Usage: !config")
+    @command_policy(manage_guild=True)
+    async def config(self, ctx: commands.Context):
+        settings = self.settings.get(ctx.guild.id)
+        announce = f"<#{settings.announce_channel_id}>" if settings.announce_channel_id else "where the member posted"
+        ignored = " ".join(f"<#{channel_id}>" for channel_id in sorted(settings.ignored_channels)) or "none"
+        embed = discord.Embed(title=f"Settings for {ctx.guild.name}", color=discord.Color.blurple())
+        embed.add_field(name="Prefix", value=f"`{settings.prefix}`")
+        embed.add_field(name="XP per message", value=f"{settings.xp_min}-{settings.xp_max}")
+        embed.add_field(name="Level-up announcements", value=announce, inline=False)
+        embed.add_field(name="Channels without XP", value=ignored, inline=False)
+        await ctx.reply(embed=embed)
+
+    @config.command(name="prefix", help="Set the command prefix, or restore the default. Usage: !config prefix [prefix]")
+    @command_policy(manage_guild=True)
+    async def config_prefix(self, ctx: commands.Context, prefix: Optional[str] = None):
+        if prefix is not None and len(prefix) > MAX_PREFIX_LENGTH:
+            await ctx.reply(f"The prefix can be at most {MAX_PREFIX_LENGTH} characters.")
+            return
+        shown = prefix or self.settings.defaults.prefix
+        await self._update(ctx, f"✅ Prefix set to `{shown}`.", prefix=prefix)
+
+    @config.command(name="xp", help="Set the XP range per message, or restore the default. Usage: !config xp [min] [max]")
+    @command_policy(manage_guild=True)
+    async def config_xp(self, ctx: commands.Context, xp_min: Optional[int] = None, xp_max: Optional[int] = None):
+        if xp_min is None:
+            defaults = self.settings.defaults
+            await self._update(
+                ctx, f"✅ XP per message reset to {defaults.xp_min}-{defaults.xp_max}.", xp_min=None, xp_max=None,
+            )
+            return
+        xp_max = xp_min if xp_max is None else xp_max
+        if not 0 <= xp_min <= xp_max <= MAX_XP_GAIN:
+            await ctx.reply(f"XP must satisfy 0 <= min <= max <= {MAX_XP_GAIN}.")
+            return
+        await self._update(ctx, f"✅ Members now earn {xp_min}-{xp_max} XP per message.", xp_min=xp_min, xp_max=xp_max)
+
+    @config.command(name="ignore", help="Stop XP gain in a channel. Usage: !config ignore #channel")
+    @command_policy(manage_guild=True)
+    async def config_ignore(self, ctx: commands.Context, channel: discord.abc.GuildChannel):
+        await self._set_ignored(ctx, channel, True)
+
+    @config.command(name="unignore", help="Allow XP gain in a channel again. Usage: !config unignore #channel")
+    @command_policy(manage_guild=True)
+    async def config_unignore(self, ctx: commands.Context, channel: discord.abc.GuildChannel):
+        await self._set_ignored(ctx, channel, False)
+
+    @config.command(
+        name="announce",
+        help="Post level-ups in one channel, or where members post without one. Usage: !config announce [#channel]",
+    )
+    @command_policy(manage_guild=True)
+    async def config_announce(self, ctx: commands.Context, channel: Optional[discord.TextChannel] = None):
+        if channel is None:
+            await self._update(ctx, "✅ Level-ups are announced where the member posted.", announce_channel_id=None)
+            return
+        if not channel.permissions_for(ctx.guild.me).send_messages:
+            await ctx.reply(f"I can't send messages in {channel.mention}.")
+            return
+        await self._update(ctx, f"✅ Level-ups are announced in {channel.mention}.", announce_channel_id=channel.id)
+
+    @config.command(name="reset", help="Restore every setting to the default. Usage: !config reset")
+    @command_policy(manage_guild=True)
+    async def config_reset(self, ctx: commands.Context):
+        try:
+            await self.settings.reset(ctx.guild.id)
+        except Exception:
+            logger.exception("Failed to reset settings for guild %s", ctx.guild.id)
+            await ctx.reply("⚠️ Could not reset the settings, try again later.")
+            return
+        logger.info("%s reset settings of guild %s", ctx.author, ctx.guild.id)
+        await ctx.reply(f"✅ Settings restored to the defaults (prefix `{self.settings.defaults.prefix}`).")
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import tempfile
+from typing import Optional
+
+import discord
+from discord.ext import commands
+
+from db import Database
+from decorators import command_policy, pipeline
+from transfer import FORMATS, Progress, detect_format, export_users, import_users
+from xp_buffer import XPBuffer
+
+logger = logging.getLogger("data")
+
+
+@pipeline
+class DataCog(commands.Cog):
+    """Export and import this server's XP data as CSV or JSON Lines."""
+
+    def __init__(self, bot: commands.Bot, db: Database | XPBuffer) -> None:
+        self.bot = bot
+        self.db = db
+        self._busy: set[int] = set()
+        # Progress edits in flight; referenced here so they are not collected mid-request
+        self._edits: set[asyncio.Task] = set()
+
+    def _progress(self, label: str, status: discord.Message) -> Progress:
+        def report(text: str) -> None:
+            task = asyncio.create_task(status.edit(content=f"⏳ {text}"))
+            self._edits.add(task)
+            task.add_done_callback(self._edit_done)
+
+        return Progress(label, report, interval=5.0)
+
+    def _edit_done(self, task: asyncio.Task) -> None:
+        self._edits.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Could not update progress message: %s", task.exception())
+
+    @commands.command(name="export", help="Export this server's XP data. Usage: !export [csv|jsonl]")
+    @command_policy(administrator=True, guild_cooldown="2/m")
+    async def export(self, ctx: commands.Context, fmt: str = "csv"):
+        if fmt not in FORMATS:
+            await ctx.reply(f"Format must be one of: {', '.join(FORMATS)}.")
+            return
+        if ctx.guild.id in self._busy:
+            await ctx.reply("An export or import is already running for this server.")
+            return
+        self._busy.add(ctx.guild.id)
+        status = await ctx.reply("⏳ Exporting...")
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, f"xp-{ctx.guild.id}.{fmt}")
+                progress = self._progress("Exported", status)
+                with open(path, "w", newline="", encoding="utf-8") as fp:
+                    rows = await export_users(self.db, fp, fmt, ctx.guild.id, progress)
+                if os.path.getsize(path) > ctx.guild.filesize_limit:
+                    await status.edit(content=f"❗ The export ({rows} rows) is larger than this server's upload limit.")
+                    return
+                await ctx.reply(file=discord.File(path))
+                await status.edit(content=f"✅ {progress.summary()}")
+        except Exception:
+            logger.exception("Export failed for guild %s", ctx.guild.id)
+            await status.edit(content="⚠️ Export failed.")
+        finally:
+            self._busy.discard(ctx.guild.id)
+
+    @commands.command(
+        name="import",
+        help=(
+            "Import XP data from an attached CSV/JSONL file into this server. "
+            "Usage: !import [replace|add] (with the file attached)"
+        ),
+    )
+    @command_policy(administrator=True, guild_cooldown="2/m")
+    async def import_(self, ctx: commands.Context, mode: str = "replace"):
+        if mode not in ("replace", "add"):
+            await ctx.reply("Mode must be `replace` or `add`.")
+            return
+        attachment: Optional[discord.Attachment] = ctx.message.attachments[0] if ctx.message.attachments else None
+        if attachment is None:
+            await ctx.reply("Attach a .csv or .jsonl file to import.")
+            return
+        if ctx.guild.id in self._busy:
+            await ctx.reply("An export or import is already running for this server.")
+            return
+        self._busy.add(ctx.guild.id)
+        status = await ctx.reply("⏳ Importing...")
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "import")
+                await attachment.save(path)
+                progress = self._progress("Imported", status)
+                with open(path, newline="", encoding="utf-8") as fp:
+                    # Every row goes into this server, whatever guild_id the file has
+                    await import_users(self.db, fp, detect_format(attachment.filename), mode, ctx.guild.id, progress)
+            await status.edit(content=f"✅ {progress.summary()}")
+            logger.info("%s imported %d users (%s) into %s", ctx.author, progress.rows, mode, ctx.guild)
+        except ValueError as e:
+            await status.edit(content=f"❗ Nothing was imported: {e}")
+        except Exception:
+            logger.exception("Import failed for guild %s", ctx.guild.id)
+            await status.edit(content="⚠️ Import failed.")
+        finally:
+            self._busy.discard(ctx.guild.id)
@@ -4,7 +4,7 @@ import random
 import discord
 from discord.ext import commands
 
-from decorators import command_logger, timing
+from decorators import pipeline
 
 logger = logging.getLogger("fun")
 
@@ -16,6 +16,7 @@ ADVICE = [
 ]
 
 
+@pipeline
 class FunCog(commands.Cog):
     """Interactive fun/assistant commands."""
 
@@ -23,8 +24,6 @@ class FunCog(commands.Cog):
         self.bot = bot
 
     @commands.command(name="guess", help="Guess a number between 1 and 10. Usage: !guess 7")
-    @command_logger()
-    @timing()
     async def guess(self, ctx: commands.Context, pick: int):
         if not 1 <= pick <= 10:
             await ctx.reply("Pick a number between 1 and 10.")
@@ -37,8 +36,6 @@ class FunCog(commands.Cog):
             await ctx.reply(f"❌ Not quite. The number is {hint} than {pick}. It was {target}.")
 
     @commands.command(name="advice", help="Get a random piece of advice. Usage: !advice [topic]")
-    @command_logger()
-    @timing()
     async def advice(self, ctx: commands.Context, *, topic: str | None = None):
         if topic:
             msg = random.choice(ADVICE)
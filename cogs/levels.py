@@ -1,47 +1,137 @@
 import logging
-import math
 import random
+import time
+from datetime import datetime, timezone
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from db import Database
+from announcer import Announcer
+from db import Database, xp_to_level
+from decorators import pipeline
+from guild_settings import GuildSettingsStore
+from member_cache import Member
+from metrics import REGISTRY
+from xp_buffer import XPBuffer
+from xp_cooldown import XPCooldown
 
 logger = logging.getLogger("levels")
 
+ON_MESSAGE_DURATION = REGISTRY.histogram("bot_on_message_duration_seconds", "LevelsCog.on_message handling time")
+LEVEL_UPS = REGISTRY.counter("bot_level_ups_total", "Level-ups announced")
+COOLDOWN_MESSAGES = REGISTRY.counter("bot_xp_cooldown_messages_total", "Messages that earned no XP due to the cooldown")
 
-def xp_to_level(xp: int) -> int:
-    return int(math.sqrt(xp / 50))
+LEADERBOARD_PAGE_SIZE = 10
 
 
+@pipeline
 class LevelsCog(commands.Cog):
-    """XP and Level system stored in SQLite via aiosqlite."""
+    """XP and Level system stored in SQLite via aiosqlite.
 
-    def __init__(self, bot: commands.Bot, db: Database) -> None:
+    `db` may be an XPBuffer in front of the Database to batch writes. With a positive
+    `xp_cooldown`, a user earns XP at most once per that many seconds per guild; messages
+    in between are only counted in memory and credited with the next grant.
+    Level-up messages go through an Announcer so they never block on_message.
+    The XP range, ignored channels and level-up channel come from the guild's cached settings.
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        db: Database | XPBuffer,
+        xp_cooldown: float = 0,
+        announcer: Announcer | None = None,
+        settings: GuildSettingsStore | None = None,
+    ) -> None:
         self.bot = bot
         self.db = db
+        self.settings = settings or GuildSettingsStore()
+        self.cooldown = XPCooldown(xp_cooldown) if xp_cooldown > 0 else None
+        self.announcer = announcer or Announcer()
+
+    async def cog_load(self) -> None:
+        if self.cooldown is not None:
+            self.evict_cooldowns.change_interval(seconds=max(self.cooldown.window, 10))
+            self.evict_cooldowns.start()
+
+    async def cog_unload(self) -> None:
+        await self.announcer.close()
+        if self.cooldown is not None:
+            self.evict_cooldowns.cancel()
+            await self._credit_messages(self.cooldown.drain())
+
+    async def _credit_messages(self, leftovers: list[tuple[int, int, int]]) -> None:
+        if not leftovers:
+            return
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.add_messages([(user_id, guild_id, 0, count, 0, now) for guild_id, user_id, count in leftovers])
+        except Exception:
+            logger.exception("Failed to record cooldown messages for %d users", len(leftovers))
+
+    @tasks.loop(seconds=60)
+    async def evict_cooldowns(self):
+        # Idle users leave the cooldown table; their uncredited messages are written now
+        await self._credit_messages(self.cooldown.evict())
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if message.author.bot or message.guild is None:
             return
+        settings = self.settings.get(message.guild.id)
+        if settings.ignored_channels and (
+            message.channel.id in settings.ignored_channels
+            or getattr(message.channel, "parent_id", None) in settings.ignored_channels
+        ):
+            return
+
+        credited = 1
+        if self.cooldown is not None:
+            credited = self.cooldown.hit(message.guild.id, message.author.id)
+            if not credited:
+                COOLDOWN_MESSAGES.inc()
+                return
 
-        xp_gain = random.randint(5, 10)
-        xp, current_level = await self.db.add_message(message.author.id, message.guild.id, xp_gain)
-        new_level = xp_to_level(xp)
-        if new_level > current_level:
-            await self.db.set_level(message.author.id, message.guild.id, new_level)
-            try:
-                await message.channel.send(f"🎉 {message.author.mention} leveled up to level {new_level}!")
-            except Exception:
-                logger.exception("Failed to send level up message")
+        start = time.perf_counter()
+        xp_gain = random.randint(settings.xp_min, settings.xp_max)
+        xp, old_level, new_level = await self.db.add_message(
+            message.author.id, message.guild.id, xp_gain, messages=credited,
+        )
+        ON_MESSAGE_DURATION.observe(time.perf_counter() - start)
+        if new_level > old_level:
+            LEVEL_UPS.inc()
+            channel = message.channel
+            if settings.announce_channel_id is not None:
+                channel = message.guild.get_channel(settings.announce_channel_id) or channel
+            self.announcer.announce(channel, f"🎉 {message.author.mention} leveled up to level {new_level}!")
 
     @commands.command(name="rank", help="Show your level and XP. Usage: !rank [@user]")
-    async def rank(self, ctx: commands.Context, member: discord.Member | None = None):
+    async def rank(self, ctx: commands.Context, member: Member | None = None):
         member = member or ctx.author
         stats = await self.db.get_stats(member.id, ctx.guild.id)
         if not stats:
             await ctx.reply("No stats yet for this user.")
             return
         xp, level, messages, last_active = stats
-        await ctx.reply(f"📈 {member.mention} | Level: {level} | XP: {xp} | Messages: {messages}")
+        position = await self.db.get_rank(member.id, ctx.guild.id)
+        rank = f"#{position}" if position else "unranked"
+        await ctx.reply(f"📈 {member.mention} | Rank: {rank} | Level: {level} | XP: {xp} | Messages: {messages}")
+
+    @commands.command(name="leaderboard", aliases=["top"], help="Show the guild XP leaderboard. Usage: !leaderboard [page]")
+    async def leaderboard(self, ctx: commands.Context, page: int = 1):
+        if page < 1:
+            await ctx.reply("Page must be 1 or higher.")
+            return
+        offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+        entries, total = await self.db.get_leaderboard(ctx.guild.id, offset, LEADERBOARD_PAGE_SIZE)
+        if not entries:
+            await ctx.reply("No one is on this page of the leaderboard yet.")
+            return
+        pages = (total + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE
+        lines = [
+            f"**#{offset + i}** <@{user_id}> | Level: {xp_to_level(xp)} | XP: {xp}"
+            for i, (user_id, xp) in enumerate(entries, start=1)
+        ]
+        embed = discord.Embed(title=f"Leaderboard for {ctx.guild.name}", description="\n".join(lines), color=discord.Color.gold())
+        embed.set_footer(text=f"Page {page}/{pages} | {total} ranked users")
+        await ctx.reply(embed=embed)
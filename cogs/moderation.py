@@ -1,26 +1,61 @@
 import logging
+import re
 from typing import Optional
 
 import discord
 from discord.ext import commands
 
-from decorators import command_logger, timing, require_guild_permissions
+from decorators import command_policy, pipeline
+import member_cache
+from member_cache import CachedMemberConverter, Member
+from mass_action import MAX_TARGETS, parse_duration, partition_targets, run_mass_action, select_members
+from purge import PurgeFilters, PurgeManager
 
 logger = logging.getLogger("moderation")
 
+MAX_PURGE = 10_000
 
+
+class PurgeFlags(commands.FlagConverter):
+    """Optional filters for !clear, e.g. `user: @spammer contains: free nitro bots: yes`."""
+
+    user: Optional[discord.User] = None
+    contains: Optional[str] = None
+    bots: bool = False
+    attachments: bool = False
+    before: Optional[discord.Object] = None
+    after: Optional[discord.Object] = None
+
+
+class MassActionFlags(commands.FlagConverter):
+    """Selectors and options for !massban / !masskick, e.g. `joined: 10m name: ^spam reason: raid`."""
+
+    joined: Optional[str] = None
+    name: Optional[str] = None
+    reason: Optional[str] = None
+    dry_run: bool = commands.flag(name="dry", default=False)
+
+
+@pipeline
 class ModerationCog(commands.Cog):
     """Moderation commands like kick, ban, and clear."""
 
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
+        self.purges = PurgeManager()
+
+    async def cog_unload(self) -> None:
+        await self.purges.close()
 
     @commands.command(name="kick", help="Kick a member. Usage: !kick @member [reason]")
-    @command_logger()
-    @timing()
-    @require_guild_permissions(kick_members=True)
-    async def kick(self, ctx: commands.Context, member: discord.Member, *, reason: Optional[str] = None):
-        if ctx.author.top_role <= member.top_role and ctx.author != ctx.guild.owner:
+    @command_policy(kick_members=True)
+    async def kick(self, ctx: commands.Context, member: Member, *, reason: Optional[str] = None):
+        try:
+            member = await member_cache.refresh(member)
+        except discord.NotFound:
+            await ctx.reply("That member is no longer in this server.")
+            return
+        if ctx.author.top_role <= member.top_role and ctx.author.id != ctx.guild.owner_id:
             await ctx.reply("You cannot kick a member with an equal or higher role.")
             return
         try:
@@ -34,11 +69,14 @@ class ModerationCog(commands.Cog):
             await ctx.reply("An error occurred while trying to kick the member.")
 
     @commands.command(name="ban", help="Ban a member. Usage: !ban @member [reason]")
-    @command_logger()
-    @timing()
-    @require_guild_permissions(ban_members=True)
-    async def ban(self, ctx: commands.Context, member: discord.Member, *, reason: Optional[str] = None):
-        if ctx.author.top_role <= member.top_role and ctx.author != ctx.guild.owner:
+    @command_policy(ban_members=True)
+    async def ban(self, ctx: commands.Context, member: Member, *, reason: Optional[str] = None):
+        try:
+            member = await member_cache.refresh(member)
+        except discord.NotFound:
+            await ctx.reply("That member is no longer in this server.")
+            return
+        if ctx.author.top_role <= member.top_role and ctx.author.id != ctx.guild.owner_id:
             await ctx.reply("You cannot ban a member with an equal or higher role.")
             return
         try:
@@ -51,14 +89,116 @@ class ModerationCog(commands.Cog):
             logger.exception("Error banning member")
             await ctx.reply("An error occurred while trying to ban the member.")
 
-    @commands.command(name="clear", help="Clear N messages in this channel. Usage: !clear 10")
-    @command_logger()
-    @timing()
-    @require_guild_permissions(manage_messages=True)
-    async def clear(self, ctx: commands.Context, amount: int):
-        if amount <= 0 or amount > 500:
-            await ctx.reply("Please specify an amount between 1 and 500.")
+    @commands.group(
+        name="clear",
+        invoke_without_command=True,
+        help=(
+            "Clear up to N messages in this channel in the background. "
+            "Usage: !clear 1000 [user: @member] [contains: text] [bots: yes] [attachments: yes] "
+            "[before: message_id] [after: message_id]"
+        ),
+    )
+    @command_policy(manage_messages=True)
+    async def clear(self, ctx: commands.Context, amount: int, *, flags: PurgeFlags):
+        if amount <= 0 or amount > MAX_PURGE:
+            await ctx.reply(f"Please specify an amount between 1 and {MAX_PURGE}.")
+            return
+        filters = PurgeFilters(
+            author_id=flags.user.id if flags.user else None,
+            contains=flags.contains,
+            bots_only=flags.bots,
+            attachments_only=flags.attachments,
+            before=flags.before or ctx.message,
+            after=flags.after,
+        )
+        try:
+            await ctx.message.delete()
+        except discord.HTTPException:
+            pass
+        status = await ctx.send(f"🧹 Purge queued for {amount} messages ({filters.describe()})...")
+        job = self.purges.start(ctx.channel, ctx.author, amount, filters, status_message=status)
+        logger.info("%s started purge #%d of %s messages in #%s (%s)", ctx.author, job.id, amount, ctx.channel, filters.describe())
+
+    @clear.command(name="status", help="Show running purge jobs in this server. Usage: !clear status")
+    @command_policy(manage_messages=True)
+    async def clear_status(self, ctx: commands.Context):
+        jobs = self.purges.for_guild(ctx.guild.id)
+        if not jobs:
+            await ctx.reply("No purge jobs are running.")
             return
-        deleted = await ctx.channel.purge(limit=amount + 1)  # include the command message
-        await ctx.send(f"🧹 Deleted {max(len(deleted)-1,0)} messages.", delete_after=5)
-        logger.info("%s cleared %s messages in #%s", ctx.author, amount, ctx.channel)
+        await ctx.reply("\n".join(job.progress() for job in jobs))
+
+    @clear.command(name="cancel", help="Cancel a purge job, or all of them. Usage: !clear cancel [job_id]")
+    @command_policy(manage_messages=True)
+    async def clear_cancel(self, ctx: commands.Context, job_id: Optional[int] = None):
+        jobs = [job for job in self.purges.for_guild(ctx.guild.id) if job_id is None or job.id == job_id]
+        if not jobs:
+            await ctx.reply("No matching purge job is running.")
+            return
+        for job in jobs:
+            self.purges.cancel(job)
+        await ctx.reply(f"🛑 Cancelled {len(jobs)} purge job(s).")
+
+    async def _mass_action(
+        self, ctx: commands.Context, action: str, members: list[discord.Member], flags: MassActionFlags
+    ) -> None:
+        try:
+            joined_within = parse_duration(flags.joined) if flags.joined else None
+            name_pattern = re.compile(flags.name, re.IGNORECASE) if flags.name else None
+        except (ValueError, re.error) as e:
+            await ctx.reply(f"Invalid selector: {e}")
+            return
+
+        # Listed members may come from the converter's cache; selected ones are live gateway members
+        targets = await member_cache.refresh_many(members) + select_members(ctx.guild, joined_within, name_pattern)
+        actionable, protected = partition_targets(ctx.author, targets)
+        if not actionable:
+            await ctx.reply(f"No members to {action} ({len(protected)} protected by role hierarchy).")
+            return
+        if len(actionable) > MAX_TARGETS:
+            await ctx.reply(f"That selects {len(actionable)} members; narrow it down to at most {MAX_TARGETS}.")
+            return
+        if flags.dry_run:
+            preview = ", ".join(str(m) for m in actionable[:20])
+            more = f" and {len(actionable) - 20} more" if len(actionable) > 20 else ""
+            await ctx.reply(f"Would {action} {len(actionable)} members: {preview}{more}.")
+            return
+
+        reason = f"{flags.reason or 'Mass ' + action} (by {ctx.author})"
+
+        async def apply(member: discord.Member) -> None:
+            if action == "ban":
+                await ctx.guild.ban(member, reason=reason, delete_message_days=1)
+            else:
+                await ctx.guild.kick(member, reason=reason)
+
+        status = await ctx.reply(f"⏳ Starting to {action} {len(actionable)} members...")
+        result = await run_mass_action(action, actionable, apply, protected=len(protected))
+        logger.info(
+            "%s mass-%s %d/%d members (%d protected, %d forbidden, %d failed): %s",
+            ctx.author, action, result.succeeded, len(actionable), result.protected,
+            result.forbidden, result.failed, flags.reason,
+        )
+        await status.edit(content=result.summary("Banned" if action == "ban" else "Kicked"))
+
+    @commands.command(
+        name="massban",
+        help=(
+            "Ban many members at once. "
+            "Usage: !massban [@member ...] [joined: 10m] [name: regex] [reason: text] [dry: yes]"
+        ),
+    )
+    @command_policy(ban_members=True, guild_cooldown="3/m")
+    async def massban(self, ctx: commands.Context, members: commands.Greedy[CachedMemberConverter], *, flags: MassActionFlags):
+        await self._mass_action(ctx, "ban", members, flags)
+
+    @commands.command(
+        name="masskick",
+        help=(
+            "Kick many members at once. "
+            "Usage: !masskick [@member ...] [joined: 10m] [name: regex] [reason: text] [dry: yes]"
+        ),
+    )
+    @command_policy(kick_members=True, guild_cooldown="3/m")
+    async def masskick(self, ctx: commands.Context, members: commands.Greedy[CachedMemberConverter], *, flags: MassActionFlags):
+        await self._mass_action(ctx, "kick", members, flags)
@@ -0,0 +1,47 @@
+import io
+import logging
+import time
+
+import discord
+from discord.ext import commands
+
+from decorators import pipeline
+from profiler import MAX_PROFILE_SECONDS, LoopProfiler
+
+logger = logging.getLogger("profiler")
+
+DM_FILE_LIMIT = 8 * 1024 * 1024
+
+
+@pipeline
+class ProfilerCog(commands.Cog):
+    """Owner-only event-loop profiling of the running bot."""
+
+    def __init__(self, bot: commands.Bot, profiler: LoopProfiler) -> None:
+        self.bot = bot
+        self.profiler = profiler
+
+    @commands.command(
+        name="profile",
+        help=f"Sample the event loop and attach collapsed stacks for a flamegraph (owner only). Usage: !profile [1..{MAX_PROFILE_SECONDS}]",
+    )
+    @commands.is_owner()
+    async def profile(self, ctx: commands.Context, seconds: float = 10.0):
+        if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+            await ctx.reply(f"Profile between 1 and {MAX_PROFILE_SECONDS} seconds.")
+            return
+        if self.profiler.running:
+            await ctx.reply("A profile is already running.")
+            return
+        status = await ctx.reply(f"⏱️ Profiling the event loop for {seconds:.0f}s...")
+        profile = await self.profiler.profile(seconds)
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+        data = profile.collapsed().encode()
+        limit = ctx.guild.filesize_limit if ctx.guild is not None else DM_FILE_LIMIT
+        summary = profile.summary()
+        if len(data) > limit:
+            # Lines are ordered by sample count, so this keeps the most common stacks
+            data = data[:limit].rsplit(b"\n", 1)[0] + b"\n"
+            summary += "\n(stacks truncated to the upload limit)"
+        await status.edit(content=f"```\n{summary[:1900]}\n```")
+        await ctx.reply(file=discord.File(io.BytesIO(data), filename=name))
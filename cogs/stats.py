@@ -1,25 +1,45 @@
 import logging
+from datetime import datetime, timezone
 
 import discord
 from discord.ext import commands
 
+from activity import ActivityRecorder
 from db import Database
-from decorators import command_logger, timing
+from member_cache import Member
+from xp_buffer import XPBuffer
+from decorators import pipeline
 
 logger = logging.getLogger("stats")
 
+SPARK_BLOCKS = "▁▂▃▄▅▆▇█"
+MAX_ACTIVITY_DAYS = 90
 
+
+def sparkline(values: list[int]) -> str:
+    peak = max(values, default=0)
+    if not peak:
+        return SPARK_BLOCKS[0] * len(values)
+    return "".join(SPARK_BLOCKS[min(len(SPARK_BLOCKS) - 1, v * len(SPARK_BLOCKS) // peak)] for v in values)
+
+
+@pipeline
 class StatsCog(commands.Cog):
     """User analytics and statistics commands."""
 
-    def __init__(self, bot: commands.Bot, db: Database) -> None:
+    def __init__(self, bot: commands.Bot, db: Database | XPBuffer, activity: ActivityRecorder | None = None) -> None:
         self.bot = bot
         self.db = db
+        self.activity = activity
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if self.activity is None or message.author.bot or message.guild is None:
+            return
+        self.activity.record(message.guild.id, message.author.id, message.created_at)
 
     @commands.command(name="stats", help="Show statistics for a user. Usage: !stats [@user]")
-    @command_logger()
-    @timing()
-    async def stats(self, ctx: commands.Context, member: discord.Member | None = None):
+    async def stats(self, ctx: commands.Context, member: Member | None = None):
         member = member or ctx.author
         stats = await self.db.get_stats(member.id, ctx.guild.id)
         if not stats:
@@ -33,3 +53,29 @@ class StatsCog(commands.Cog):
         if last_active:
             embed.set_footer(text=f"Last active: {last_active}")
         await ctx.reply(embed=embed)
+
+    @commands.command(
+        name="activity",
+        help="Show daily message activity for the server or a user. Usage: !activity [@user] [days]",
+    )
+    async def activity_command(self, ctx: commands.Context, member: Member | None = None, days: int = 30):
+        if self.activity is None:
+            await ctx.reply("Activity tracking is disabled.")
+            return
+        if days < 1 or days > MAX_ACTIVITY_DAYS:
+            await ctx.reply(f"Please choose between 1 and {MAX_ACTIVITY_DAYS} days.")
+            return
+        series = await self.activity.get_activity(ctx.guild.id, days, member.id if member else None)
+        counts = [messages for _, messages in series]
+        total = sum(counts)
+        subject = member.display_name if member else ctx.guild.name
+        embed = discord.Embed(title=f"Activity for {subject} (last {days} days)", color=discord.Color.green())
+        embed.description = f"`{sparkline(counts)}`"
+        embed.add_field(name="Messages", value=str(total))
+        embed.add_field(name="Daily average", value=f"{total / days:.1f}")
+        if total:
+            busiest_day, busiest = max(series, key=lambda item: item[1])
+            date = datetime.fromtimestamp(busiest_day, timezone.utc).strftime("%Y-%m-%d")
+            embed.add_field(name="Busiest day", value=f"{date} ({busiest})")
+        embed.set_footer(text="Days in UTC")
+        await ctx.reply(embed=embed)
@@ -1,169 +1,345 @@
-import aiosqlite
-import asyncpg
+import asyncio
 import logging
-from typing import Optional
-from urllib.parse import urlparse
+import time
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from backends import IMPORT_MODES, USER_COLUMNS, Backend, create_backend, xp_to_level
+from backends.base import AutomodRule, SettingsRow
+from cache import MISSING, TTLCache
+from leaderboard import GuildBoard, Leaderboard
+from metrics import REGISTRY, timed
+
+__all__ = ["Database", "USER_COLUMNS", "xp_to_level"]
 
 logger = logging.getLogger("db")
 
-SQLITE_SCHEMA = """
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER NOT NULL,
-    guild_id INTEGER NOT NULL,
-    xp INTEGER NOT NULL DEFAULT 0,
-    level INTEGER NOT NULL DEFAULT 0,
-    messages INTEGER NOT NULL DEFAULT 0,
-    last_active TIMESTAMP
-);
-CREATE UNIQUE INDEX IF NOT EXISTS idx_users ON users (user_id, guild_id);
-"""
-
-POSTGRES_SCHEMA = """
-CREATE TABLE IF NOT EXISTS users (
-    user_id BIGINT NOT NULL,
-    guild_id BIGINT NOT NULL,
-    xp INTEGER NOT NULL DEFAULT 0,
-    level INTEGER NOT NULL DEFAULT 0,
-    messages INTEGER NOT NULL DEFAULT 0,
-    last_active TIMESTAMPTZ
-);
-CREATE UNIQUE INDEX IF NOT EXISTS idx_users ON users (user_id, guild_id);
-"""
+QUERY_DURATION = REGISTRY.histogram("bot_db_query_duration_seconds", "Database operation latency", ("operation",))
 
 
 class Database:
-    """Async DB wrapper supporting SQLite (default) and PostgreSQL (via DATABASE_URL).
+    """Async DB facade over a storage backend (see backends/).
 
-    If url is provided and scheme is postgresql, uses asyncpg; otherwise falls back to SQLite.
+    The backend is chosen from `url`: PostgreSQL for postgres:// URLs (reads go to
+    `read_url` when given), the in-memory log-structured engine for memory:// URLs,
+    and SQLite at `path` otherwise.
+    SQLite runs in WAL mode with one serialized writer connection whose commits are
+    grouped, plus `sqlite_readers` read-only connections for queries.
+    get_stats results are served from a bounded LRU/TTL cache that writes keep up to date,
+    and guild rankings from an in-memory Leaderboard loaded once per guild.
     """
 
-    def __init__(self, path: str | None = "bot.db", url: str | None = None) -> None:
-        self._url = url
-        self._path = path or "bot.db"
-        self._backend: str = "sqlite"
-        self._conn: Optional[aiosqlite.Connection] = None
-        self._pool: Optional[asyncpg.Pool] = None
+    def __init__(
+        self,
+        path: str | None = "bot.db",
+        url: str | None = None,
+        cache_size: int = 10_000,
+        cache_ttl: float = 300.0,
+        sqlite_readers: int = 2,
+        commit_delay: float = 0.005,
+        read_url: str | None = None,
+        pool_min: int = 1,
+        pool_max: int = 5,
+        statement_timeout: float | None = None,
+        connection_lifetime: float = 300.0,
+        backend: Optional[Backend] = None,
+    ) -> None:
+        self.backend: Backend = backend or create_backend(
+            url, path, sqlite_readers, commit_delay,
+            read_url, pool_min, pool_max, statement_timeout, connection_lifetime,
+        )
+        REGISTRY.counter("bot_db_statements_total", "SQL statements executed").set_function(lambda: self.statements)
+        cache_events = REGISTRY.counter("bot_stats_cache_events_total", "Stats cache lookups and evictions", ("event",))
+        cache_events.labels("hit").set_function(lambda: self.stats_cache.hits)
+        cache_events.labels("miss").set_function(lambda: self.stats_cache.misses)
+        cache_events.labels("eviction").set_function(lambda: self.stats_cache.evictions)
+        REGISTRY.gauge("bot_stats_cache_size", "Entries in the stats cache").set_function(lambda: len(self.stats_cache))
+        self.stats_cache: TTLCache[Optional[tuple[int, int, int, str]]] = TTLCache(cache_size, cache_ttl)
+        self.leaderboard = Leaderboard()
+        # Keys with a get_stats read in flight, and how often each was written during it
+        self._stats_readers: Counter[tuple[int, int]] = Counter()
+        self._stats_writes: Counter[tuple[int, int]] = Counter()
+        self._board_locks: dict[int, asyncio.Lock] = {}
+        # XP writes and the board load of a guild exclude each other, so a loaded board
+        # holds exactly the writes that finished before its snapshot plus those applied after
+        self._writes_in_flight: Counter[int] = Counter()
+        self._writes_drained: dict[int, asyncio.Event] = {}
+        self._boards_loading: dict[int, asyncio.Event] = {}
 
-        if url:
-            parsed = urlparse(url)
-            if parsed.scheme.startswith("postgres"):
-                self._backend = "postgres"
+    @property
+    def statements(self) -> int:
+        """Number of statements the backend executed (executemany counts each row), for benchmarks."""
+        return self.backend.statements
 
     async def init(self) -> None:
-        if self._backend == "postgres":
-            self._pool = await asyncpg.create_pool(dsn=self._url, min_size=1, max_size=5)
-            async with self._pool.acquire() as conn:
-                await conn.execute(POSTGRES_SCHEMA)
-            logger.info("PostgreSQL initialized at %s", self._url)
-        else:
-            self._conn = await aiosqlite.connect(self._path)
-            await self._conn.executescript(SQLITE_SCHEMA)
-            await self._conn.commit()
-            logger.info("SQLite initialized at %s", self._path)
+        await self.backend.init()
 
     async def close(self) -> None:
-        if self._backend == "postgres":
-            if self._pool is not None:
-                await self._pool.close()
-                self._pool = None
-                logger.info("PostgreSQL pool closed")
-        else:
-            if self._conn is not None:
-                await self._conn.close()
-                self._conn = None
-                logger.info("SQLite connection closed")
+        await self.backend.close()
 
     # User analytics and XP helpers
-    async def add_message(self, user_id: int, guild_id: int, xp_gain: int) -> tuple[int, int]:
-        """Increment message count and XP, return (xp, level)."""
-        if self._backend == "postgres":
-            assert self._pool is not None
-            async with self._pool.acquire() as conn:
-                await conn.execute(
-                    """
-                    INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
-                    VALUES ($1, $2, 0, 0, 0, NOW())
-                    ON CONFLICT (user_id, guild_id) DO NOTHING
-                    """,
-                    user_id, guild_id,
-                )
-                await conn.execute(
-                    """
-                    UPDATE users
-                    SET messages = messages + 1,
-                        xp = xp + $1,
-                        last_active = NOW()
-                    WHERE user_id = $2 AND guild_id = $3
-                    """,
-                    xp_gain, user_id, guild_id,
-                )
-                row = await conn.fetchrow(
-                    "SELECT xp, level FROM users WHERE user_id = $1 AND guild_id = $2",
-                    user_id, guild_id,
-                )
-                return int(row[0]), int(row[1])
-        else:
-            assert self._conn is not None
-            await self._conn.execute(
-                """
-                INSERT INTO users (user_id, guild_id, xp, level, messages, last_active)
-                VALUES (?, ?, 0, 0, 0, CURRENT_TIMESTAMP)
-                ON CONFLICT(user_id, guild_id) DO NOTHING
-                """,
-                (user_id, guild_id),
-            )
-            await self._conn.execute(
-                """
-                UPDATE users
-                SET messages = messages + 1,
-                    xp = xp + ?,
-                    last_active = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND guild_id = ?
-                """,
-                (xp_gain, user_id, guild_id),
+    @timed(QUERY_DURATION, "add_message")
+    async def add_message(self, user_id: int, guild_id: int, xp_gain: int, messages: int = 1) -> tuple[int, int, int]:
+        """Add XP and `messages` to the message count in one atomic upsert, return (xp, old_level, new_level).
+
+        The level is recomputed from the new XP and never decreases.
+        """
+        guild_ids = (guild_id,)
+        await self._start_writes(guild_ids)
+        try:
+            xp, old_level, level, total_messages, last_active = await self.backend.add_message(
+                user_id, guild_id, xp_gain, messages,
             )
-            await self._conn.commit()
-            async with self._conn.execute(
-                "SELECT xp, level FROM users WHERE user_id = ? AND guild_id = ?",
-                (user_id, guild_id),
-            ) as cur:
-                row = await cur.fetchone()
-                return int(row[0]), int(row[1])
+            self._stats_written((user_id, guild_id))
+            self.stats_cache.set((user_id, guild_id), (xp, level, total_messages, last_active))
+            self.leaderboard.set(guild_id, user_id, xp)
+        finally:
+            self._end_writes(guild_ids)
+        return xp, old_level, level
+
+    @timed(QUERY_DURATION, "add_messages")
+    async def add_messages(self, rows: list[tuple[int, int, int, int, int, datetime]]) -> None:
+        """Apply buffered deltas in bulk.
 
+        Each row is (user_id, guild_id, xp_delta, messages_delta, level, last_active).
+        The stored level is the highest of the current level, the given level and the
+        level computed from the new XP.
+        """
+        if not rows:
+            return
+        for user_id, guild_id, *_ in rows:
+            self.stats_cache.pop((user_id, guild_id))
+        guild_ids = {row[1] for row in rows}
+        await self._start_writes(guild_ids)
+        try:
+            await self.backend.add_messages(rows)
+            for user_id, guild_id, xp, *_ in rows:
+                # Again: a read may have cached the old row while the write ran
+                self._stats_written((user_id, guild_id))
+                self.stats_cache.pop((user_id, guild_id))
+                self.leaderboard.add(guild_id, user_id, xp)
+        finally:
+            self._end_writes(guild_ids)
+
+    @timed(QUERY_DURATION, "set_level")
     async def set_level(self, user_id: int, guild_id: int, level: int) -> None:
-        if self._backend == "postgres":
-            assert self._pool is not None
-            async with self._pool.acquire() as conn:
-                await conn.execute(
-                    "UPDATE users SET level = $1 WHERE user_id = $2 AND guild_id = $3",
-                    level, user_id, guild_id,
-                )
-        else:
-            assert self._conn is not None
-            await self._conn.execute(
-                "UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?",
-                (level, user_id, guild_id),
-            )
-            await self._conn.commit()
+        await self.backend.set_level(user_id, guild_id, level)
+        self._stats_written((user_id, guild_id))
+        self.stats_cache.pop((user_id, guild_id))
+
+    def _stats_written(self, key: tuple[int, int]) -> None:
+        if key in self._stats_readers:
+            self._stats_writes[key] += 1
 
     async def get_stats(self, user_id: int, guild_id: int) -> Optional[tuple[int, int, int, str]]:
-        if self._backend == "postgres":
-            assert self._pool is not None
-            async with self._pool.acquire() as conn:
-                row = await conn.fetchrow(
-                    "SELECT xp, level, messages, COALESCE(to_char(last_active, 'YYYY-MM-DD HH24:MI:SSTZ'), '') FROM users WHERE user_id = $1 AND guild_id = $2",
-                    user_id, guild_id,
-                )
-                if row:
-                    return int(row[0]), int(row[1]), int(row[2]), str(row[3])
-                return None
-        else:
-            assert self._conn is not None
-            async with self._conn.execute(
-                "SELECT xp, level, messages, COALESCE(last_active, '') FROM users WHERE user_id = ? AND guild_id = ?",
-                (user_id, guild_id),
-            ) as cur:
-                row = await cur.fetchone()
-                if row:
-                    return int(row[0]), int(row[1]), int(row[2]), str(row[3])
-                return None
+        key = (user_id, guild_id)
+        cached = self.stats_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        self._stats_readers[key] += 1
+        writes = self._stats_writes[key]
+        try:
+            stats = await self._fetch_stats(user_id, guild_id)
+            # Only cache the row if nothing wrote the key while we read it; the read may
+            # predate that write, and a write that did land has fresher data anyway
+            if self._stats_writes[key] == writes:
+                self.stats_cache.add(key, stats)
+        finally:
+            self._stats_readers[key] -= 1
+            if not self._stats_readers[key]:
+                del self._stats_readers[key]
+                self._stats_writes.pop(key, None)
+        return stats
+
+    @timed(QUERY_DURATION, "get_stats")
+    async def _fetch_stats(self, user_id: int, guild_id: int) -> Optional[tuple[int, int, int, str]]:
+        return await self.backend.fetch_stats(user_id, guild_id)
+
+    @timed(QUERY_DURATION, "get_stats_many")
+    async def fetch_stats_many(
+        self, keys: list[tuple[int, int]]
+    ) -> dict[tuple[int, int], tuple[int, int, int, str]]:
+        """Read stats for many (user_id, guild_id) pairs in one query, bypassing the cache."""
+        if not keys:
+            return {}
+        return await self.backend.fetch_stats_many(keys)
+
+    # Warm start
+    def hot_users(self) -> list[tuple[int, int, int, int, int, str]]:
+        """Cached users as (guild_id, user_id, xp, level, messages, last_active), for a snapshot."""
+        return [
+            (guild_id, user_id, *stats)
+            for (user_id, guild_id), stats in self.stats_cache.items()
+            if stats is not None
+        ]
+
+    def seed(self, rows: Iterable[tuple[int, int, int, int, int, str]]) -> int:
+        """Prime the stats cache from a snapshot without overwriting live entries; return rows used."""
+        seeded = 0
+        for guild_id, user_id, xp, level, messages, last_active in rows:
+            if seeded >= self.stats_cache.maxsize:
+                break
+            self.stats_cache.add((user_id, guild_id), (xp, level, messages, last_active))
+            seeded += 1
+        return seeded
+
+    def reconcile(
+        self, row: tuple[int, int, int, int, int, str], actual: Optional[tuple[int, int, int, str]]
+    ) -> bool:
+        """Correct a seeded entry that disagrees with the database; return whether it did."""
+        guild_id, user_id, *seeded = row
+        if actual is not None and tuple(seeded) == actual:
+            return False
+        # Only entries nobody has written since seeding still hold snapshot data
+        if self.stats_cache.peek((user_id, guild_id)) == tuple(seeded):
+            self.stats_cache.pop((user_id, guild_id))
+        return True
+
+    async def _start_writes(self, guild_ids: Iterable[int]) -> None:
+        """Wait out board loads of these guilds, then count the write as in flight."""
+        while True:
+            loading = next((self._boards_loading[g] for g in guild_ids if g in self._boards_loading), None)
+            if loading is None:
+                break
+            await loading.wait()
+        for guild_id in guild_ids:
+            self._writes_in_flight[guild_id] += 1
+
+    def _end_writes(self, guild_ids: Iterable[int]) -> None:
+        for guild_id in guild_ids:
+            self._writes_in_flight[guild_id] -= 1
+            if not self._writes_in_flight[guild_id]:
+                del self._writes_in_flight[guild_id]
+                drained = self._writes_drained.get(guild_id)
+                if drained is not None:
+                    drained.set()
+
+    async def _guild_board(self, guild_id: int) -> GuildBoard:
+        board = self.leaderboard.get(guild_id)
+        if board is not None:
+            return board
+        lock = self._board_locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            board = self.leaderboard.get(guild_id)
+            if board is not None:
+                return board
+            # New writes to the guild wait until the board is in place; the snapshot is
+            # read once those already running are done, so each one is counted exactly once
+            loading = self._boards_loading[guild_id] = asyncio.Event()
+            try:
+                if self._writes_in_flight[guild_id]:
+                    drained = self._writes_drained[guild_id] = asyncio.Event()
+                    await drained.wait()
+                rows = await self._fetch_guild_xp(guild_id)
+                board = self.leaderboard.load(guild_id, rows)
+            finally:
+                self._writes_drained.pop(guild_id, None)
+                del self._boards_loading[guild_id]
+                loading.set()
+            self._board_locks.pop(guild_id, None)
+            logger.info("Loaded leaderboard for guild %s (%d users)", guild_id, len(board))
+            return board
+
+    @timed(QUERY_DURATION, "load_leaderboard")
+    async def _fetch_guild_xp(self, guild_id: int) -> list[tuple[int, int]]:
+        return await self.backend.fetch_guild_xp(guild_id)
+
+    async def get_leaderboard(self, guild_id: int, offset: int = 0, limit: int = 10) -> tuple[list[tuple[int, int]], int]:
+        """Return ([(user_id, xp), ...] for the requested slice, total ranked users)."""
+        board = await self._guild_board(guild_id)
+        return board.top(offset, limit), len(board)
+
+    async def get_rank(self, user_id: int, guild_id: int) -> Optional[int]:
+        """Return the user's 1-based position in the guild by XP, or None if unranked."""
+        board = await self._guild_board(guild_id)
+        return board.position(user_id)
+
+    # Activity rollups
+    @timed(QUERY_DURATION, "add_activity")
+    async def add_activity(self, rows: list[tuple[int, int, int, int]]) -> None:
+        """Add message counts to hourly buckets; each row is (guild_id, user_id, bucket, messages)."""
+        if rows:
+            await self.backend.add_activity(rows)
+
+    @timed(QUERY_DURATION, "get_activity")
+    async def get_activity(self, guild_id: int, since: int, user_id: Optional[int] = None) -> list[tuple[int, int]]:
+        """Return [(day, messages), ...] from `since` (unix time) on, for the guild or one member."""
+        return await self.backend.get_activity(guild_id, since, user_id)
+
+    @timed(QUERY_DURATION, "compact_activity")
+    async def compact_activity(self, hourly_before: int, delete_before: int) -> None:
+        """Fold hourly buckets older than `hourly_before` into daily ones and drop buckets older than `delete_before`."""
+        await self.backend.compact_activity(hourly_before, delete_before)
+
+    # Bulk export / import
+    def iter_users(
+        self, guild_id: Optional[int] = None, batch_size: int = 5000
+    ) -> AsyncIterator[list[tuple[int, int, int, int, int, str]]]:
+        """Stream users as batches of (user_id, guild_id, xp, level, messages, last_active) rows.
+
+        The table is never loaded into memory at once. last_active is
+        "YYYY-MM-DD HH:MM:SS" in UTC, or "".
+        """
+        return self.backend.iter_users(guild_id, batch_size)
+
+    async def import_users(
+        self,
+        batches: Iterable[list[tuple[int, int, int, int, int, Optional[datetime]]]],
+        mode: str = "replace",
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """Bulk-load (user_id, guild_id, xp, level, messages, last_active) rows.
+
+        `mode` is "replace" or "add"; `progress` is called with the running row count
+        after each batch. Returns the number of rows read.
+        """
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Unknown import mode: {mode!r}")
+        start = time.perf_counter()
+        total, guilds = await self.backend.import_users(batches, mode, progress)
+        # Cached stats and rankings of the imported guilds are stale now
+        for key in self._stats_readers:
+            self._stats_writes[key] += 1
+        self.stats_cache.clear()
+        for guild_id in guilds:
+            self.leaderboard.discard(guild_id)
+        logger.info(
+            "Imported %d users into %d guilds (%s) in %.1fs", total, len(guilds), mode, time.perf_counter() - start,
+        )
+        return total
+
+    # Guild settings
+    @timed(QUERY_DURATION, "fetch_guild_settings")
+    async def fetch_guild_settings(self) -> list[SettingsRow]:
+        return await self.backend.fetch_guild_settings()
+
+    @timed(QUERY_DURATION, "save_guild_settings")
+    async def save_guild_settings(self, row: SettingsRow) -> None:
+        """Insert or replace one guild's row; see backends.base.SettingsRow."""
+        await self.backend.save_guild_settings(row)
+
+    @timed(QUERY_DURATION, "delete_guild_settings")
+    async def delete_guild_settings(self, guild_id: int) -> None:
+        await self.backend.delete_guild_settings(guild_id)
+
+    # Automod
+    @timed(QUERY_DURATION, "fetch_automod_rules")
+    async def fetch_automod_rules(self) -> list[AutomodRule]:
+        return await self.backend.fetch_automod_rules()
+
+    @timed(QUERY_DURATION, "add_automod_rule")
+    async def add_automod_rule(self, rule: AutomodRule) -> None:
+        await self.backend.add_automod_rule(rule)
+
+    @timed(QUERY_DURATION, "delete_automod_rule")
+    async def delete_automod_rule(self, rule: AutomodRule) -> bool:
+        return await self.backend.delete_automod_rule(rule)
+
+    @timed(QUERY_DURATION, "fetch_automod_actions")
+    async def fetch_automod_actions(self) -> list[tuple[int, str]]:
+        return await self.backend.fetch_automod_actions()
+
+    @timed(QUERY_DURATION, "save_automod_action")
+    async def save_automod_action(self, guild_id: int, action: str) -> None:
+        await self.backend.save_automod_action(guild_id, action)
@@ -1,100 +1,205 @@
-import asyncio
+import inspect
 import logging
+import time
 from functools import wraps
-from typing import Callable, Coroutine, Any
+from typing import Any, Callable, Coroutine, Optional, TypeVar
 
+import discord
 from discord.ext import commands
 
+from cache import MISSING, TTLCache
+from metrics import REGISTRY
+from ratelimit import TokenBucket, parse_rate
+
 logger = logging.getLogger("decorators")
 
+COMMANDS_TOTAL = REGISTRY.counter("bot_commands_total", "Command invocations", ("command",))
+COMMAND_DURATION = REGISTRY.histogram("bot_command_duration_seconds", "Command execution time", ("command",))
+COMMAND_DENIED = REGISTRY.counter("bot_command_permission_denied_total", "Commands rejected by permission checks", ("command",))
+COMMANDS_SHED = REGISTRY.counter("bot_commands_shed_total", "Commands dropped by rate limits", ("command", "limit"))
 
-def command_logger():
-    """Decorator to log command invocation before execution.
+CogT = TypeVar("CogT", bound=type)
 
-    Works with both free functions (ctx first) and cog methods (self, ctx, ...).
-    """
+# Bot-wide command throughput, and the per-user limiters of commands without a cooldown
+# of their own; both are set by configure()
+_global: Optional[TokenBucket] = None
+_default_limiters: list["_Limiter"] = []
 
-    def decorator(func: Callable[..., Coroutine[Any, Any, Any]]):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            ctx = None
-            if args:
-                if isinstance(args[0], commands.Context):
-                    ctx = args[0]
-                elif len(args) > 1 and isinstance(args[1], commands.Context):
-                    ctx = args[1]
-            if ctx is None:
-                ctx = kwargs.get("ctx")
-
-            if ctx is not None:
-                logger.info(
-                    "Command invoked: %s by %s in #%s",
-                    func.__name__,
-                    getattr(ctx, "author", "unknown"),
-                    getattr(getattr(ctx, "channel", None), "name", "DM"),
-                )
-            else:
-                logger.info("Command invoked: %s", func.__name__)
 
-            return await func(*args, **kwargs)
+def configure(global_rate: Optional[str] = None, user_rate: Optional[str] = None) -> None:
+    """Set the bot-wide command rate (e.g. "50/s") and the per-user rate of commands without their own.
+
+    None or "" disables a limit. Applies to commands defined before the call too.
+    """
+    global _global
+    _global = TokenBucket(*parse_rate(global_rate)) if global_rate else None
+    rate, burst = parse_rate(user_rate) if user_rate else (0.0, 0.0)
+    for limiter in _default_limiters:
+        limiter.set_rate(rate, burst)
+
+
+class CommandShed(commands.CheckFailure):
+    """A command dropped by a rate limit without a reply; the error handler ignores it."""
+
+
+class _Bucket(TokenBucket):
+    __slots__ = ("warned",)
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        super().__init__(rate, capacity)
+        self.warned = False
+
+
+class _Limiter:
+    """Token buckets keyed by user or guild id, bounded and forgotten once they would be full again."""
+
+    __slots__ = ("rate", "burst", "cooldown", "type", "_buckets")
+
+    def __init__(self, rate: float, burst: float, bucket_type: commands.BucketType) -> None:
+        self.type = bucket_type
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: float) -> None:
+        """Change the limit and forget all buckets; a rate of 0 disables the limiter."""
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = commands.Cooldown(burst, burst / rate if rate else 0.0)
+        self._buckets: TTLCache[_Bucket] = TTLCache(maxsize=10_000, ttl=burst / rate if rate else 0.0)
+
+    def hit(self, key: int) -> float:
+        """Take a token for `key`; return 0, or the seconds to wait (negative if already told)."""
+        bucket = self._buckets.get(key)
+        if bucket is MISSING:
+            bucket = _Bucket(self.rate, self.burst)
+        # Refreshes the expiry: an idle bucket is full again by the time it is dropped
+        self._buckets.set(key, bucket)
+        if bucket.try_acquire():
+            bucket.warned = False
+            return 0.0
+        retry_after = bucket.retry_after()
+        if bucket.warned:
+            return -retry_after
+        bucket.warned = True
+        return retry_after
+
+
+def command_policy(
+    *,
+    cooldown: Optional[str] = None,
+    guild_cooldown: Optional[str] = None,
+    **permissions: bool,
+) -> Callable:
+    """Declare what the cog's pipeline enforces for a command.
+
+    `permissions` are guild permissions the author needs (e.g. kick_members=True),
+    `cooldown` a per-user and `guild_cooldown` a per-guild rate such as "3/m".
+    This only marks the function; apply it below the command decorator and put
+    @pipeline on the cog.
+    """
 
-        return wrapper
+    def decorator(func):
+        func.__command_policy__ = (cooldown, guild_cooldown, permissions)
+        return func
 
     return decorator
 
 
-def timing():
-    """Decorator to measure command execution time and log it.
+def _ctx_index(func: Callable) -> int:
+    params = list(inspect.signature(func).parameters)
+    return 1 if params and params[0] == "self" else 0
 
-    Works with both free functions and cog methods.
-    """
 
-    def decorator(func: Callable[..., Coroutine[Any, Any, Any]]):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            loop = asyncio.get_event_loop()
-            start = loop.time()
-            try:
-                return await func(*args, **kwargs)
-            finally:
-                elapsed = (loop.time() - start) * 1000
-                logger.info("Command %s took %.2f ms", func.__name__, elapsed)
+def _policy_check(command: commands.Command) -> Callable[[commands.Context], bool]:
+    """Build the check that sheds, authorizes and rate-limits one command.
 
-        return wrapper
+    Checks run in Command.prepare before the arguments are converted, so a dropped
+    command never reaches a converter's member lookup or the database.
+    """
+    name = command.callback.__name__
+    names = {command.name.lower(), *(alias.lower() for alias in command.aliases)}
+    cooldown, guild_cooldown, permissions = getattr(command.callback, "__command_policy__", (None, None, {}))
+    required = discord.Permissions(**permissions) if permissions else None
+    if cooldown is not None:
+        user_limiter = _Limiter(*parse_rate(cooldown), commands.BucketType.user)
+    else:
+        user_limiter = _Limiter(0.0, 0.0, commands.BucketType.user)
+        _default_limiters.append(user_limiter)
+    guild_limiter = _Limiter(*parse_rate(guild_cooldown), commands.BucketType.guild) if guild_cooldown else None
+    denied = COMMAND_DENIED.labels(name)
+    shed_global = COMMANDS_SHED.labels(name, "global")
+    shed_user = COMMANDS_SHED.labels(name, "user")
+    shed_guild = COMMANDS_SHED.labels(name, "guild")
+
+    def limit(limiter: _Limiter, key: int, shed) -> None:
+        retry_after = limiter.hit(key)
+        if retry_after:
+            shed.inc()
+            if retry_after < 0:
+                raise CommandShed()
+            raise commands.CommandOnCooldown(limiter.cooldown, retry_after, limiter.type)
+
+    def predicate(ctx: commands.Context) -> bool:
+        # The help command runs every command's checks to filter its listing (with
+        # invoked_with "help"); only an actual invocation of this command takes tokens
+        invoking = (ctx.invoked_with or "").lower() in names
+        # Cheapest first: a flood is dropped before any per-command work
+        if invoking and _global is not None and not _global.try_acquire():
+            shed_global.inc()
+            raise CommandShed()
+        if required is not None:
+            if ctx.guild is None:
+                raise commands.NoPrivateMessage()
+            granted = ctx.author.guild_permissions
+            if not granted >= required:
+                if not invoking:
+                    return False
+                denied.inc()
+                logger.warning("Permission denied for %s on %s", ctx.author, name)
+                raise commands.MissingPermissions([perm for perm, value in required if value and not getattr(granted, perm)])
+        if invoking:
+            if user_limiter.rate:
+                limit(user_limiter, ctx.author.id, shed_user)
+            if guild_limiter is not None and ctx.guild is not None:
+                limit(guild_limiter, ctx.guild.id, shed_guild)
+        return True
+
+    return predicate
+
+
+def _wrap(func: Callable[..., Coroutine[Any, Any, Any]]) -> Callable[..., Coroutine[Any, Any, Any]]:
+    """Build the single wrapper that counts, logs and times one command's calls."""
+    name = func.__name__
+    ctx_index = _ctx_index(func)
+    invocations = COMMANDS_TOTAL.labels(name)
+    duration = COMMAND_DURATION.labels(name)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        ctx: commands.Context = args[ctx_index]
+        invocations.inc()
+        logger.info("Command invoked: %s by %s in #%s", name, ctx.author, getattr(ctx.channel, "name", "DM"))
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            duration.observe(elapsed)
+            logger.debug("Command %s took %.2f ms", name, elapsed * 1000)
 
-    return decorator
+    return wrapper
 
 
-def require_guild_permissions(**perms):
-    """Decorator to require guild permissions with a custom error message/log.
+def pipeline(cog: CogT) -> CogT:
+    """Cog class decorator: give every command of the cog one policy check and one wrapper.
 
-    Works with both free functions and cog methods.
+    The check, which discord.py runs before converting arguments, sheds commands over
+    the bot-wide rate, then checks the permissions and per-user/per-guild cooldowns
+    declared with @command_policy. The wrapper counts, logs and times the call. The
+    required discord.Permissions, the buckets and metric children are all set up
+    here, once per command.
     """
-
-    def decorator(func: Callable[..., Coroutine[Any, Any, Any]]):
-        check = commands.has_guild_permissions(**perms)
-
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            # Find ctx regardless of whether this is a bound method
-            ctx = None
-            if args:
-                if isinstance(args[0], commands.Context):
-                    ctx = args[0]
-                elif len(args) > 1 and isinstance(args[1], commands.Context):
-                    ctx = args[1]
-            if ctx is None:
-                ctx = kwargs.get("ctx")
-
-            if ctx is None:
-                return await func(*args, **kwargs)
-
-            pred = check.predicate
-            if not await commands.utils.maybe_coroutine(pred, ctx):
-                logger.warning("Permission denied for %s on %s", getattr(ctx, "author", "unknown"), func.__name__)
-                raise commands.MissingPermissions(list(perms.keys()))
-            return await func(*args, **kwargs)
-
-        return wrapper
-
-    return decorator
+    for command in cog.__cog_commands__:
+        command.callback = _wrap(command.callback)
+        # First, so a shed command doesn't even run the other checks
+        command.checks.insert(0, _policy_check(command))
+    return cog
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Optional
+
+import discord
+
+from backends.base import SETTINGS_COLUMNS, SettingsRow
+from db import Database
+from metrics import REGISTRY
+
+logger = logging.getLogger("guild_settings")
+
+MAX_PREFIX_LENGTH = 10
+MAX_XP_GAIN = 1000
+
+
+def _check_xp_range(xp_min: int, xp_max: int) -> None:
+    if not 0 <= xp_min <= xp_max <= MAX_XP_GAIN:
+        raise ValueError(f"XP per message must satisfy 0 <= min <= max <= {MAX_XP_GAIN}, got {xp_min}-{xp_max}.")
+
+
+class GuildSettings:
+    """Effective settings of one guild: its overrides resolved against the bot-wide defaults.
+
+    Instances are never modified; a change replaces the guild's instance, so the
+    hot path can hold one without locking.
+    """
+
+    __slots__ = ("prefix", "xp_min", "xp_max", "announce_channel_id", "ignored_channels", "row")
+
+    def __init__(self, row: SettingsRow, defaults: "GuildSettings | None" = None) -> None:
+        guild_id, prefix, xp_min, xp_max, announce_channel_id, ignored_channels = row
+        self.row = row
+        self.prefix: str = prefix if prefix is not None or defaults is None else defaults.prefix
+        self.xp_min: int = xp_min if xp_min is not None or defaults is None else defaults.xp_min
+        self.xp_max: int = xp_max if xp_max is not None or defaults is None else defaults.xp_max
+        # One side overridden past the other's default: the range narrows to the override
+        if self.xp_max < self.xp_min:
+            if xp_min is not None:
+                self.xp_max = self.xp_min
+            else:
+                self.xp_min = self.xp_max
+        self.announce_channel_id: Optional[int] = announce_channel_id
+        self.ignored_channels: frozenset[int] = frozenset(int(c) for c in ignored_channels.split())
+
+
+class GuildSettingsStore:
+    """Per-guild prefix, XP range, ignored channels and level-up channel, kept in memory.
+
+    Every stored row is loaded once by load(); get() is then a dict lookup, so the
+    command prefix and on_message never touch the database. update() and reset()
+    write through to the database and swap the cached entry. Changes to one guild are
+    serialized, so concurrent ones each build on the other's row. A guild is handled
+    by exactly one process, so no other cache has to be told about a change.
+    """
+
+    def __init__(self, db: Optional[Database] = None, prefix: str = "!", xp_min: int = 5, xp_max: int = 10) -> None:
+        _check_xp_range(xp_min, xp_max)
+        self.db = db
+        self.defaults = GuildSettings((0, prefix, xp_min, xp_max, None, ""))
+        self._guilds: dict[int, GuildSettings] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        REGISTRY.gauge("bot_guild_settings", "Guilds with custom settings").set_function(lambda: len(self._guilds))
+
+    async def load(self) -> None:
+        assert self.db is not None
+        rows = await self.db.fetch_guild_settings()
+        self._guilds = {row[0]: GuildSettings(row, self.defaults) for row in rows}
+        logger.info("Loaded settings for %d guilds", len(self._guilds))
+
+    def get(self, guild_id: Optional[int]) -> GuildSettings:
+        return self._guilds.get(guild_id, self.defaults) if guild_id is not None else self.defaults
+
+    def prefix(self, bot, message: discord.Message) -> str:
+        """`command_prefix` callable for the bot."""
+        return self.get(message.guild.id if message.guild is not None else None).prefix
+
+    async def update(self, guild_id: int, **changes) -> GuildSettings:
+        """Change some of a guild's overrides, e.g. update(id, prefix="?").
+
+        None restores a default; ignored_channels takes an iterable of channel ids.
+        Raises ValueError for an XP value outside 0-MAX_XP_GAIN or a min above the max.
+        """
+        assert self.db is not None
+        unknown = changes.keys() - set(SETTINGS_COLUMNS[1:])
+        if unknown:
+            raise TypeError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        # A lone min or max is checked against itself; GuildSettings keeps the resolved range ordered
+        xp_range = [changes[key] for key in ("xp_min", "xp_max") if changes.get(key) is not None]
+        if xp_range:
+            _check_xp_range(xp_range[0], xp_range[-1])
+        async with self._lock(guild_id):
+            return await self._save(guild_id, changes)
+
+    async def set_ignored(self, guild_id: int, channel_id: int, ignored: bool) -> bool:
+        """Add or remove one channel from the guild's ignored channels; False if it already was."""
+        async with self._lock(guild_id):
+            channels = self.get(guild_id).ignored_channels
+            if (channel_id in channels) == ignored:
+                return False
+            await self._save(guild_id, {"ignored_channels": channels | {channel_id} if ignored else channels - {channel_id}})
+        return True
+
+    async def _save(self, guild_id: int, changes: dict) -> GuildSettings:
+        # Callers hold the guild's lock, so the row read here includes every earlier change
+        assert self.db is not None
+        if "ignored_channels" in changes:
+            changes["ignored_channels"] = " ".join(map(str, sorted(changes["ignored_channels"])))
+        current = self._guilds.get(guild_id)
+        row = dict(zip(SETTINGS_COLUMNS, current.row if current is not None else (guild_id, None, None, None, None, "")))
+        row.update(changes)
+        new_row: SettingsRow = tuple(row.values())
+        await self.db.save_guild_settings(new_row)
+        settings = self._guilds[guild_id] = GuildSettings(new_row, self.defaults)
+        return settings
+
+    async def reset(self, guild_id: int) -> None:
+        assert self.db is not None
+        async with self._lock(guild_id):
+            await self.db.delete_guild_settings(guild_id)
+            self._guilds.pop(guild_id, None)
+
+    def _lock(self, guild_id: int) -> asyncio.Lock:
+        return self._locks.setdefault(guild_id, asyncio.Lock())
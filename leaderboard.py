@@ -0,0 +1,72 @@
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+
+class GuildBoard:
+    """Users of one guild ordered by XP (highest first, ties by user id)."""
+
+    __slots__ = ("_order", "_xp")
+
+    def __init__(self, rows: Iterable[tuple[int, int]] = ()) -> None:
+        self._xp: dict[int, int] = {}
+        for user_id, xp in rows:
+            self._xp[user_id] = xp
+        self._order: list[tuple[int, int]] = sorted((-xp, user_id) for user_id, xp in self._xp.items())
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def set(self, user_id: int, xp: int) -> None:
+        old = self._xp.get(user_id)
+        if old == xp:
+            return
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+        self._xp[user_id] = xp
+        insort(self._order, (-xp, user_id))
+
+    def add(self, user_id: int, delta: int) -> None:
+        self.set(user_id, self._xp.get(user_id, 0) + delta)
+
+    def position(self, user_id: int) -> Optional[int]:
+        """1-based rank of the user, or None if they have no XP entry."""
+        xp = self._xp.get(user_id)
+        if xp is None:
+            return None
+        return bisect_left(self._order, (-xp, user_id)) + 1
+
+    def top(self, offset: int, limit: int) -> list[tuple[int, int]]:
+        """Return (user_id, xp) pairs for positions offset+1 .. offset+limit."""
+        return [(user_id, -neg_xp) for neg_xp, user_id in self._order[offset:offset + limit]]
+
+
+class Leaderboard:
+    """Per-guild XP ordering kept in memory and updated incrementally by writes.
+
+    Guilds are loaded on first use; writes for guilds that are not loaded are
+    ignored since the next load reads them from the database anyway.
+    """
+
+    def __init__(self) -> None:
+        self._boards: dict[int, GuildBoard] = {}
+
+    def get(self, guild_id: int) -> Optional[GuildBoard]:
+        return self._boards.get(guild_id)
+
+    def load(self, guild_id: int, rows: Iterable[tuple[int, int]]) -> GuildBoard:
+        board = GuildBoard(rows)
+        self._boards[guild_id] = board
+        return board
+
+    def set(self, guild_id: int, user_id: int, xp: int) -> None:
+        board = self._boards.get(guild_id)
+        if board is not None:
+            board.set(user_id, xp)
+
+    def add(self, guild_id: int, user_id: int, delta: int) -> None:
+        board = self._boards.get(guild_id)
+        if board is not None:
+            board.add(user_id, delta)
+
+    def discard(self, guild_id: int) -> None:
+        self._boards.pop(guild_id, None)
@@ -1,17 +1,34 @@
 import asyncio
 import logging
+import math
 import os
+import signal
+import time
 from typing import Optional
 
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 
-from bot_logging import setup_logging
+from activity import ActivityRecorder
+from bot_logging import setup_logging, stop_logging
+from announcer import Announcer
+from automod import Automod
 from db import Database
+import decorators
+from guild_settings import GuildSettingsStore
+import member_cache
+from metrics import REGISTRY, monitor_loop_lag, process_memory_bytes, start_http_server
+from profiler import LoopProfiler, profile_to_file
+from snapshot import read_snapshot, validate_snapshot, write_snapshot
+from xp_buffer import XPBuffer
 from cogs.moderation import ModerationCog
 from cogs.levels import LevelsCog
 from cogs.stats import StatsCog
+from cogs.data import DataCog
+from cogs.config import ConfigCog
+from cogs.automod import AutomodCog
+from cogs.profiler import ProfilerCog
 from cogs.fun import FunCog
 
 
@@ -22,10 +39,40 @@ def get_env(name: str, default: Optional[str] = None, required: bool = False) ->
     return value
 
 
-async def main():
+async def report_shard_health(bot: commands.Bot, interval: float = 30.0) -> None:
+    """Periodically export and log gateway latency for every shard this process runs."""
+    logger = logging.getLogger("bot")
+    latency_gauge = REGISTRY.gauge("bot_shard_latency_seconds", "Gateway heartbeat latency", ("shard",))
+    guilds_gauge = REGISTRY.gauge("bot_guilds", "Guilds handled by this process")
+    while True:
+        await asyncio.sleep(interval)
+        if isinstance(bot, commands.AutoShardedBot):
+            latencies = bot.latencies
+        else:
+            latencies = [(0, bot.latency)]
+        report = []
+        for shard_id, latency in latencies:
+            if math.isfinite(latency):
+                latency_gauge.labels(shard_id).set(latency)
+                report.append(f"{shard_id}={latency * 1000:.0f}ms")
+        guilds_gauge.set(len(bot.guilds))
+        logger.info("Shard latency: %s | guilds: %d", ", ".join(report) or "n/a", len(bot.guilds))
+
+
+async def main(shard_ids: Optional[list[int]] = None, shard_count: Optional[int] = None, cluster_id: int = 0):
+    """Run the bot; with shard_count set, run an AutoShardedBot for the given shard_ids.
+
+    The cluster launcher (cluster.py) calls this once per worker process.
+    """
     # Load env and configure logging
     load_dotenv()
-    setup_logging()
+    setup_logging(
+        level=logging.getLevelName(get_env("LOG_LEVEL", default="INFO").upper()),
+        use_queue=get_env("LOG_ASYNC", default="1") != "0",
+        json_format=get_env("LOG_FORMAT", default="text").lower() == "json",
+        rate_limits=get_env("LOG_RATE_LIMITS", default="decorators=20/s"),
+        sampling=get_env("LOG_SAMPLING"),
+    )
     logger = logging.getLogger("bot")
 
     token = get_env("DISCORD_TOKEN", required=True)
@@ -38,13 +85,56 @@ async def main():
     intents.guilds = True
     intents.messages = True
 
-    bot = commands.Bot(command_prefix=prefix, intents=intents)
+    # Lean gateway mode: no member chunking at startup and only members who join while
+    # the bot is online are cached; commands fetch other members on demand
+    lean = get_env("LEAN_GATEWAY", default="0") == "1"
+    gateway_options = {}
+    if lean:
+        member_cache_flags = discord.MemberCacheFlags.none()
+        member_cache_flags.joined = True
+        gateway_options = {"chunk_guilds_at_startup": False, "member_cache_flags": member_cache_flags}
+    member_cache.configure(
+        int(get_env("MEMBER_CACHE_SIZE", default="2048")), float(get_env("MEMBER_CACHE_TTL", default="300")),
+    )
+    # Commands over the bot-wide rate are dropped silently; the per-user rate applies to
+    # commands without a cooldown of their own
+    decorators.configure(
+        global_rate=get_env("COMMAND_GLOBAL_RATE", default="50/s"),
+        user_rate=get_env("COMMAND_USER_RATE", default="20/m"),
+    )
+
+    if shard_count is not None:
+        bot: commands.Bot = commands.AutoShardedBot(
+            command_prefix=prefix, intents=intents, shard_ids=shard_ids, shard_count=shard_count, **gateway_options,
+        )
+        logger.info("Cluster %d running shards %s of %d", cluster_id, shard_ids, shard_count)
+    else:
+        bot = commands.Bot(command_prefix=prefix, intents=intents, **gateway_options)
+
+    started = time.perf_counter()
+    ready_after: Optional[float] = None
+    startup_seconds = REGISTRY.gauge("bot_startup_seconds", "Time from launch until the first on_ready")
+    REGISTRY.gauge("bot_cached_members", "Members held in the gateway cache").set_function(
+        lambda: sum(len(guild.members) for guild in bot.guilds)
+    )
+
+    shard_up = REGISTRY.gauge("bot_shard_connected", "Whether the shard's gateway session is up", ("shard",))
 
     # Centralized on_ready logging
     @bot.event
     async def on_ready():
         logger.info("Bot is online as %s (id=%s)", bot.user, bot.user and bot.user.id)
         print("Bot is online!")
+        nonlocal ready_after
+        if ready_after is None:
+            # on_ready waits for member chunking unless lean mode turned it off
+            ready_after = time.perf_counter() - started
+            startup_seconds.set(ready_after)
+            logger.info(
+                "Ready in %.1fs (%s gateway): %d guilds, %d members cached, %.0f MB resident",
+                ready_after, "lean" if lean else "full", len(bot.guilds),
+                sum(len(guild.members) for guild in bot.guilds), process_memory_bytes() / 1e6,
+            )
         if client_id:
             invite_link = (
                 f"https://discord.com/api/oauth2/authorize?client_id={client_id}"
@@ -53,8 +143,33 @@ async def main():
             logger.info("Invite link: %s", invite_link)
             print(f"Invite link: {invite_link}")
 
+    @bot.event
+    async def on_shard_ready(shard_id: int):
+        shard_up.labels(shard_id).set(1)
+        logger.info("Shard %d ready", shard_id)
+
+    @bot.event
+    async def on_shard_resumed(shard_id: int):
+        shard_up.labels(shard_id).set(1)
+        logger.info("Shard %d resumed", shard_id)
+
+    @bot.event
+    async def on_shard_disconnect(shard_id: int):
+        shard_up.labels(shard_id).set(0)
+        logger.warning("Shard %d disconnected", shard_id)
+
+    @bot.event
+    async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+        member_cache.forget(payload.guild_id, payload.user.id)
+
     @bot.event
     async def on_command_error(ctx: commands.Context, error: Exception):
+        # Shed commands get no reply, and rate limits are expected rather than logged
+        if isinstance(error, decorators.CommandShed):
+            return
+        if isinstance(error, commands.CommandOnCooldown):
+            await ctx.reply(f"⏳ Slow down, try again in {math.ceil(error.retry_after)}s.", delete_after=10)
+            return
         # Provide user-friendly messages for common errors and log everything
         if isinstance(error, commands.MissingPermissions):
             await ctx.reply("⛔ You don't have permission to use this command.")
@@ -68,26 +183,154 @@ async def main():
 
     # Initialize database and add cogs
     database_url = get_env("DATABASE_URL")
-    db = Database(url=database_url)
+    db = Database(
+        url=database_url,
+        cache_size=int(get_env("STATS_CACHE_SIZE", default="10000")),
+        cache_ttl=float(get_env("STATS_CACHE_TTL", default="300")),
+        sqlite_readers=int(get_env("SQLITE_READERS", default="2")),
+        read_url=get_env("DATABASE_READ_URL") or None,
+        pool_min=int(get_env("PG_POOL_MIN", default="1")),
+        pool_max=int(get_env("PG_POOL_MAX", default="5")),
+        statement_timeout=float(get_env("PG_STATEMENT_TIMEOUT", default="0")) or None,
+        connection_lifetime=float(get_env("PG_CONNECTION_LIFETIME", default="300")),
+    )
     await db.init()
 
+    # Per-guild settings are loaded once; the prefix and XP settings are then served from memory
+    settings = GuildSettingsStore(
+        db,
+        prefix=prefix,
+        xp_min=int(get_env("XP_MIN", default="5")),
+        xp_max=int(get_env("XP_MAX", default="10")),
+    )
+    await settings.load()
+    bot.command_prefix = settings.prefix
+    automod = Automod(
+        db,
+        strikes=int(get_env("AUTOMOD_STRIKES", default="3")),
+        strike_window=float(get_env("AUTOMOD_STRIKE_WINDOW", default="600")),
+        timeout=float(get_env("AUTOMOD_TIMEOUT", default="600")),
+    )
+    await automod.load()
+
+    # Write-behind XP accumulation; XP_FLUSH_INTERVAL=0 writes every message directly
+    flush_interval = float(get_env("XP_FLUSH_INTERVAL", default="5"))
+    xp_store: Database | XPBuffer = db
+    xp_buffer: Optional[XPBuffer] = None
+    if flush_interval > 0:
+        xp_buffer = XPBuffer(db, interval=flush_interval, max_pending=int(get_env("XP_FLUSH_SIZE", default="500")))
+        xp_buffer.start()
+        xp_store = xp_buffer
+
+    # Warm start: seed hot users from the snapshot the last graceful shutdown wrote,
+    # then check them against the database in the background
+    snapshot_path = get_env("SNAPSHOT_PATH", default="warm.snapshot")
+    if snapshot_path and shard_count is not None:
+        snapshot_path = f"{snapshot_path}.{cluster_id}"
+    validate_task: Optional[asyncio.Task] = None
+    if snapshot_path:
+        start = time.perf_counter()
+        rows = read_snapshot(snapshot_path, max_age=float(get_env("SNAPSHOT_MAX_AGE", default="86400")))
+        if rows:
+            rows = rows[:xp_store.seed(rows)]
+            logger.info("Warm start: seeded %d users in %.0f ms", len(rows), (time.perf_counter() - start) * 1000)
+            validate_task = asyncio.create_task(validate_snapshot(db, xp_store, rows))
+
+    # Hourly message rollups for !activity; ACTIVITY_FLUSH_INTERVAL=0 disables them
+    activity: Optional[ActivityRecorder] = None
+    activity_interval = float(get_env("ACTIVITY_FLUSH_INTERVAL", default="60"))
+    if activity_interval > 0:
+        activity = ActivityRecorder(
+            db,
+            interval=activity_interval,
+            hourly_days=int(get_env("ACTIVITY_HOURLY_DAYS", default="7")),
+            retention_days=int(get_env("ACTIVITY_RETENTION_DAYS", default="365")),
+        )
+        activity.start()
+
+    # Prometheus-format metrics on a local port when METRICS_PORT is set
+    metrics_port = get_env("METRICS_PORT")
+    metrics_server: Optional[asyncio.AbstractServer] = None
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    health_task = asyncio.create_task(report_shard_health(bot))
+    if metrics_port:
+        # Each cluster worker listens on its own port
+        metrics_server = await start_http_server(
+            get_env("METRICS_HOST", default="127.0.0.1"), int(metrics_port) + cluster_id,
+        )
+
     await bot.add_cog(ModerationCog(bot))
-    await bot.add_cog(LevelsCog(bot, db))
-    await bot.add_cog(StatsCog(bot, db))
+    await bot.add_cog(AutomodCog(bot, automod))
+    announcer = Announcer(window=float(get_env("LEVELUP_ANNOUNCE_WINDOW", default="2")))
+    await bot.add_cog(LevelsCog(
+        bot, xp_store, xp_cooldown=float(get_env("XP_COOLDOWN", default="0")), announcer=announcer, settings=settings,
+    ))
+    await bot.add_cog(StatsCog(bot, xp_store, activity=activity))
+    await bot.add_cog(DataCog(bot, xp_store))
+    await bot.add_cog(ConfigCog(bot, settings))
     await bot.add_cog(FunCog(bot))
+    profiler = LoopProfiler(
+        interval=float(get_env("PROFILE_INTERVAL_MS", default="5")) / 1000,
+        slow_threshold=float(get_env("SLOW_CALLBACK_MS", default="100")) / 1000,
+    )
+    await bot.add_cog(ProfilerCog(bot, profiler))
 
     # Graceful shutdown
     async def shutdown():
         logger.info("Shutting down bot...")
+        lag_task.cancel()
+        health_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        if xp_buffer is not None:
+            try:
+                await xp_buffer.close()
+            except Exception:
+                logger.exception("Failed to flush buffered XP on shutdown")
+        if activity is not None:
+            try:
+                await activity.close()
+            except Exception:
+                logger.exception("Failed to flush activity rollups on shutdown")
+        if validate_task is not None:
+            validate_task.cancel()
+        if snapshot_path:
+            try:
+                count = write_snapshot(snapshot_path, xp_store.hot_users())
+                logger.info("Wrote warm-start snapshot of %d users to %s", count, snapshot_path)
+            except Exception:
+                logger.exception("Failed to write warm-start snapshot")
+        logger.info("Stats cache: %s", db.stats_cache.info())
         await db.close()
 
+    # SIGTERM (docker stop, cluster launcher) and SIGINT close the gateway cleanly
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(bot.close()))
+        except (NotImplementedError, RuntimeError):
+            pass
+    # SIGUSR1 profiles the event loop and writes the collapsed stacks to PROFILE_DIR
+    if hasattr(signal, "SIGUSR1"):
+        profile_seconds = float(get_env("PROFILE_SIGNAL_SECONDS", default="30"))
+        profile_dir = get_env("PROFILE_DIR", default=".")
+        try:
+            loop.add_signal_handler(
+                signal.SIGUSR1,
+                lambda: asyncio.ensure_future(profile_to_file(profiler, profile_seconds, profile_dir)),
+            )
+        except (NotImplementedError, RuntimeError):
+            pass
+
     try:
-        logger.info("Starting bot with prefix '%s'", prefix)
+        logger.info("Starting bot with default prefix '%s'", prefix)
         await bot.start(token)
     except Exception:
         logger.exception("Bot crashed with an unexpected error")
     finally:
         await shutdown()
+        stop_logging()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Iterable, Optional
+
+import discord
+
+from metrics import REGISTRY
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("mass_action")
+
+MAX_TARGETS = 1000
+
+ACTIONS = REGISTRY.counter("bot_mass_action_members_total", "Members processed by mass moderation", ("action", "result"))
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text: str) -> timedelta:
+    """Parse "90s", "10m", "2h" or "1d" (bare numbers are minutes) into a timedelta."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", text.lower())
+    if match is None:
+        raise ValueError(f"Invalid duration: {text!r}")
+    value, unit = match.groups()
+    return timedelta(seconds=float(value) * _DURATION_UNITS[unit or "m"])
+
+
+def select_members(
+    guild: discord.Guild,
+    joined_within: Optional[timedelta] = None,
+    name_pattern: Optional[re.Pattern] = None,
+) -> list[discord.Member]:
+    """Cached guild members matching every given selector, newest joins first."""
+    if joined_within is None and name_pattern is None:
+        return []
+    cutoff = discord.utils.utcnow() - joined_within if joined_within is not None else None
+    selected = []
+    for member in guild.members:
+        if cutoff is not None and (member.joined_at is None or member.joined_at < cutoff):
+            continue
+        if name_pattern is not None and not (
+            name_pattern.search(member.name) or name_pattern.search(member.display_name)
+        ):
+            continue
+        selected.append(member)
+    selected.sort(key=lambda m: m.joined_at or discord.utils.utcnow(), reverse=True)
+    return selected
+
+
+def partition_targets(
+    moderator: discord.Member,
+    members: Iterable[discord.Member],
+) -> tuple[list[discord.Member], list[discord.Member]]:
+    """Split targets into (actionable, protected) using one role-hierarchy check for the whole batch.
+
+    A member is protected if it is the moderator, the bot, the guild owner, or has a top
+    role at or above the moderator's (unless the moderator owns the guild) or the bot's.
+    """
+    guild = moderator.guild
+    me = guild.me
+    ceiling = me.top_role
+    if moderator.id != guild.owner_id and moderator.top_role < ceiling:
+        ceiling = moderator.top_role
+    untouchable = {moderator.id, me.id, guild.owner_id}
+
+    actionable, protected, seen = [], [], set()
+    for member in members:
+        if member.id in seen:
+            continue
+        seen.add(member.id)
+        if member.id in untouchable or member.top_role >= ceiling:
+            protected.append(member)
+        else:
+            actionable.append(member)
+    return actionable, protected
+
+
+class MassActionResult:
+    """Outcome of one mass action, summarized for a single reply."""
+
+    def __init__(self, action: str, protected: int) -> None:
+        self.action = action
+        self.protected = protected
+        self.succeeded = 0
+        self.forbidden = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    def summary(self, verb: str) -> str:
+        total = self.succeeded + self.forbidden + self.failed
+        parts = [f"✅ {verb} {self.succeeded}/{total} members in {self.elapsed:.1f}s."]
+        if self.protected:
+            parts.append(f"Skipped {self.protected} with an equal or higher role.")
+        if self.forbidden:
+            parts.append(f"{self.forbidden} refused by Discord (missing permissions).")
+        if self.failed:
+            parts.append(f"{self.failed} failed, see logs.")
+        return " ".join(parts)
+
+
+async def run_mass_action(
+    action: str,
+    members: list[discord.Member],
+    apply: Callable[[discord.Member], Awaitable[None]],
+    protected: int = 0,
+    concurrency: int = 4,
+    rate: float = 5.0,
+) -> MassActionResult:
+    """Apply `apply` to every member with at most `concurrency` requests in flight and
+    at most `rate` requests per second, so a raid response doesn't trip global rate limits.
+    """
+    result = MassActionResult(action, protected)
+    bucket = TokenBucket(rate, max(rate, 1.0))
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def worker(member: discord.Member) -> None:
+        async with semaphore:
+            await bucket.acquire()
+            try:
+                await apply(member)
+                result.succeeded += 1
+                ACTIONS.labels(action, "ok").inc()
+            except discord.NotFound:
+                # Already gone (left, or banned by someone else): the goal is met
+                result.succeeded += 1
+                ACTIONS.labels(action, "ok").inc()
+            except discord.Forbidden:
+                result.forbidden += 1
+                ACTIONS.labels(action, "forbidden").inc()
+            except Exception:
+                result.failed += 1
+                ACTIONS.labels(action, "error").inc()
+                logger.exception("Mass %s failed for %s", action, member)
+
+    await asyncio.gather(*(worker(member) for member in members))
+    result.elapsed = time.perf_counter() - start
+    return result
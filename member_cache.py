@@ -0,0 +1,87 @@
+import asyncio
+from typing import Annotated, Iterable, Optional
+
+import discord
+from discord.ext import commands
+
+from cache import MISSING, TTLCache
+from metrics import REGISTRY
+
+# Members fetched on demand, keyed by (guild_id, user_id) and (guild_id, "name")
+_members: TTLCache[discord.Member] = TTLCache(maxsize=2048, ttl=300.0)
+
+_events = REGISTRY.counter("bot_member_cache_events_total", "Member converter cache lookups", ("event",))
+_events.labels("hit").set_function(lambda: _members.hits)
+_events.labels("miss").set_function(lambda: _members.misses)
+_events.labels("eviction").set_function(lambda: _members.evictions)
+
+
+def configure(maxsize: int, ttl: float) -> None:
+    """Resize the on-demand member cache (clears it)."""
+    global _members
+    _members = TTLCache(maxsize, ttl)
+
+
+def forget(guild_id: int, user_id: int) -> None:
+    _members.pop((guild_id, user_id))
+
+
+async def refresh(member: discord.Member) -> discord.Member:
+    """Return `member` with current roles, for role-hierarchy checks.
+
+    A member from this cache may be up to `ttl` seconds old; members in the gateway
+    cache are kept current by Discord, the rest are fetched again. Raises
+    discord.NotFound if they left the guild.
+    """
+    guild = member.guild
+    current = guild.get_member(member.id)
+    if current is None:
+        current = await guild.fetch_member(member.id)
+        _members.set((guild.id, member.id), current)
+    return current
+
+
+async def refresh_many(members: Iterable[discord.Member]) -> list[discord.Member]:
+    """refresh() each member concurrently, dropping those who left the guild."""
+    results = await asyncio.gather(*(refresh(member) for member in members), return_exceptions=True)
+    current = []
+    for result in results:
+        if isinstance(result, discord.NotFound):
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        current.append(result)
+    return current
+
+
+class CachedMemberConverter(commands.MemberConverter):
+    """MemberConverter that remembers members it had to fetch.
+
+    Members already in the gateway cache (or mentioned in the message) are found
+    without a lookup. The rest are fetched by discord.py from the gateway or the API,
+    which with a lean member cache would otherwise happen on every command.
+    """
+
+    async def query_member_by_id(self, bot, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        member = _members.get((guild.id, user_id))
+        if member is not MISSING:
+            return member
+        member = await super().query_member_by_id(bot, guild, user_id)
+        if member is not None:
+            _members.set((guild.id, user_id), member)
+        return member
+
+    async def query_member_named(self, guild: discord.Guild, argument: str) -> Optional[discord.Member]:
+        key = (guild.id, argument)
+        member = _members.get(key)
+        if member is not MISSING:
+            return member
+        member = await super().query_member_named(guild, argument)
+        if member is not None:
+            _members.set(key, member)
+            _members.set((guild.id, member.id), member)
+        return member
+
+
+# Use in command signatures in place of discord.Member
+Member = Annotated[discord.Member, CachedMemberConverter]
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("profiler")
+
+MAX_PROFILE_SECONDS = 300
+# Shortest GIL switch interval set while profiling; shorter ones cost the loop more in switches
+MIN_SWITCH_INTERVAL = 0.001
+
+SLOW_CALLBACKS = REGISTRY.counter("bot_event_loop_blocked_total", "Callbacks that blocked the event loop while profiling")
+SAMPLES = REGISTRY.counter("bot_profiler_samples_total", "Event-loop stack samples taken")
+
+Stack = tuple[str, ...]
+
+
+class Profile:
+    """Stack samples of the event-loop thread, root frame first, plus the callbacks that blocked it."""
+
+    def __init__(self, seconds: float, interval: float, slow_threshold: float) -> None:
+        self.seconds = seconds
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.stacks: Counter[Stack] = Counter()
+        self.idle = 0
+        # (seconds blocked, stack seen while blocked)
+        self.slow: list[tuple[float, Stack]] = []
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def collapsed(self) -> str:
+        """Folded stacks ("root;...;leaf count" per line) for flamegraph.pl, speedscope or inferno."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, n: int = 10) -> list[tuple[str, int]]:
+        """Busiest frames by self time, idle waits excluded."""
+        leaves: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            if stack and not _is_idle(stack[-1]):
+                leaves[stack[-1]] += count
+        return leaves.most_common(n)
+
+    def summary(self, n: int = 10) -> str:
+        samples = self.samples
+        busy = samples - self.idle
+        lines = [
+            f"{samples} samples over {self.seconds:.0f}s every {self.interval * 1000:.0f} ms, "
+            f"loop busy {busy / samples:.0%}" if samples else "No samples taken."
+        ]
+        for label, count in self.top(n):
+            lines.append(f"{count / samples:6.1%}  {label}")
+        if self.slow:
+            lines.append(f"{len(self.slow)} callbacks blocked the loop for more than {self.slow_threshold * 1000:.0f} ms:")
+            for blocked, stack in sorted(self.slow, reverse=True)[:5]:
+                lines.append(f"{blocked * 1000:6.0f} ms  {' <- '.join(reversed(stack[-3:]))}")
+        return "\n".join(lines)
+
+
+def _is_idle(label: str) -> bool:
+    # The loop waiting in its selector for I/O or the next timer
+    return label.startswith("select (selectors.py")
+
+
+class LoopProfiler:
+    """Samples the event-loop thread's stack from a helper thread, on demand.
+
+    While profile() runs, a daemon thread reads the loop thread's current frame every
+    `interval` seconds via sys._current_frames() and counts the stacks; the loop
+    itself only runs a cheap heartbeat timer. When the heartbeat is more than
+    `slow_threshold` seconds late, the loop is blocked and the stack the sampler sees
+    is recorded as a slow callback. Nothing runs between profiles.
+
+    The sampler can only read the stack when the loop thread gives up the GIL, at most
+    every switch interval (about `interval`, bounded by MIN_SWITCH_INTERVAL), so
+    callbacks shorter than that are sampled less accurately than long ones.
+    """
+
+    def __init__(self, interval: float = 0.005, slow_threshold: float = 0.1) -> None:
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self._lock = asyncio.Lock()
+        self._beat = 0.0
+        self._beat_handle: Optional[asyncio.TimerHandle] = None
+        self._labels: dict[CodeType, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float) -> Profile:
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        seconds = max(0.1, min(seconds, MAX_PROFILE_SECONDS))
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            profile = Profile(seconds, self.interval, self.slow_threshold)
+            stop = threading.Event()
+            sampler = threading.Thread(
+                target=self._sample, args=(threading.get_ident(), profile, stop), name="loop-profiler", daemon=True,
+            )
+            # The sampler needs the GIL to read the stack, so let it in about once per
+            # sample; no more often, as every switch slows the loop down
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(switch_interval, max(self.interval, MIN_SWITCH_INTERVAL)))
+            self._heartbeat(loop)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                sys.setswitchinterval(switch_interval)
+                if self._beat_handle is not None:
+                    self._beat_handle.cancel()
+                    self._beat_handle = None
+                await asyncio.to_thread(sampler.join)
+        logger.info("Profiled the event loop for %.0fs: %d samples, %d slow callbacks", seconds, profile.samples, len(profile.slow))
+        return profile
+
+    def _heartbeat(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._beat = time.monotonic()
+        self._beat_handle = loop.call_later(self.slow_threshold / 4, self._heartbeat, loop)
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _stack(self, frame: Optional[FrameType]) -> Stack:
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def _sample(self, thread_id: int, profile: Profile, stop: threading.Event) -> None:
+        blocked_for = 0.0
+        blocked_stack: Optional[Stack] = None
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stack = self._stack(frame)
+            del frame
+            profile.stacks[stack] += 1
+            idle = bool(stack) and _is_idle(stack[-1])
+            profile.idle += idle
+            SAMPLES.inc()
+            late = time.monotonic() - self._beat - self.slow_threshold / 4
+            if late > self.slow_threshold and not idle:
+                if blocked_stack is None:
+                    blocked_stack = stack
+                blocked_for = late
+            elif blocked_stack is not None:
+                profile.slow.append((blocked_for, blocked_stack))
+                SLOW_CALLBACKS.inc()
+                blocked_stack = None
+        if blocked_stack is not None:
+            profile.slow.append((blocked_for, blocked_stack))
+            SLOW_CALLBACKS.inc()
+
+
+async def profile_to_file(profiler: LoopProfiler, seconds: float, directory: str = ".") -> Optional[str]:
+    """Profile, write the collapsed stacks to `directory` and log the summary; for the signal trigger."""
+    if profiler.running:
+        logger.warning("Ignoring profile request: a profile is already running")
+        return None
+    logger.info("Profiling the event loop for %.0fs", seconds)
+    profile = await profiler.profile(seconds)
+    path = os.path.join(directory, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+    await asyncio.to_thread(_write_text, path, profile.collapsed())
+    logger.info("Wrote %s\n%s", path, profile.summary())
+    return path
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from itertools import count
+from typing import Optional
+
+import discord
+
+from metrics import REGISTRY
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("purge")
+
+BULK_DELETE_SIZE = 100
+# Discord only bulk-deletes messages younger than 14 days; keep a margin for clock skew
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+
+DELETED = REGISTRY.counter("bot_purge_deleted_total", "Messages deleted by purge jobs", ("method",))
+JOBS = REGISTRY.gauge("bot_purge_jobs", "Purge jobs by state", ("state",))
+
+
+class PurgeFilters:
+    """Which messages a purge job deletes; every set filter must match."""
+
+    __slots__ = ("author_id", "contains", "bots_only", "attachments_only", "before", "after")
+
+    def __init__(
+        self,
+        author_id: Optional[int] = None,
+        contains: Optional[str] = None,
+        bots_only: bool = False,
+        attachments_only: bool = False,
+        before: Optional[discord.abc.Snowflake] = None,
+        after: Optional[discord.abc.Snowflake] = None,
+    ) -> None:
+        self.author_id = author_id
+        self.contains = contains.lower() if contains else None
+        self.bots_only = bots_only
+        self.attachments_only = attachments_only
+        self.before = before
+        self.after = after
+
+    def matches(self, message: discord.Message) -> bool:
+        if self.author_id is not None and message.author.id != self.author_id:
+            return False
+        if self.bots_only and not message.author.bot:
+            return False
+        if self.attachments_only and not message.attachments:
+            return False
+        if self.contains is not None and self.contains not in message.content.lower():
+            return False
+        return True
+
+    def describe(self) -> str:
+        parts = []
+        if self.author_id is not None:
+            parts.append(f"from <@{self.author_id}>")
+        if self.bots_only:
+            parts.append("bots only")
+        if self.attachments_only:
+            parts.append("with attachments")
+        if self.contains is not None:
+            parts.append(f'containing "{self.contains}"')
+        if self.before is not None:
+            parts.append(f"before {self.before.id}")
+        if self.after is not None:
+            parts.append(f"after {self.after.id}")
+        return ", ".join(parts) or "all messages"
+
+
+class PurgeJob:
+    """One purge running in the background against a single channel."""
+
+    def __init__(
+        self,
+        job_id: int,
+        channel: discord.TextChannel,
+        requester: discord.abc.User,
+        limit: int,
+        filters: PurgeFilters,
+        max_scan: int,
+    ) -> None:
+        self.id = job_id
+        self.channel = channel
+        self.requester = requester
+        self.limit = limit
+        self.filters = filters
+        self.max_scan = max_scan
+        self.scanned = 0
+        self.deleted = 0
+        self.state = "queued"
+        self.started = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.status_message: Optional[discord.Message] = None
+
+    @property
+    def guild_id(self) -> int:
+        return self.channel.guild.id
+
+    def progress(self) -> str:
+        return (
+            f"🧹 Purge #{self.id} in {self.channel.mention} ({self.filters.describe()}): {self.state}, "
+            f"deleted {self.deleted}/{self.limit}, scanned {self.scanned}"
+        )
+
+
+class PurgeManager:
+    """Runs purge jobs as tracked background tasks.
+
+    Matching messages younger than 14 days are deleted in 100-message bulk calls; older
+    ones fall back to paced single deletes. At most `per_guild` jobs run at once per
+    guild, the rest wait their turn. A status message is edited with progress every
+    `progress_interval` seconds and jobs can be cancelled at any time.
+    """
+
+    def __init__(self, per_guild: int = 2, progress_interval: float = 5.0, single_delete_rate: float = 1.0) -> None:
+        self.per_guild = per_guild
+        self.progress_interval = progress_interval
+        self.single_delete_rate = single_delete_rate
+        self.jobs: dict[int, PurgeJob] = {}
+        self._ids = count(1)
+        self._slots: dict[int, asyncio.Semaphore] = {}
+
+    def start(
+        self,
+        channel: discord.TextChannel,
+        requester: discord.abc.User,
+        limit: int,
+        filters: PurgeFilters,
+        status_message: Optional[discord.Message] = None,
+    ) -> PurgeJob:
+        # Filtered purges may have to look past many non-matching messages
+        filtered = filters.author_id or filters.contains or filters.bots_only or filters.attachments_only
+        max_scan = min(limit * 20, 50_000) if filtered else limit
+        job = PurgeJob(next(self._ids), channel, requester, limit, filters, max_scan)
+        job.status_message = status_message
+        job.task = asyncio.create_task(self._run(job))
+        self.jobs[job.id] = job
+        return job
+
+    def for_guild(self, guild_id: int) -> list[PurgeJob]:
+        return [job for job in self.jobs.values() if job.guild_id == guild_id]
+
+    def cancel(self, job: PurgeJob) -> None:
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    async def close(self) -> None:
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: PurgeJob) -> None:
+        slots = self._slots.setdefault(job.guild_id, asyncio.Semaphore(self.per_guild))
+        reporter: Optional[asyncio.Task] = None
+        try:
+            async with slots:
+                job.state = "running"
+                reporter = asyncio.create_task(self._report(job))
+                await self._purge(job)
+                job.state = "done"
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+        except discord.Forbidden:
+            job.state = "failed (missing permissions)"
+        except Exception:
+            job.state = "failed"
+            logger.exception("Purge job %d failed", job.id)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            self._update_gauges()
+            logger.info(
+                "Purge #%d in #%s by %s %s: deleted %d, scanned %d in %.1fs",
+                job.id, job.channel, job.requester, job.state, job.deleted, job.scanned, time.monotonic() - job.started,
+            )
+            await self._edit_status(job, final=True)
+            self.jobs.pop(job.id, None)
+
+    async def _purge(self, job: PurgeJob) -> None:
+        filters = job.filters
+        single_deletes = TokenBucket(self.single_delete_rate, 1)
+        skip = {job.status_message.id} if job.status_message is not None else set()
+        batch: list[discord.Message] = []
+        self._update_gauges()
+
+        history = job.channel.history(
+            limit=job.max_scan, before=filters.before, after=filters.after, oldest_first=False,
+        )
+        async for message in history:
+            job.scanned += 1
+            if message.id in skip or not filters.matches(message):
+                continue
+            if discord.utils.utcnow() - message.created_at < BULK_DELETE_MAX_AGE:
+                batch.append(message)
+                if len(batch) == BULK_DELETE_SIZE:
+                    await self._bulk_delete(job, batch)
+                    batch = []
+            else:
+                # History runs newest first, so everything from here on is too old to bulk delete
+                if batch:
+                    await self._bulk_delete(job, batch)
+                    batch = []
+                await single_deletes.acquire()
+                try:
+                    await message.delete()
+                    job.deleted += 1
+                    DELETED.labels("single").inc()
+                except discord.NotFound:
+                    pass
+            if job.deleted + len(batch) >= job.limit:
+                break
+        if batch:
+            await self._bulk_delete(job, batch)
+
+    async def _bulk_delete(self, job: PurgeJob, batch: list[discord.Message]) -> None:
+        try:
+            await job.channel.delete_messages(batch, reason=f"Purge #{job.id} by {job.requester}")
+        except discord.NotFound:
+            # Someone else deleted one of them; fall back to deleting the rest one by one,
+            # counting only the messages this job actually removed
+            for message in batch:
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    continue
+                job.deleted += 1
+                DELETED.labels("single").inc()
+            return
+        job.deleted += len(batch)
+        DELETED.labels("bulk").inc(len(batch))
+
+    async def _report(self, job: PurgeJob) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._edit_status(job)
+
+    async def _edit_status(self, job: PurgeJob, final: bool = False) -> None:
+        if job.status_message is None:
+            return
+        try:
+            await job.status_message.edit(content=job.progress(), delete_after=10 if final else None)
+        except discord.HTTPException:
+            job.status_message = None
+
+    def _update_gauges(self) -> None:
+        states: dict[str, int] = {"queued": 0, "running": 0}
+        for job in self.jobs.values():
+            if job.state in states:
+                states[job.state] += 1
+        for state, value in states.items():
+            JOBS.labels(state).set(value)
@@ -0,0 +1,49 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity` tokens."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0, now: Optional[float] = None) -> bool:
+        """Take tokens if available and return whether they were taken."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def retry_after(self, tokens: float = 1.0, now: Optional[float] = None) -> float:
+        """Seconds until `tokens` will be available."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until tokens are available, then take them."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.retry_after(tokens))
+
+
+def parse_rate(spec: str) -> tuple[float, float]:
+    """Parse "20/s", "300/m" or "5" (per second) into (rate_per_second, burst)."""
+    spec = spec.strip()
+    count, _, unit = spec.partition("/")
+    per = {"": 1.0, "s": 1.0, "m": 60.0, "h": 3600.0}[unit.strip().lower()]
+    rate = float(count) / per
+    return rate, max(float(count), 1.0)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from db import Database
+from xp_buffer import XPBuffer
+
+logger = logging.getLogger("snapshot")
+
+MAGIC = b"XPSNAP\x00\x01"
+# magic, record count, created (unix time), crc32 of the records
+HEADER = struct.Struct("<8sIdI")
+# guild_id, user_id, xp, level, messages, last_active (UTF-8, NUL padded)
+RECORD = struct.Struct("<QQqiq32s")
+
+Row = tuple[int, int, int, int, int, str]
+
+
+def _utc(last_active: str) -> str:
+    """A last_active string as UTC "YYYY-MM-DD HH:MM:SS", whatever offset it was written with."""
+    if not last_active:
+        return ""
+    try:
+        moment = datetime.fromisoformat(last_active)
+    except ValueError:
+        return last_active
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def write_snapshot(path: str, rows: Iterable[Row]) -> int:
+    """Write rows to `path` atomically (temp file + rename), return the number written."""
+    body = bytearray()
+    count = 0
+    for guild_id, user_id, xp, level, messages, last_active in rows:
+        body += RECORD.pack(guild_id, user_id, xp, level, messages, last_active.encode())
+        count += 1
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, count, time.time(), zlib.crc32(body)))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return count
+
+
+def read_snapshot(path: str, max_age: Optional[float] = None) -> list[Row]:
+    """Memory-map and decode a snapshot, then delete it.
+
+    The file is consumed so that only a graceful shutdown, which writes a fresh one,
+    can warm the next start. Returns [] for a missing, stale, truncated or corrupt file.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return []
+    try:
+        if size < HEADER.size:
+            raise ValueError("truncated header")
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, count, created, crc = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError("unknown format")
+            if size != HEADER.size + count * RECORD.size:
+                raise ValueError("truncated records")
+            if max_age is not None and time.time() - created > max_age:
+                logger.info("Ignoring snapshot %s from %.0fs ago", path, time.time() - created)
+                return []
+            with memoryview(mm)[HEADER.size:] as body:
+                if zlib.crc32(body) != crc:
+                    raise ValueError("checksum mismatch")
+                # Snapshots from older versions may hold Postgres' "+00" form
+                return [
+                    (guild_id, user_id, xp, level, messages, _utc(last_active.rstrip(b"\0").decode()))
+                    for guild_id, user_id, xp, level, messages, last_active in RECORD.iter_unpack(body)
+                ]
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        return []
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def validate_snapshot(
+    db: Database,
+    store: Database | XPBuffer,
+    rows: list[Row],
+    batch_size: int = 500,
+    pause: float = 0.05,
+) -> int:
+    """Check seeded rows against the database in the background, return how many were corrected.
+
+    Reads `batch_size` users per query with a short pause in between, so validation
+    never competes with live traffic for long.
+    """
+    corrected = 0
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        actual = await db.fetch_stats_many([(user_id, guild_id) for guild_id, user_id, *_ in batch])
+        for row in batch:
+            stats = actual.get((row[1], row[0]))
+            if stats is not None:
+                stats = (*stats[:3], _utc(stats[3]))
+            if store.reconcile(row, stats):
+                corrected += 1
+        await asyncio.sleep(pause)
+    logger.info(
+        "Validated %d snapshot users in %.1fs, %d differed from the database",
+        len(rows), time.perf_counter() - start, corrected,
+    )
+    return corrected
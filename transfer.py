@@ -0,0 +1,187 @@
+"""Streaming export/import of the users table as CSV or JSON Lines.
+
+    python transfer.py export users.csv [--guild ID] [--format csv|jsonl]
+    python transfer.py import users.jsonl [--guild ID] [--mode replace|add]
+
+Uses DATABASE_URL like the bot (SQLite bot.db without it). The format defaults to
+the file extension; "-" reads stdin / writes stdout.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional, TextIO
+
+from dotenv import load_dotenv
+
+from db import USER_COLUMNS, Database
+from xp_buffer import XPBuffer
+
+logger = logging.getLogger("transfer")
+
+FORMATS = ("csv", "jsonl")
+
+
+def detect_format(path: str, default: str = "csv") -> str:
+    return "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else default
+
+
+class Progress:
+    """Counts rows and reports the running total and rows/sec at most every `interval` seconds."""
+
+    def __init__(self, label: str, report: Optional[Callable[[str], None]] = None, interval: float = 2.0) -> None:
+        self.label = label
+        self.report = report or (lambda text: logger.info("%s", text))
+        self.interval = interval
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return f"{self.label}: {self.rows} rows in {time.perf_counter() - self.started:.1f}s ({self.rate:,.0f} rows/s)"
+
+    def __call__(self, rows: int) -> None:
+        self.rows = rows
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report(self.summary())
+
+
+def _parse_time(value) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _parse_row(record: dict, guild_id: Optional[int]) -> tuple[int, int, int, int, int, Optional[datetime]]:
+    return (
+        int(record["user_id"]),
+        guild_id if guild_id is not None else int(record["guild_id"]),
+        int(record.get("xp") or 0),
+        int(record.get("level") or 0),
+        int(record.get("messages") or 0),
+        _parse_time(record.get("last_active")),
+    )
+
+
+def read_batches(
+    fp: TextIO, fmt: str, guild_id: Optional[int] = None, batch_size: int = 5000,
+) -> Iterator[list[tuple[int, int, int, int, int, Optional[datetime]]]]:
+    """Lazily parse rows from a CSV (with header) or JSONL file into import batches.
+
+    With `guild_id` every row is imported into that guild, whatever the file says.
+    Raises ValueError with the line number on malformed input.
+    """
+    if fmt == "csv":
+        records = csv.DictReader(fp)
+    else:
+        records = (json.loads(line) for line in fp if line.strip())
+    batch = []
+    line = 0
+    try:
+        for line, record in enumerate(records, start=1):
+            batch.append(_parse_row(record, guild_id))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except (KeyError, ValueError, TypeError) as e:
+        raise ValueError(f"Bad row {line + 1}: {e!r}") from e
+    if batch:
+        yield batch
+
+
+async def export_users(
+    store: Database | XPBuffer,
+    fp: TextIO,
+    fmt: str,
+    guild_id: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Write users to `fp` batch by batch as they are read, return the row count."""
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(fp)
+        writer.writerow(USER_COLUMNS)
+    total = 0
+    async for batch in store.iter_users(guild_id):
+        if writer is not None:
+            writer.writerows(batch)
+        else:
+            fp.writelines(json.dumps(dict(zip(USER_COLUMNS, row))) + "\n" for row in batch)
+        total += len(batch)
+        if progress is not None:
+            progress(total)
+    return total
+
+
+async def import_users(
+    store: Database | XPBuffer,
+    fp: TextIO,
+    fmt: str,
+    mode: str = "replace",
+    guild_id: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Import rows from `fp`; a seekable file is checked in full first, so a malformed one imports nothing."""
+    if fp.seekable():
+        start = fp.tell()
+        for _ in read_batches(fp, fmt, guild_id):
+            pass
+        fp.seek(start)
+    return await store.import_users(read_batches(fp, fmt, guild_id), mode, progress)
+
+
+async def _cli(args: argparse.Namespace) -> None:
+    db = Database(url=os.getenv("DATABASE_URL") or None, sqlite_readers=1)
+    await db.init()
+    fmt = args.format or detect_format(args.path)
+    progress = Progress(args.command.capitalize())
+    try:
+        if args.command == "export":
+            out = sys.stdout if args.path == "-" else open(args.path, "w", newline="", encoding="utf-8")
+            try:
+                await export_users(db, out, fmt, args.guild, progress)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        else:
+            src = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+            try:
+                await import_users(db, src, fmt, args.mode, args.guild, progress)
+            finally:
+                if src is not sys.stdin:
+                    src.close()
+    finally:
+        await db.close()
+    logger.info("%s", progress.summary())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export or import XP data as CSV/JSONL")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help='file to write or read, "-" for stdout/stdin')
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension, else csv")
+    parser.add_argument("--guild", type=int, help="export only this guild / import every row into it")
+    parser.add_argument("--mode", choices=("replace", "add"), default="replace",
+                        help="import: overwrite existing users or add to their XP and messages")
+    args = parser.parse_args()
+    load_dotenv()
+    # Progress goes to stderr so exports can be piped
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s | %(levelname)s | %(message)s")
+    asyncio.run(_cli(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+from db import Database, xp_to_level
+from metrics import REGISTRY
+
+logger = logging.getLogger("xp_buffer")
+
+
+class _Entry:
+    __slots__ = ("xp", "level", "messages", "last_active", "pending_xp", "pending_messages", "pending_active")
+
+    def __init__(self, xp: int = 0, level: int = 0, messages: int = 0, last_active: str = "") -> None:
+        self.xp = xp
+        self.level = level
+        self.messages = messages
+        self.last_active = last_active
+        self.pending_xp = 0
+        self.pending_messages = 0
+        self.pending_active: Optional[datetime] = None
+
+    @property
+    def dirty(self) -> bool:
+        return self.pending_active is not None
+
+
+class XPBuffer:
+    """Write-behind accumulator for XP, message counts and last_active.
+
+    Keeps running totals per (guild_id, user_id) in memory so level-ups are detected
+    immediately, and writes the accumulated deltas to the database in bulk once
+    `max_pending` users are dirty, every `interval` seconds, and on close().
+    Exposes the same add_message/set_level/get_stats interface as Database.
+    """
+
+    def __init__(self, db: Database, interval: float = 5.0, max_pending: int = 500, max_entries: int = 50_000) -> None:
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_entries = max_entries
+        self._entries: dict[tuple[int, int], _Entry] = {}
+        self._loading: dict[tuple[int, int], asyncio.Future] = {}
+        self._dirty: set[tuple[int, int]] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        REGISTRY.gauge("bot_xp_buffer_pending", "Users with unflushed XP").set_function(lambda: len(self._dirty))
+        REGISTRY.gauge("bot_xp_buffer_entries", "Users resident in the XP buffer").set_function(lambda: len(self._entries))
+
+    def start(self) -> None:
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        await self.flush()
+        logger.info("XP buffer flushed and closed")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Periodic XP flush failed")
+
+    async def _entry(self, user_id: int, guild_id: int) -> _Entry:
+        key = (guild_id, user_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            # Move to the end so eviction drops the least recently used users first
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            stats = await self.db.get_stats(user_id, guild_id)
+            entry = _Entry(*stats) if stats else _Entry()
+            self._entries[key] = entry
+            future.set_result(entry)
+            return entry
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark retrieved so a failed load with no other waiters doesn't warn
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+
+    # Database-compatible interface
+    async def add_message(self, user_id: int, guild_id: int, xp_gain: int, messages: int = 1) -> tuple[int, int, int]:
+        """Buffer messages and their XP, return the up-to-date (xp, old_level, new_level)."""
+        entry = await self._entry(user_id, guild_id)
+        now = datetime.now(timezone.utc)
+        old_level = entry.level
+        entry.xp += xp_gain
+        entry.level = max(old_level, xp_to_level(entry.xp))
+        entry.messages += messages
+        entry.last_active = now.strftime("%Y-%m-%d %H:%M:%S")
+        entry.pending_xp += xp_gain
+        entry.pending_messages += messages
+        entry.pending_active = now
+        self._dirty.add((guild_id, user_id))
+
+        if len(self._dirty) >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+        return entry.xp, old_level, entry.level
+
+    async def add_messages(self, rows: list[tuple[int, int, int, int, int, datetime]]) -> None:
+        """Fold bulk deltas into resident users and write the rest straight through."""
+        direct = []
+        for row in rows:
+            user_id, guild_id, xp, messages, level, last_active = row
+            entry = self._entries.get((guild_id, user_id))
+            if entry is None:
+                direct.append(row)
+                continue
+            entry.xp += xp
+            entry.level = max(entry.level, level, xp_to_level(entry.xp))
+            entry.messages += messages
+            entry.pending_xp += xp
+            entry.pending_messages += messages
+            if entry.pending_active is None or entry.pending_active < last_active:
+                entry.pending_active = last_active
+            self._dirty.add((guild_id, user_id))
+        await self.db.add_messages(direct)
+
+    async def set_level(self, user_id: int, guild_id: int, level: int) -> None:
+        entry = await self._entry(user_id, guild_id)
+        entry.level = level
+        if entry.pending_active is None:
+            entry.pending_active = datetime.now(timezone.utc)
+        self._dirty.add((guild_id, user_id))
+
+    async def get_stats(self, user_id: int, guild_id: int) -> Optional[tuple[int, int, int, str]]:
+        entry = self._entries.get((guild_id, user_id))
+        if entry is not None:
+            return entry.xp, entry.level, entry.messages, entry.last_active
+        return await self.db.get_stats(user_id, guild_id)
+
+    async def get_leaderboard(self, guild_id: int, offset: int = 0, limit: int = 10) -> tuple[list[tuple[int, int]], int]:
+        # Rankings include buffered XP once it has been flushed
+        return await self.db.get_leaderboard(guild_id, offset, limit)
+
+    async def get_rank(self, user_id: int, guild_id: int) -> Optional[int]:
+        return await self.db.get_rank(user_id, guild_id)
+
+    async def iter_users(self, guild_id: Optional[int] = None, batch_size: int = 5000) -> AsyncIterator[list[tuple]]:
+        await self.flush()
+        async for batch in self.db.iter_users(guild_id, batch_size):
+            yield batch
+
+    async def import_users(
+        self,
+        batches: Iterable[list[tuple[int, int, int, int, int, Optional[datetime]]]],
+        mode: str = "replace",
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """Flush, import, then forget resident users so they are reloaded with the imported totals.
+
+        Users who chat during the import stay resident until evicted, showing totals
+        from before it; their buffered deltas are still added on top in the database.
+        """
+        await self.flush()
+        total = await self.db.import_users(batches, mode, progress)
+        for key in list(self._entries):
+            if not self._entries[key].dirty:
+                del self._entries[key]
+        return total
+
+    # Warm start
+    def hot_users(self) -> list[tuple[int, int, int, int, int, str]]:
+        """Resident users with nothing pending as (guild_id, user_id, xp, level, messages, last_active)."""
+        return [
+            (guild_id, user_id, entry.xp, entry.level, entry.messages, entry.last_active)
+            for (guild_id, user_id), entry in self._entries.items()
+            if not entry.dirty
+        ]
+
+    def seed(self, rows: Iterable[tuple[int, int, int, int, int, str]]) -> int:
+        """Make snapshot users resident without overwriting ones already loaded; return rows used."""
+        seeded = 0
+        for guild_id, user_id, xp, level, messages, last_active in rows:
+            if len(self._entries) >= self.max_entries:
+                break
+            if (guild_id, user_id) not in self._entries:
+                self._entries[(guild_id, user_id)] = _Entry(xp, level, messages, last_active)
+                seeded += 1
+        return seeded
+
+    def reconcile(
+        self, row: tuple[int, int, int, int, int, str], actual: Optional[tuple[int, int, int, str]]
+    ) -> bool:
+        """Correct a seeded user that disagrees with the database; return whether it did.
+
+        Anything buffered since seeding is kept on top of the database values.
+        """
+        guild_id, user_id, xp, level, messages, last_active = row
+        if actual is not None and (xp, level, messages, last_active) == actual:
+            return False
+        entry = self._entries.get((guild_id, user_id))
+        if entry is None:
+            return True
+        db_xp, db_level, db_messages, db_active = actual or (0, 0, 0, "")
+        entry.xp += db_xp - xp
+        entry.messages += db_messages - messages
+        entry.level = max(db_level, xp_to_level(entry.xp)) if entry.dirty else db_level
+        if not entry.dirty:
+            entry.last_active = db_active
+        return True
+
+    async def flush(self) -> int:
+        """Write all pending deltas in one bulk statement, return the number of rows written."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            rows = []
+            for guild_id, user_id in keys:
+                entry = self._entries[(guild_id, user_id)]
+                rows.append((
+                    user_id, guild_id, entry.pending_xp, entry.pending_messages, entry.level, entry.pending_active,
+                ))
+                entry.pending_xp = 0
+                entry.pending_messages = 0
+                entry.pending_active = None
+
+            try:
+                await self.db.add_messages(rows)
+            except Exception:
+                # Put the deltas back so the next flush retries them
+                for user_id, guild_id, xp, messages, _, last_active in rows:
+                    entry = self._entries[(guild_id, user_id)]
+                    entry.pending_xp += xp
+                    entry.pending_messages += messages
+                    if entry.pending_active is None or entry.pending_active < last_active:
+                        entry.pending_active = last_active
+                    self._dirty.add((guild_id, user_id))
+                raise
+
+            self._evict()
+            logger.debug("Flushed %d buffered XP rows", len(rows))
+            return len(rows)
+
+    def _evict(self) -> None:
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        for key in list(self._entries):
+            if excess <= 0:
+                break
+            if not self._entries[key].dirty:
+                del self._entries[key]
+                excess -= 1
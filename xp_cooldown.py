@@ -0,0 +1,50 @@
+import time
+from typing import Optional
+
+
+class XPCooldown:
+    """At most one XP grant per (guild_id, user_id) every `window` seconds.
+
+    Only the last grant time is kept per active user, plus a counter for users who
+    sent messages during their cooldown; those messages are credited with the next
+    grant or returned by evict()/drain() so the message count stays exact.
+    """
+
+    __slots__ = ("window", "_last_grant", "_pending")
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self._last_grant: dict[tuple[int, int], float] = {}
+        self._pending: dict[tuple[int, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._last_grant)
+
+    def hit(self, guild_id: int, user_id: int, now: Optional[float] = None) -> int:
+        """Record a message; return how many messages to credit with an XP grant, or 0 if on cooldown."""
+        now = time.monotonic() if now is None else now
+        key = (guild_id, user_id)
+        last = self._last_grant.get(key)
+        if last is not None and now - last < self.window:
+            self._pending[key] = self._pending.get(key, 0) + 1
+            return 0
+        self._last_grant[key] = now
+        return self._pending.pop(key, 0) + 1
+
+    def evict(self, now: Optional[float] = None) -> list[tuple[int, int, int]]:
+        """Forget users whose cooldown has expired; return their uncredited (guild_id, user_id, messages)."""
+        now = time.monotonic() if now is None else now
+        expired = [key for key, last in self._last_grant.items() if now - last >= self.window]
+        leftovers = []
+        for key in expired:
+            del self._last_grant[key]
+            pending = self._pending.pop(key, 0)
+            if pending:
+                leftovers.append((key[0], key[1], pending))
+        return leftovers
+
+    def drain(self) -> list[tuple[int, int, int]]:
+        """Return and clear every uncredited message count."""
+        leftovers = [(guild_id, user_id, count) for (guild_id, user_id), count in self._pending.items()]
+        self._pending.clear()
+        return leftovers